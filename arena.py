@@ -0,0 +1,361 @@
+#!/usr/bin/python
+"""Parse trees kept as rows of typed arrays instead of Node objects.
+
+   An Arena has one row per node and a column per field: its kind, RULE or
+   TOKEN as in astfile, its data and type as ids in one table of interned
+   strings, 0 standing for None, its line, the offsets of its token, -1
+   for none, and the rows of its parent, first child, last child and next
+   sibling, -1 for none. A tree of a million nodes is a dozen arrays rather
+   than a million objects, so it takes a fraction of the memory, costs the
+   garbage collector nothing and pickles as a few strings.
+
+   ArenaNode is a view of a row with the data, type, line, children and
+   parent of a Node, and the traversals and writers of Node, so code that
+   reads trees works on either. Views are made when asked for and hold
+   nothing but the arena and the row. fromNode and Arena.toNode convert
+   between the two, and ArenaBuilder builds an arena straight from the
+   events of the table engine.
+"""
+
+from astfile import RULE, TOKEN
+from tableparser import Handler, ACTIONS, SPECIAL, WRAPPERS, PUSH, POP, \
+    CALL
+from tree import Node
+from array import array
+import zlib
+
+
+# the columns of an arena, with their typecodes
+COLUMNS = [('kinds', 'B'), ('datas', 'i'), ('types', 'i'), ('lines', 'i'),
+           ('starts', 'i'), ('ends', 'i'), ('parents', 'i'),
+           ('firsts', 'i'), ('lasts', 'i'), ('nexts', 'i')]
+
+
+def kindOf(data):
+    """Returns RULE for the data of a '#rule#' node, else TOKEN."""
+    if isinstance(data, str) and len(data) > 2 and data[0] == '#' and \
+       data[-1] == '#':
+        return RULE
+    return TOKEN
+
+
+class Arena(object):
+    """The nodes of a tree as rows of parallel arrays. The root is row 0."""
+
+    def __init__(self):
+        """Constructor for an empty arena."""
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.strings = [None]
+        self.ids = {None: 0}
+        # the kind of a node with each string as its data
+        self.stringKinds = [TOKEN]
+
+    def __len__(self):
+        """Returns the number of nodes."""
+        return len(self.kinds)
+
+    def intern(self, value):
+        """Returns the id of a string in the string table, adding it if it
+           is new."""
+        id = self.ids.get(value)
+        if id is None:
+            id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+            self.stringKinds.append(kindOf(value))
+        return id
+
+    def add(self, data, line=1, type=None, parent=-1, start=None, end=None):
+        """Adds a node as the last child of the row parent, or as a root if
+           parent is -1, and returns its row."""
+        row = len(self.kinds)
+        ids = self.ids
+        data = ids.get(data) or self.intern(data)
+        self.kinds.append(self.stringKinds[data])
+        self.datas.append(data)
+        self.types.append(ids.get(type) or self.intern(type))
+        self.lines.append(line)
+        self.starts.append(-1 if start is None else start)
+        self.ends.append(-1 if end is None else end)
+        self.parents.append(parent)
+        self.firsts.append(-1)
+        self.lasts.append(-1)
+        self.nexts.append(-1)
+        if parent >= 0:
+            last = self.lasts[parent]
+            if last < 0:
+                self.firsts[parent] = row
+            else:
+                self.nexts[last] = row
+            self.lasts[parent] = row
+        return row
+
+    def addTree(self, root, parent=-1):
+        """Adds the subtree of a Node under the row parent, or as a root,
+           and returns the row of its root."""
+        rows = {}
+        for node in root.iterPreorder():
+            above = parent if node is root else rows[id(node.parent)]
+            rows[id(node)] = self.add(node.data, node.line, node.type, above,
+                                      node.start, node.end)
+        return rows[id(root)]
+
+    def data(self, row):
+        return self.strings[self.datas[row]]
+
+    def type(self, row):
+        return self.strings[self.types[row]]
+
+    def setType(self, row, type):
+        """Changes the type of a node."""
+        self.types[row] = self.intern(type)
+
+    def childRows(self, row):
+        """Returns the rows of a node's children."""
+        rows = []
+        child = self.firsts[row]
+        nexts = self.nexts
+        while child >= 0:
+            rows.append(child)
+            child = nexts[child]
+        return rows
+
+    def iterRows(self, row=0):
+        """Generator over the rows of a node's subtree in preorder."""
+        firsts = self.firsts
+        nexts = self.nexts
+        yield row
+        # the next sibling of each node on the path down, innermost last
+        stack = []
+        child = firsts[row]
+        while True:
+            if child < 0:
+                if not stack:
+                    return
+                child = stack.pop()
+                continue
+            yield child
+            stack.append(nexts[child])
+            child = firsts[child]
+
+    def node(self, row):
+        """Returns a view of a row."""
+        return ArenaNode(self, row)
+
+    def root(self):
+        """Returns a view of the root."""
+        return ArenaNode(self, 0)
+
+    def toNode(self, row=0):
+        """Returns the subtree of a row as Node objects."""
+        strings = self.strings
+        datas = self.datas
+        types = self.types
+        lines = self.lines
+        starts = self.starts
+        ends = self.ends
+        parents = self.parents
+        nodes = {}
+        top = None
+        for current in self.iterRows(row):
+            start = starts[current]
+            end = ends[current]
+            node = nodes[current] = Node(
+                strings[datas[current]], lines[current],
+                strings[types[current]], None if start < 0 else start,
+                None if end < 0 else end)
+            if current == row:
+                top = node
+            else:
+                nodes[parents[current]].addChild(node)
+        return top
+
+    def bytes(self):
+        """Returns the memory held by the columns, not counting the string
+           table, which the strings of a Node tree hold too."""
+        return sum(getattr(self, name).buffer_info()[1] *
+                   getattr(self, name).itemsize for name, typecode in COLUMNS)
+
+    def __getstate__(self):
+        """Pickles the columns as strings compressed with zlib, which
+           takes them down to a fraction of their size quickly since most
+           of them change little from one row to the next."""
+        return (self.strings, [zlib.compress(getattr(self, name).tostring(), 1)
+                               for name, typecode in COLUMNS])
+
+    def __setstate__(self, state):
+        """Restores a pickled arena."""
+        self.strings, columns = state
+        self.ids = dict((value, id) for id, value in enumerate(self.strings))
+        self.stringKinds = map(kindOf, self.strings)
+        for (name, typecode), data in zip(COLUMNS, columns):
+            values = array(typecode)
+            values.fromstring(zlib.decompress(data))
+            setattr(self, name, values)
+
+
+def fromNode(root):
+    """Returns an Arena holding the subtree of a Node."""
+    arena = Arena()
+    arena.addTree(root)
+    return arena
+
+
+class ArenaNode(object):
+    """A view of a row of an Arena that reads like a Node. Views of the
+       same row are equal."""
+
+    __slots__ = ('arena', 'row')
+
+    def __init__(self, arena, row):
+        self.arena = arena
+        self.row = row
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and other.arena is self.arena \
+            and other.row == self.row
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.row)
+
+    data = property(lambda self: self.arena.data(self.row))
+    line = property(lambda self: self.arena.lines[self.row])
+    kind = property(lambda self: self.arena.kinds[self.row])
+    start = property(lambda self: self.arena.starts[self.row]
+                     if self.arena.starts[self.row] >= 0 else None)
+    end = property(lambda self: self.arena.ends[self.row]
+                   if self.arena.ends[self.row] >= 0 else None)
+
+    def getType(self):
+        return self.arena.type(self.row)
+
+    def setType(self, type):
+        self.arena.setType(self.row, type)
+
+    type = property(getType, setType)
+
+    @property
+    def parent(self):
+        """A view of the parent, None for a root."""
+        parent = self.arena.parents[self.row]
+        if parent < 0:
+            return None
+        return ArenaNode(self.arena, parent)
+
+    @property
+    def children(self):
+        """A list of views of the node's children."""
+        arena = self.arena
+        return [ArenaNode(arena, row) for row in arena.childRows(self.row)]
+
+    def addChild(self, node):
+        """Copies a Node and its subtree in as the last child and returns
+           a view of it."""
+        return ArenaNode(self.arena, self.arena.addTree(node, self.row))
+
+    def iterPreorder(self, predicate=None, prune=None):
+        """Generator over views of the node's subtree in preorder, read
+           straight from the columns unless predicate or prune is given,
+           see Node.iterPreorder."""
+        if predicate is not None or prune is not None:
+            for node in Node.__dict__['iterPreorder'](self, predicate, prune):
+                yield node
+            return
+        arena = self.arena
+        for row in arena.iterRows(self.row):
+            yield ArenaNode(arena, row)
+
+    def toNode(self):
+        """Returns the node's subtree as Node objects."""
+        return self.arena.toNode(self.row)
+
+    # the rest of Node's reading interface works on views as it is
+    iterPostorder = Node.__dict__['iterPostorder']
+    iterLevelorder = Node.__dict__['iterLevelorder']
+    preorder = Node.__dict__['preorder']
+    postorder = Node.__dict__['postorder']
+    span = Node.__dict__['span']
+    walk = Node.__dict__['walk']
+    write = Node.__dict__['write']
+    __str__ = Node.__dict__['__str__']
+
+
+class ArenaBuilder(Handler):
+    """Builds an Arena from the events of a TableParser, the same tree
+       tableparser.TreeBuilder builds out of Nodes. A '#rule#' node is only
+       added once something goes under it, so empty ones never take a row.
+       Tokens have no offsets in the table engine's trees."""
+
+    def __init__(self):
+        """Constructor. The tree is in arena once the parse is done."""
+        self.arena = Arena()
+        # the rows that new nodes are added under, innermost last, with
+        # ('#rule#', line) for a '#rule#' node that has no row yet
+        self.nodes = []
+        # the rules being parsed and how many nodes were open when each
+        # rule's own nodes started
+        self.frames = []
+
+    def open(self):
+        """Returns the row new nodes go under, adding the '#rule#' nodes
+           waiting for their first child."""
+        nodes = self.nodes
+        if not isinstance(nodes[-1], tuple):
+            return nodes[-1]
+        first = len(nodes) - 1
+        while isinstance(nodes[first - 1], tuple):
+            first -= 1
+        for index in xrange(first, len(nodes)):
+            data, line = nodes[index]
+            nodes[index] = self.arena.add(data, line, None, nodes[index - 1])
+        return nodes[-1]
+
+    def enter(self, rule, line):
+        """Starts a rule, opening a '#rule#' node if it has one."""
+        nodes = self.nodes
+        if rule in SPECIAL:
+            if rule == 'program':
+                nodes.append(self.arena.add('#PGRM#'))
+            else:
+                # an assignment goes next to the id, not under it
+                del nodes[self.frames[-1][1]:]
+        wrapper = WRAPPERS.get(rule)
+        if wrapper is not None:
+            nodes.append((wrapper, line))
+        self.frames.append((rule, len(nodes)))
+
+    def exit(self, rule, line):
+        """Ends a rule, closing the nodes it left open."""
+        nodes = self.nodes
+        depth = self.frames.pop()[1]
+        if rule == 'if':
+            self.arena.add('#EndIf#', line, None, nodes[depth])
+        if len(nodes) > depth:
+            del nodes[depth:]
+        if rule in WRAPPERS:
+            nodes.pop()
+
+    def token(self, kind, text, line):
+        """Adds the row for a token, if its rule has one."""
+        rule, depth = self.frames[-1]
+        action = ACTIONS.get((rule, kind))
+        if action is None:
+            return
+        action, data, type = action
+        nodes = self.nodes
+        if action == POP:
+            nodes.pop()
+            return
+        if action == CALL:
+            if len(nodes) > depth:
+                # the id of a call is open
+                self.arena.setType(nodes[-1], 'procCall')
+                return
+            action = PUSH
+        row = self.arena.add(text if data is None else data, line, type,
+                             self.open())
+        if action == PUSH:
+            nodes.append(row)
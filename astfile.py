@@ -0,0 +1,304 @@
+#!/usr/bin/python
+"""A compact binary encoding of parse trees.
+
+   A file starts with a fixed size header:
+
+       magic        8 bytes  'ICE9AST\0'
+       version      uint16
+       reserved     uint16
+       nodes        uint32   number of nodes
+       strings      uint32   number of strings in the string table
+       blob         uint32   size of the string table's text in bytes
+       checksum     uint32   CRC-32 of everything after the header
+
+   followed by the string table (strings + 1 uint32 offsets into the text
+   and the text itself, padded to 4 bytes) and one fixed width column per
+   node field, each holding the nodes in preorder:
+
+       kind         uint8    RULE for '#rule#' wrapper nodes, else TOKEN
+                             (padded to 4 bytes)
+       data         uint32   string id of data, 0 for None
+       type         uint32   string id of type, 0 for None
+       line         uint32
+       end          uint32   preorder index just past the node's subtree
+       start offset uint32   source offset of the node's token, NONE if
+                             it stands for no token
+       end offset   uint32   source offset just past the token, or NONE
+
+   A node's children start right after it and each child's subtree ends
+   where its next sibling starts, so the end column is all it takes to
+   walk the tree. All numbers are little endian.
+"""
+
+from tree import Node
+from array import array
+import mmap
+import struct
+import sys
+import zlib
+
+
+MAGIC = 'ICE9AST\0'
+VERSION = 2
+HEADER = struct.Struct('<8sHHIIII')
+
+# the offset column value of a node without offsets
+NONE = 0xffffffff
+
+# node kinds
+RULE, TOKEN = range(2)
+
+
+class FormatError(Exception):
+    """Raised when data is not a valid binary tree of a known version."""
+    pass
+
+
+def pad(size):
+    """Returns size rounded up to a multiple of 4."""
+    return (size + 3) & ~3
+
+
+def column(typecode, values):
+    """Returns values packed as a little endian array."""
+    values = array(typecode, values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tostring()
+
+
+def dumps(node):
+    """Returns the binary encoding of the node's subtree."""
+    strings = {None: 0}
+    texts = []
+    kinds = []
+    datas = []
+    types = []
+    lines = []
+    ends = []
+    starts = []
+    stops = []
+    stack = []
+
+    def intern(value):
+        id = strings.get(value)
+        if id is None:
+            id = strings[value] = len(strings)
+            texts.append(value)
+        return id
+
+    for index, current in enumerate(node.iterPreorder()):
+        # close the subtrees of the nodes that are not ancestors of current
+        while stack and stack[-1][0] is not current.parent:
+            ends[stack.pop()[1]] = index
+        data = current.data
+        if isinstance(data, str) and len(data) > 2 and \
+           data[0] == '#' and data[-1] == '#':
+            kinds.append(RULE)
+        else:
+            kinds.append(TOKEN)
+        datas.append(intern(data))
+        types.append(intern(current.type))
+        lines.append(current.line)
+        ends.append(0)
+        starts.append(NONE if current.start is None else current.start)
+        stops.append(NONE if current.end is None else current.end)
+        stack.append((current, index))
+    while stack:
+        ends[stack.pop()[1]] = len(ends)
+
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    blob = ''.join(texts)
+    body = ''.join([
+        column('I', offsets),
+        blob, '\0' * (pad(len(blob)) - len(blob)),
+        column('B', kinds), '\0' * (pad(len(kinds)) - len(kinds)),
+        column('I', datas),
+        column('I', types),
+        column('I', lines),
+        column('I', ends),
+        column('I', starts),
+        column('I', stops),
+        ])
+    header = HEADER.pack(MAGIC, VERSION, 0, len(kinds), len(texts),
+                         len(blob), zlib.crc32(body) & 0xffffffff)
+    return header + body
+
+
+def dump(node, fileobj):
+    """Writes the binary encoding of the node's subtree to a file."""
+    fileobj.write(dumps(node))
+
+
+class MappedTree(object):
+    """A binary tree read in place from a string or a memory mapped file.
+       Nothing is decoded up front, nodes and strings are read from the
+       buffer as they are visited."""
+
+    def __init__(self, source, verify=True):
+        """Constructor that checks the header and, if verify is true, the
+           checksum of the source buffer."""
+        if len(source) < HEADER.size:
+            raise FormatError("truncated header")
+        (magic, version, reserved, self.size, self.stringCount, blob,
+         checksum) = HEADER.unpack_from(source, 0)
+        if magic != MAGIC:
+            raise FormatError("not a binary ice9 tree")
+        if version != VERSION:
+            raise FormatError("unsupported version %d" % version)
+        self.buffer = source
+        self.offsets = HEADER.size
+        self.blob = self.offsets + 4 * (self.stringCount + 1)
+        self.kinds = self.blob + pad(blob)
+        self.datas = self.kinds + pad(self.size)
+        self.types = self.datas + 4 * self.size
+        self.lines = self.types + 4 * self.size
+        self.ends = self.lines + 4 * self.size
+        self.startOffsets = self.ends + 4 * self.size
+        self.endOffsets = self.startOffsets + 4 * self.size
+        if len(source) < self.endOffsets + 4 * self.size:
+            raise FormatError("truncated data")
+        body = buffer(self.buffer, HEADER.size,
+                      self.endOffsets + 4 * self.size - HEADER.size)
+        if verify and zlib.crc32(body) & 0xffffffff != checksum:
+            raise FormatError("checksum mismatch")
+        self.cache = {0: None}
+
+    def uint(self, start, index):
+        """Reads entry index of the uint32 column at offset start."""
+        return struct.unpack_from('<I', self.buffer, start + 4 * index)[0]
+
+    def string(self, id):
+        """Returns the string with the given id, None for id 0."""
+        if id not in self.cache:
+            start, end = struct.unpack_from('<II', self.buffer,
+                                            self.offsets + 4 * (id - 1))
+            self.cache[id] = self.buffer[self.blob + start:self.blob + end]
+        return self.cache[id]
+
+    def kind(self, index):
+        """Returns the kind of the node at the preorder index."""
+        return ord(self.buffer[self.kinds + index])
+
+    def data(self, index):
+        return self.string(self.uint(self.datas, index))
+
+    def type(self, index):
+        return self.string(self.uint(self.types, index))
+
+    def line(self, index):
+        return self.uint(self.lines, index)
+
+    def end(self, index):
+        return self.uint(self.ends, index)
+
+    def startOffset(self, index):
+        """Returns the source offset of the node's token, or None."""
+        offset = self.uint(self.startOffsets, index)
+        return None if offset == NONE else int(offset)
+
+    def endOffset(self, index):
+        """Returns the source offset just past the node's token, or None."""
+        offset = self.uint(self.endOffsets, index)
+        return None if offset == NONE else int(offset)
+
+    def childIndexes(self, index):
+        """Returns the preorder indexes of a node's children."""
+        children = []
+        child = index + 1
+        end = self.end(index)
+        while child < end:
+            children.append(child)
+            child = self.end(child)
+        return children
+
+    def __len__(self):
+        return self.size
+
+    def root(self):
+        """Returns a MappedNode for the root of the tree."""
+        return MappedNode(self, 0)
+
+    def columnArray(self, start, count):
+        """Reads count entries of the uint32 column at offset start into an
+           array in one go."""
+        values = array('I', self.buffer[start:start + 4 * count])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def toNode(self):
+        """Decodes the whole tree into Node objects and returns the root.
+           The columns are read in bulk rather than node by node."""
+        strings = [self.string(id) for id in xrange(self.stringCount + 1)]
+        datas = self.columnArray(self.datas, self.size)
+        types = self.columnArray(self.types, self.size)
+        lines = self.columnArray(self.lines, self.size)
+        ends = self.columnArray(self.ends, self.size)
+        starts = [None if offset == NONE else int(offset) for offset in
+                  self.columnArray(self.startOffsets, self.size)]
+        stops = [None if offset == NONE else int(offset) for offset in
+                 self.columnArray(self.endOffsets, self.size)]
+        root = None
+        stack = []
+        for index in xrange(self.size):
+            node = Node(strings[datas[index]], lines[index],
+                        strings[types[index]], starts[index], stops[index])
+            while stack and stack[-1][1] <= index:
+                stack.pop()
+            if stack:
+                stack[-1][0].addChild(node)
+            else:
+                root = node
+            stack.append((node, ends[index]))
+        return root
+
+
+class MappedNode(object):
+    """A read only view of one node of a MappedTree with the data, type,
+       line, start, end and children attributes of a Node."""
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    data = property(lambda self: self.tree.data(self.index))
+    type = property(lambda self: self.tree.type(self.index))
+    line = property(lambda self: self.tree.line(self.index))
+    kind = property(lambda self: self.tree.kind(self.index))
+    start = property(lambda self: self.tree.startOffset(self.index))
+    end = property(lambda self: self.tree.endOffset(self.index))
+
+    @property
+    def children(self):
+        """A list of views of the node's children."""
+        tree = self.tree
+        return [MappedNode(tree, index)
+                for index in tree.childIndexes(self.index)]
+
+
+def loads(data, verify=True):
+    """Returns a MappedTree reading the binary tree in data."""
+    return MappedTree(data, verify)
+
+
+def load(filename, verify=True):
+    """Memory maps a binary tree file and returns a MappedTree over it."""
+    f = open(filename, 'rb')
+    try:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    return MappedTree(source, verify)
+
+if __name__ == "__main__":
+    from scanner import ice9Scanner
+    from parser import ice9Parser
+    tree = ice9Parser().parse(ice9Scanner().scan(open(sys.argv[1]).read()))
+    data = dumps(tree)
+    print "%d nodes in %d bytes" % (len(loads(data)), len(data))
+    print loads(data).toNode()
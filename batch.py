@@ -0,0 +1,185 @@
+#!/usr/bin/python
+"""Scans and parses many ice9 files across a pool of processes.
+
+   python batch.py [options] files, directories or globs...
+
+   Each worker keeps one scanner and parser and handles files in chunks.
+   A file's result is what ice9.py --file would print for it, or with
+   --format summary just its token and node counts, and errors are
+   reported per file instead of ending the run. Results are printed as
+   files finish, or in the order given with --ordered, and throughput is
+   reported on stderr at the end.
+"""
+
+from scanner import ice9Scanner, LexicalError, mapFile
+from parser import ice9Parser, ENGINES, SyntaxError
+from cache import ParseCache
+from optparse import OptionParser
+from cStringIO import StringIO
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+
+# the scanner, parser and parse cache, if any, of a worker process
+scanner = None
+parser = None
+cache = None
+
+
+def setup(engine, directory=None):
+    """Creates the scanner and parser a process uses for all its files,
+       and a ParseCache keeping its results in directory if one is
+       given."""
+    global scanner, parser, cache
+    scanner = ice9Scanner()
+    parser = ice9Parser(engine)
+    cache = None if directory is None else ParseCache(directory)
+
+
+def process(job):
+    """Scans and parses one file. job is (index, path, format) and the
+       result is (index, path, error, tokens, nodes, text), where text is
+       what ice9.py prints for the file, or None for a summary."""
+    index, path, format = job
+    tokens = nodes = 0
+    error = text = None
+    try:
+        if cache is not None:
+            tree, tokens = cache.parse(mapFile(path), parser, scanner)
+        else:
+            buffer = scanner.scanFile(path)
+            tokens = len(buffer)
+            tree = parser.parseTokens(buffer)
+    except (LexicalError, SyntaxError), e:
+        error = str(e)
+    except (IOError, OSError), e:
+        error = e.strerror
+    except RuntimeError:
+        error = "nested too deeply"
+    else:
+        nodes = sum(1 for node in tree.iterPreorder())
+        if format != 'summary':
+            out = StringIO()
+            tree.write(out, format)
+            if format == 'tree':
+                out.write("\n")
+            text = out.getvalue()
+    if error is not None and format != 'summary':
+        text = error + "\n"
+    return index, path, error, tokens, nodes, text
+
+
+def expand(args, manifest=None):
+    """Returns the files named by args, in order. An argument can be a
+       file, a glob or a directory, which stands for the .ice9 files under
+       it. A manifest file, '-' for stdin, lists more paths one per line."""
+    names = list(args)
+    if manifest is not None:
+        f = sys.stdin if manifest == '-' else open(manifest)
+        try:
+            names.extend(line.strip() for line in f
+                         if line.strip() and not line.startswith('#'))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    paths = []
+    for name in names:
+        if os.path.isdir(name):
+            for root, dirs, files in os.walk(name):
+                dirs.sort()
+                paths.extend(os.path.join(root, file)
+                             for file in sorted(files)
+                             if file.endswith('.ice9'))
+        elif glob.has_magic(name):
+            paths.extend(sorted(glob.glob(name)))
+        else:
+            paths.append(name)
+    return paths
+
+
+def run(paths, format='summary', engine='recursive', jobs=None, chunk=None,
+        ordered=False, cache=None):
+    """Generator over the results of process for each path, using jobs
+       processes, all the CPUs by default, or this one if jobs is 1. chunk
+       is the number of files a worker is handed at a time. Parse results
+       are kept in the directory cache, if it is given."""
+    work = [(index, path, format) for index, path in enumerate(paths)]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1:
+        setup(engine, cache)
+        for job in work:
+            yield process(job)
+        return
+    if chunk is None:
+        # a few chunks per worker keeps them all busy to the end
+        chunk = max(1, min(64, len(work) // (jobs * 4)))
+    pool = multiprocessing.Pool(jobs, setup, (engine, cache))
+    try:
+        if ordered:
+            results = pool.imap(process, work, chunk)
+        else:
+            results = pool.imap_unordered(process, work, chunk)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    """Parses the files the command line names and reports on each one."""
+    options = OptionParser(
+        usage="%prog [options] files, directories or globs...")
+    options.add_option("--manifest", metavar="FILE",
+                       help="also parse the paths listed in FILE, - for stdin")
+    options.add_option("-j", "--jobs", type="int", metavar="N",
+                       help="use N processes (default one per CPU)")
+    options.add_option("--chunk", type="int", metavar="N",
+                       help="hand workers N files at a time")
+    options.add_option("--ordered", action="store_true", default=False,
+                       help="print results in the order the files were given")
+    options.add_option("--engine", default="recursive", choices=list(ENGINES),
+                       help="parse with the recursive descent or table engine")
+    options.add_option("--format", default="summary",
+                       choices=["summary", "tree", "sexp", "jsonl"],
+                       help="print a summary line per file, or what ice9.py "
+                            "prints for it as tree, sexp or jsonl")
+    options.add_option("--cache", metavar="DIR",
+                       help="keep parse results in DIR and reuse them while "
+                            "a file and the parser stay the same")
+    opts, args = options.parse_args()
+    paths = expand(args, opts.manifest)
+    if not paths:
+        options.error("no files to parse")
+
+    start = time.time()
+    failed = tokens = nodes = 0
+    for index, path, error, count, size, text in run(
+            paths, opts.format, opts.engine, opts.jobs, opts.chunk,
+            opts.ordered, opts.cache):
+        tokens += count
+        nodes += size
+        if error is not None:
+            failed += 1
+        if text is None:
+            if error is None:
+                print "%s: %d tokens, %d nodes" % (path, count, size)
+            else:
+                print "%s: %s" % (path, error)
+        else:
+            sys.stdout.write("==> %s <==\n" % path)
+            sys.stdout.write(text)
+    elapsed = time.time() - start
+    print >> sys.stderr, "%d files, %d failed, %d tokens, %d nodes in " \
+        "%.2fs: %.1f files/s, %d tokens/s" % (
+            len(paths), failed, tokens, nodes, elapsed,
+            len(paths) / elapsed, tokens / elapsed)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,939 @@
+#!/usr/bin/python
+"""Rough timing harness for the ice9 scanner and parser.
+
+   python bench.py parse [sizes...]
+   python bench.py scan [files...]
+   python bench.py tokens [files...]
+   python bench.py nodes [count]
+   python bench.py ast [files...]
+   python bench.py incremental [lines]
+   python bench.py engines [files...]
+   python bench.py expr [statements]
+   python bench.py events [files...]
+   python bench.py errors [sizes...]
+   python bench.py idents [files...]
+   python bench.py query [files...]
+   python bench.py arena [files...]
+   python bench.py rewrite [sizes...]
+   python bench.py cache [files...]
+   python bench.py suite [results.json [baseline.json]]
+   python bench.py server [runs]
+"""
+
+from parser import ice9Parser
+from scanner import ice9Scanner
+from tree import Node
+from re import Scanner
+from incremental import IncrementalParser
+from tableparser import Handler
+from tokens import ID
+from generate import Generator
+from cStringIO import StringIO
+from query import TreeIndex, Selector, matches, ancestry
+from rewrite import Pass, PassManager, REMOVE
+from cache import ParseCache, SOURCES, version
+import arena
+import astfile
+import client
+import cPickle
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import random
+import re
+import gc
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+
+# A program using every kind of token. The statements are repeated to
+# build inputs of any size.
+DECLARATIONS = """var a, b: int[10], flag: bool
+type vec = int[3]
+forward f(x: int): int
+proc f(x: int): int
+    # comments are skipped
+    if x <= 1 -> return; [] else -> f := x * f(x - 1); fi
+end
+"""
+STATEMENTS = """fa i := 0 to 9 -> a[i] := read; af
+do a[0] != 0 -> writes 'left'; a[0] := a[0] / 2 % 7; od
+iffy := ?flag; b >= -3; write "done";
+"""
+
+# Statements that are mostly operators, for timing expression parsing.
+EXPRESSIONS = """x := a + b * c - d / (e + f) % g;
+y[i + 1] := -x * -(y - 2) + f(a * b, c - d) - ?flag;
+write (a + b) * (c - d) < e * f + g * h - 100;
+z := 1 + 2 + 3 + 4 + 5 + 6 + 7 + 8 - 9 * 10 * 11 / 12 % 13;
+"""
+
+
+# Programs covering every rule of grammar.txt, for checking that the parsing
+# engines build the same trees.
+PROGRAMS = [
+    ';', '42;', "'mystring';", '(42);', '5+2;', '----2;', 'x+---2;',
+    '3/-2 + -3/-3 + x - 3 + y/2;', 'x <= 2; x = 1; x != 2; x >= 1; x > 0; x < 2 + 3 * 4;',
+    'x(); z(2, x, y); x[2][i + 1] := 2; x(x := 2 * y);', 'a := b := c;',
+    'write x + 2; writes 3 % 2; break; exit; return;',
+    'if (n < 1) + (n > 100) -> write "wrong"; exit; fi',
+    'if a -> b; [] c -> d; [] else -> e; f; fi',
+    'if a -> if b -> c; fi [] c -> d; fi',
+    'fa i := 0 to n -> a[i] := read; af',
+    'var k: int do k < 4 -> k := k + 1; od',
+    'var a, b: int[100][2], c: bool, d: int var e: string ;',
+    'type foo = int[3][4] type bar = foo ;',
+    'forward f(x: int, y, z: bool): int forward g() forward h(a: t) ;',
+    'proc error() write "x"; exit; end ;',
+    'proc f(x: int): int var y: int type t = int\n'
+    '  if x > 0 -> f := true; [] else -> f := false; fi\nend f(false);',
+    'proc g(a, b: int, c: bool) end g(1, ?c, -d);',
+    '\n\n4\n\t+2\n\n;\n\n', 'x := true; y := false; z := read;',
+    'proc h(n: int) do n > 0 -> fa i := 1 to n -> writes a[i][n]; af '
+    'n := n - 1; od end h(3);',
+    ]
+
+
+def sample(count):
+    """Returns a valid program with the sample statements repeated count
+       times."""
+    return DECLARATIONS + STATEMENTS * count
+
+
+def legacyScan(input):
+    """The original re.Scanner based tokenizer, kept as the reference for
+       checking and timing the compiled scanner."""
+    key = lambda scanner, token: ("KEY", token)
+    scanner = Scanner([
+        (r"[\n]", lambda scanner, token: ("NL", "NL")),
+        (r"\"[^\"\n]*\"", lambda scanner, token: ("STR", token)),
+        (r"\'[^\'\n]*\'", lambda scanner, token: ("STR", token)),
+        (r"\b(if|fi|else|do|od|fa|af|to|proc)\b", key),
+        (r"\b(end|return|forward|var|type|break)\b", key),
+        (r"\b(exit|true|false|writes|write|read)\b", key),
+        (r"[A-Za-z][A-Za-z0-9_]*", lambda scanner, token: ("ID", token)),
+        (r"\-\>|\(|\)|\[\]|\[|\]|;|:\=|:|\,",
+            lambda scanner, token: ("SYM", token)),
+        (r"\+|\-|\/|\*|\=|\%|!\=|\>=|\<=|\>|\<|\?",
+            lambda scanner, token: ("OP", token)),
+        (r"[0-9]+", lambda scanner, token: ("INT", token)),
+        (r"#.*(?=\n?)", None),
+        (r"[\t ]+", None),
+        ])
+    tokens, remainder = scanner.scan(input)
+    tokens.append(('EOF', 'EOF'))
+    return tokens
+
+
+def makeTokens(count):
+    """Returns a token list of roughly count tokens made of simple
+       assignment statements, one per line."""
+    line = [('ID', 'x'), ('SYM', ':='), ('ID', 'x'), ('OP', '+'),
+            ('INT', '1'), ('SYM', ';'), ('NL', 'NL')]
+    tokens = line * (count // len(line))
+    tokens.append(('EOF', 'EOF'))
+    return tokens
+
+
+def timeit(func, *args):
+    """Returns the wall clock time of a single call to func. Like the timeit
+       module, garbage collection is disabled while timing."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.time()
+        func(*args)
+        return time.time() - start
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def benchParse(sizes):
+    """Times parsing token lists of the given sizes. Linear behaviour shows
+       up as a constant time per token."""
+    p = ice9Parser()
+    print "%10s %10s %14s" % ('tokens', 'seconds', 'usec/token')
+    for size in sizes:
+        tokens = makeTokens(size)
+        elapsed = timeit(p.parse, tokens)
+        print "%10d %10.3f %14.3f" % (len(tokens), elapsed,
+                                      elapsed * 1e6 / len(tokens))
+
+
+def benchScan(files):
+    """Checks that the scanner produces the same tokens as the original
+       scanner on each input and compares their throughput."""
+    inputs = [open(name).read() for name in files] or [sample(2000)]
+    s = ice9Scanner()
+    print "%10s %14s %14s" % ('tokens', 'legacy tok/s', 'scan tok/s')
+    for input in inputs:
+        expected = legacyScan(input)
+        if s.scan(input) != expected:
+            print "token streams differ"
+            sys.exit(1)
+        # one long line, without its comments, read a chunk at a time
+        line = ' '.join(each.split('#')[0] for each in input.split('\n'))
+        if list(s.scanIter(StringIO(line), 4096)) != s.scan(line):
+            print "token streams differ on one line"
+            sys.exit(1)
+        before = timeit(legacyScan, input)
+        after = timeit(s.scan, input)
+        print "%10d %14d %14d" % (len(expected), len(expected) / before,
+                                  len(expected) / after)
+
+
+def tupleBytes(tokens):
+    """Approximate memory held by a list of token tuples. Shared strings,
+       like the category names, are only counted once."""
+    seen = set()
+    total = sys.getsizeof(tokens)
+    for token in tokens:
+        total += sys.getsizeof(token)
+        for text in token:
+            if id(text) not in seen:
+                seen.add(id(text))
+                total += sys.getsizeof(text)
+    return total
+
+
+def bufferBytes(tokens):
+    """Memory held by the arrays of a TokenBuffer, not counting the
+       source text it refers to."""
+    return (sys.getsizeof(tokens.kinds) + sys.getsizeof(tokens.starts) +
+            sys.getsizeof(tokens.ends))
+
+
+def benchTokens(files):
+    """Compares memory per token and parse time of token tuples with those
+       of a TokenBuffer."""
+    inputs = [open(name).read() for name in files] or [sample(2000)]
+    s = ice9Scanner()
+    p = ice9Parser()
+    print "%10s %12s %12s %12s %12s" % ('tokens', 'tuple B/tok',
+                                        'buffer B/tok', 'tuple parse',
+                                        'buffer parse')
+    for input in inputs:
+        tuples = s.scan(input)
+        buffer = s.scanBuffer(input)
+        print "%10d %12.1f %12.1f %12.3f %12.3f" % (
+            len(tuples), float(tupleBytes(tuples)) / len(tuples),
+            float(bufferBytes(buffer)) / len(buffer),
+            timeit(p.parse, tuples), timeit(p.parse, buffer))
+
+
+def makeTree(count):
+    """Returns the root of a tree of count nodes where every node has up
+       to four children."""
+    root = Node('root')
+    nodes = [root]
+    for i in xrange(1, count):
+        nodes.append(nodes[(i - 1) // 4].addChild(Node('node', i)))
+    return root
+
+
+def nodeBytes(node):
+    """Memory held by a single node, its child list and its parent link."""
+    total = sys.getsizeof(node) + sys.getsizeof(node.children)
+    if node.parentRef is not None:
+        total += sys.getsizeof(node.parentRef)
+    return total
+
+
+def benchNodes(count):
+    """Reports memory per node, the pause of a full garbage collection with
+       the tree alive and the time taken to free the tree."""
+    elapsed = timeit(makeTree, count)
+    root = makeTree(count)
+    leaf = root
+    while leaf.children:
+        leaf = leaf.children[-1]
+    print "nodes:            %d" % count
+    print "build:            %.3fs" % elapsed
+    print "bytes/node:       %d" % nodeBytes(leaf)
+    start = time.time()
+    gc.collect()
+    print "full gc pause:    %.3fs" % (time.time() - start)
+    start = time.time()
+    del root, leaf
+    gc.collect()
+    print "free tree:        %.3fs" % (time.time() - start)
+
+
+def benchAst(files):
+    """Checks that trees survive a round trip through the binary format and
+       compares its size and load time with those of pickle."""
+    inputs = [open(name).read() for name in files] or [sample(2000)]
+    s = ice9Scanner()
+    p = ice9Parser()
+    print "%10s %10s %10s %10s %10s %10s" % (
+        'nodes', 'ast bytes', 'pkl bytes', 'ast open', 'ast decode',
+        'pkl load')
+    for input in inputs:
+        tree = p.parse(s.scanBuffer(input))
+        data = astfile.dumps(tree)
+        pickled = cPickle.dumps(tree, 2)
+        copy = astfile.loads(data).toNode()
+        if str(copy) != str(tree):
+            print "round trip differs"
+            sys.exit(1)
+        if copy.span() != tree.span() or \
+           [(node.start, node.end) for node in copy.iterPreorder()] != \
+           [(node.start, node.end) for node in tree.iterPreorder()]:
+            print "round trip spans differ"
+            sys.exit(1)
+        print "%10d %10d %10d %10.4f %10.3f %10.3f" % (
+            len(astfile.loads(data)), len(data), len(pickled),
+            timeit(astfile.loads, data),
+            timeit(lambda: astfile.loads(data).toNode()),
+            timeit(cPickle.loads, pickled))
+
+
+def benchIncremental(lines):
+    """Times single character edits of a program of about the given number
+       of lines against scanning and parsing it in full. Edits in one place,
+       like typing, are timed apart from edits scattered over the file."""
+    source = sample(lines // STATEMENTS.count('\n'))
+    full = timeit(lambda: ice9Parser().parse(ice9Scanner().scanBuffer(source)))
+    doc = IncrementalParser(source)
+    rand = random.Random(9)
+    digit = source.index('9', len(source) // 2)
+    space = source.index(';', len(source) // 2) + 1
+    local = []
+    scattered = []
+    for i in xrange(100):
+        # retype a digit, and add and then remove a space after a ';'
+        local.extend([(digit, 1, '8'), (digit, 1, '9'),
+                      (space, 0, ' '), (space, 1, '')])
+        offset = source.index('9', rand.randrange(len(source) // 2))
+        scattered.extend([(offset, 1, '8'), (offset, 1, '9')])
+        offset = source.index(';', rand.randrange(len(source) // 2)) + 1
+        scattered.extend([(offset, 0, ' '), (offset, 1, '')])
+    doc.edit(*local[0])
+    doc.edit(*local[1])
+    typing = timeit(lambda: [doc.edit(*edit) for edit in local])
+    moving = timeit(lambda: [doc.edit(*edit) for edit in scattered])
+    print "lines:             %d" % source.count('\n')
+    print "full parse:        %.3fs" % full
+    print "edit in place:     %.2fms" % (typing * 1000 / len(local))
+    print "scattered edit:    %.2fms" % (moving * 1000 / len(scattered))
+
+
+def treeText(tree):
+    """Returns a tree as one JSON object per node."""
+    out = StringIO()
+    tree.write(out, 'jsonl')
+    return out.getvalue()
+
+
+def nesting(parser, template, limit=100000):
+    """Returns the deepest nesting the parser parses without running out of
+       stack, up to limit. template returns a program nested to a given
+       depth."""
+    def parses(depth):
+        tokens = ice9Scanner().scanBuffer(template(depth))
+        try:
+            parser.parse(tokens)
+        except RuntimeError:
+            return False
+        return True
+    low, high = 0, 1
+    while parses(high):
+        if high == limit:
+            return limit
+        low, high = high, min(high * 2, limit)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if parses(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def benchEngines(files):
+    """Checks that the recursive descent and table driven engines build the
+       same trees for PROGRAMS, a sample program and the given files, then
+       compares their throughput and how deeply nested a program each can
+       parse."""
+    programs = PROGRAMS + [sample(2)] + [open(name).read() for name in files]
+    differ = 0
+    for program in programs:
+        tokens = ice9Scanner().scanBuffer(program)
+        trees = [treeText(ice9Parser(engine).parse(tokens))
+                 for engine in ('recursive', 'table')]
+        if trees[0] != trees[1]:
+            differ += 1
+            print "trees differ for %r" % program[:60]
+    print "%d programs, %d differ" % (len(programs), differ)
+    if differ:
+        sys.exit(1)
+    tokens = ice9Scanner().scanBuffer(sample(3000))
+    print "%10s %14s %10s %10s" % ('engine', 'tokens/sec', 'parens', 'ifs')
+    for engine in ('recursive', 'table'):
+        elapsed = timeit(ice9Parser(engine).parse, tokens)
+        parens = nesting(ice9Parser(engine), lambda depth: '(' * depth + '1' +
+                         ')' * depth + ';')
+        ifs = nesting(ice9Parser(engine), lambda depth: 'if x -> ' * depth + 'x;' +
+                      ' fi' * depth)
+        print "%10s %14d %10d %10d" % (engine, len(tokens) / elapsed, parens,
+                                       ifs)
+
+
+def benchExpressions(count):
+    """Times parsing a program of count expression statements into the full
+       tree with either engine, into the compact expression tree and into
+       the tree with pass-through rule nodes elided, and a preorder walk of
+       each tree, and finds the longest chain of '+' and of unary '-' each
+       can parse."""
+    tokens = ice9Scanner().scanBuffer(EXPRESSIONS * (count // 4))
+    parsers = [('recursive', ice9Parser()), ('table', ice9Parser('table')),
+               ('compact', ice9Parser(compactExpr=True)),
+               ('elided', ice9Parser(compactTree=True))]
+    print "%10s %14s %10s %10s %10s %10s" % ('tree', 'tokens/sec', 'nodes',
+                                             'walk s', 'chain', 'negations')
+    for name, parser in parsers:
+        elapsed = timeit(parser.parse, tokens)
+        tree = parser.parse(tokens)
+        nodes = sum(1 for node in tree.iterPreorder())
+        walk = timeit(lambda: sum(1 for node in tree.iterPreorder()))
+        chain = nesting(parser, lambda depth: 'x := ' +
+                        ' + '.join(['a'] * (depth + 1)) + ';')
+        negations = nesting(parser, lambda depth: 'x := ' + '-' * depth +
+                            'a;')
+        print "%10s %14d %10d %10.3f %10d %10d" % (
+            name, len(tokens) / elapsed, nodes, walk, chain, negations)
+
+
+class Counter(Handler):
+    """A handler that counts the rules and tokens of a program and lists
+       its identifiers, the kind of tool that has no use for a tree."""
+
+    def __init__(self):
+        self.rules = {}
+        self.tokens = 0
+        self.ids = set()
+
+    def enter(self, rule, line):
+        self.rules[rule] = self.rules.get(rule, 0) + 1
+
+    def token(self, kind, text, line):
+        self.tokens += 1
+        if kind == ID:
+            self.ids.add(text)
+
+
+def benchEvents(files):
+    """Compares building a tree with either engine against consuming the
+       parse events with an empty handler, a Counter and a generator."""
+    inputs = [open(name).read() for name in files] or [sample(3000)]
+    p = ice9Parser()
+    table = ice9Parser('table')
+
+    def drain(tokens):
+        for event in p.events(tokens):
+            pass
+    ways = [('recursive tree', p.parse), ('table tree', table.parse),
+            ('no handler', lambda tokens: p.events(tokens, Handler())),
+            ('counter', lambda tokens: p.events(tokens, Counter())),
+            ('generator', drain)]
+    for input in inputs:
+        tokens = ice9Scanner().scanBuffer(input)
+        nodes = sum(1 for node in p.parse(tokens).iterPreorder())
+        print "%d tokens, %d nodes in the tree" % (len(tokens), nodes)
+        print "%16s %14s" % ('consumer', 'tokens/sec')
+        for name, way in ways:
+            print "%16s %14d" % (name, len(tokens) / timeit(way, tokens))
+
+
+def benchErrors(sizes):
+    """Times parseAll on samples of the given numbers of statement groups
+       with a syntax error in every group. Recovery is linear if the time
+       per token stays the same."""
+    p = ice9Parser()
+    broken = STATEMENTS.replace('a[0] / 2', 'a[0] / / 2').replace(
+        'write "done"', 'write "done" )')
+    print "%10s %10s %10s %14s" % ('tokens', 'errors', 'seconds',
+                                   'usec/token')
+    for size in sizes:
+        tokens = ice9Scanner().scanBuffer(DECLARATIONS + broken * size)
+        elapsed = timeit(p.parseAll, tokens, size * 2)
+        print "%10d %10d %10.3f %14.3f" % (len(tokens), len(p.diagnostics),
+                                           elapsed,
+                                           elapsed * 1e6 / len(tokens))
+
+
+def identifierBytes(nodes):
+    """Memory held by the names of the id nodes of a tree, once with each
+       distinct string counted once and once as if every node had its own
+       copy, as slicing the token's text gives it. Python shares strings of
+       one character, so those are only counted once either way."""
+    shared = {}
+    copies = 0
+    for node in nodes:
+        shared[id(node.data)] = sys.getsizeof(node.data)
+        if len(node.data) > 1:
+            copies += sys.getsizeof(node.data)
+    copies += sum(sys.getsizeof(chr(c)) for c in range(256)
+                  if chr(c) in set(node.data for node in nodes))
+    return sum(shared.values()), copies
+
+
+def indexBytes(symbols):
+    """Memory held by the number and node lists of a SymbolTable."""
+    total = sys.getsizeof(symbols.ids) + sys.getsizeof(symbols.names)
+    for index in (symbols.declared, symbols.used):
+        total += sys.getsizeof(index) + sum(map(sys.getsizeof, index))
+    return total
+
+
+def benchIdents(files):
+    """Reports the memory saved by interning the names of id nodes, net of
+       the cross reference index, and compares finding the uses of a name
+       in the index with walking the tree for them."""
+    inputs = [open(name).read() for name in files] or [
+        sample(2000), EXPRESSIONS * 2000,
+        Generator(seed=1, density=0.6).generate(100000)]
+    p = ice9Parser()
+    s = ice9Scanner()
+    print "%10s %8s %12s %12s %12s %12s %10s %10s" % (
+        'id nodes', 'names', 'copies B', 'interned B', 'index B',
+        'saved B/id', 'walk ms', 'lookup ms')
+    for input in inputs:
+        tree = p.parseTokens(s.scanBuffer(input))
+        symbols = p.symbols
+        nodes = [node for name in symbols.names
+                 for node in symbols.declarations(name) + symbols.uses(name)]
+        interned, copies = identifierBytes(nodes)
+        index = indexBytes(symbols)
+        name = max(symbols.names, key=lambda name: len(symbols.uses(name)))
+        walk = timeit(lambda: [node for node in tree.iterPreorder()
+                               if node.data == name])
+        lookup = timeit(symbols.uses, name)
+        print "%10d %8d %12d %12d %12d %12.1f %10.3f %10.3f" % (
+            len(nodes), len(symbols), copies, interned, index,
+            float(copies - interned - index) / len(nodes), walk * 1000,
+            lookup * 1000)
+
+
+# queries an analysis pass might make, for timing the index
+QUERIES = ['End > [type=procCall]', ':=', 'fa', 'proc faStm :=', 'do End',
+           'Stm > write', '"[]"']
+
+
+def walkSelect(root, selector):
+    """Finds the nodes matching a selector by walking the whole tree, the
+       way passes did without an index."""
+    selector = Selector(selector)
+    memo = {}
+    return [node for node in root.iterPreorder()
+            if matches(node, selector.compounds[-1]) and
+            ancestry(node, selector, len(selector.compounds) - 2, None, memo)]
+
+
+def benchQuery(files):
+    """Times building a TreeIndex and answering QUERIES with it against a
+       walk of the tree per query, and the cost of keeping an index up to
+       date while a tree is changed."""
+    inputs = [open(name).read() for name in files] or [sample(2000)]
+    p = ice9Parser()
+    s = ice9Scanner()
+    for input in inputs:
+        tokens = s.scanBuffer(input)
+        plain = min(timeit(p.parseTokens, tokens) for run in range(3))
+        tree = p.parseTokens(tokens)
+        nodes = sum(1 for node in tree.iterPreorder())
+        print "%d nodes, index built in %.3fs" % (nodes,
+                                                  timeit(TreeIndex, tree))
+        index = TreeIndex(tree)
+        print "%24s %8s %10s %10s" % ('query', 'matches', 'walk ms',
+                                      'index ms')
+        for query in QUERIES:
+            found = index.select(query)
+            if found != walkSelect(tree, query):
+                print "index and walk differ on %r" % query
+                sys.exit(1)
+            print "%24s %8d %10.2f %10.2f" % (
+                query, len(found), timeit(walkSelect, tree, query) * 1000,
+                timeit(index.select, query) * 1000)
+        statements = index.kind('Stm')
+        moved = statements[::10]
+
+        def edit():
+            for node in moved:
+                node.addParent(Node('#Stm#', node.line))
+        watched = min(timeit(p.parseTokens, tokens) for run in range(3))
+        print "reparse %.3fs, with an index on another tree %.3fs" % (
+            plain, watched)
+        print "%d addParent calls with the index following: %.3fs, " \
+              "then a query %.3fs" % (len(moved), timeit(edit),
+                                      timeit(index.select, 'Stm'))
+
+
+def benchArena(files):
+    """Compares trees of Node objects with arenas: memory, not counting
+       the strings both share, build time with either engine, a preorder
+       traversal reading the data of each node, and the size and time of
+       pickling the tree for another process."""
+    inputs = [open(name).read() for name in files] or [sample(2000)]
+    recursive = ice9Parser()
+    table = ice9Parser('table')
+    for input in inputs:
+        tokens = ice9Scanner().scanBuffer(input)
+        tree = table.parseTokens(tokens)
+        columns = table.parseArena(tokens)
+        if str(columns.root()) != str(tree):
+            print "the arena and the tree differ"
+            sys.exit(1)
+        nodes = [node for node in tree.iterPreorder()]
+        print "%d nodes" % len(nodes)
+        print "%28s %12s %12s" % ('', 'Node', 'Arena')
+        print "%28s %12.1f %12.1f" % (
+            'bytes/node', float(sum(map(nodeBytes, nodes))) / len(nodes),
+            float(columns.bytes() + sys.getsizeof(columns.strings)) /
+            len(nodes))
+        print "%28s %12.3f %12.3f" % (
+            'table engine build s', timeit(table.parseTokens, tokens),
+            timeit(table.parseArena, tokens))
+        print "%28s %12.3f %12.3f" % (
+            'recursive build s', timeit(recursive.parseTokens, tokens),
+            timeit(recursive.parseArena, tokens))
+        print "%28s %12.3f %12.3f" % (
+            'preorder data s',
+            timeit(lambda: [node.data for node in tree.iterPreorder()]),
+            timeit(lambda: [columns.strings[columns.datas[row]]
+                            for row in columns.iterRows()]))
+        print "%28s %12s %12.3f" % (
+            'preorder views s', '',
+            timeit(lambda: [node.data for node in
+                            columns.root().iterPreorder()]))
+        print "%28s %12.3f %12.3f" % (
+            'convert s', timeit(arena.fromNode, tree), timeit(columns.toNode))
+        pickled = cPickle.dumps(tree, 2)
+        packed = cPickle.dumps(columns, 2)
+        print "%28s %12d %12d" % ('pickle bytes', len(pickled), len(packed))
+        print "%28s %12.3f %12.3f" % (
+            'pickle s', timeit(cPickle.dumps, tree, 2),
+            timeit(cPickle.dumps, columns, 2))
+        print "%28s %12.3f %12.3f" % (
+            'unpickle s', timeit(cPickle.loads, pickled),
+            timeit(cPickle.loads, packed))
+
+
+# the expression wrappers the rewrite benchmark splices out when they have
+# only one child
+WRAPPED = frozenset(['#Low#', '#Med#', '#High#'])
+
+
+def dropEndIfs(root):
+    for node in [node for node in root.iterPreorder()
+                 if node.data == '#EndIf#']:
+        node.remove()
+
+
+def unwrapExpressions(root):
+    for node in [node for node in root.iterPreorder()
+                 if node.data in WRAPPED and len(node.children) == 1]:
+        node.inPlaceRemove()
+
+
+def wrapStatements(root):
+    for node in [node for node in root.iterPreorder()
+                 if node.data == '#Stm#']:
+        node.addParent(Node('#Line#', node.line))
+
+
+def lineOf(node):
+    line = Node('#Line#', node.line)
+    line.addChild(node)
+    return line
+
+
+def rewritePasses():
+    """Returns a PassManager doing what dropEndIfs, unwrapExpressions and
+       wrapStatements do."""
+    single = lambda node: node.children if len(node.children) == 1 else None
+    return PassManager([Pass({'EndIf': lambda node: REMOVE}),
+                        Pass({'Low': single, 'Med': single, 'High': single}),
+                        Pass({'Stm': lineOf})])
+
+
+def benchRewrite(sizes):
+    """Times three rewrites of samples of the given numbers of statement
+       groups, run one after the other with a walk each and the mutation
+       methods of Node, against a PassManager running them in one walk.
+       The statements of a sample are siblings, so the methods, which look
+       a node up among its siblings, take time growing with the square of
+       the size."""
+    p = ice9Parser()
+    manager = rewritePasses()
+    print "%10s %10s %12s %12s" % ('size', 'nodes', 'one by one s',
+                                   'fused s')
+    for size in sizes:
+        tokens = ice9Scanner().scanBuffer(sample(size))
+        trees = [p.parseTokens(tokens), p.parseTokens(tokens)]
+        nodes = sum(1 for node in trees[0].iterPreorder())
+
+        def sequential():
+            for rewrite in (dropEndIfs, unwrapExpressions, wrapStatements):
+                rewrite(trees[0])
+        one = timeit(sequential)
+        fused = timeit(manager.run, trees[1])
+        if str(trees[0]) != str(trees[1]):
+            print "the rewrites differ"
+            sys.exit(1)
+        print "%10d %10d %12.3f %12.3f" % (size, nodes, one, fused)
+
+
+def checkCacheVersion():
+    """Checks that cache.SOURCES has every module the parse imports from
+       this directory and that changing any of them changes the key of a
+       parse. Exits with status 1 if not."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    local = set(name for name in os.listdir(here) if name.endswith('.py'))
+    sources = set(SOURCES)
+    for name in SOURCES:
+        if not name.endswith('.py'):
+            continue
+        text = open(os.path.join(here, name)).read()
+        for module in re.findall(r"^(?:from|import) (\w+)", text, re.M):
+            if module + '.py' in local and module + '.py' not in sources:
+                print "%s imports %s, which is not in cache.SOURCES" % (
+                    name, module)
+                sys.exit(1)
+    directory = tempfile.mkdtemp()
+    p = ice9Parser()
+    source = sample(10)
+    key = ParseCache().key(source, p)
+    try:
+        for name in SOURCES:
+            for each in SOURCES:
+                shutil.copy(os.path.join(here, each), directory)
+            f = open(os.path.join(directory, name), 'ab')
+            f.write('\n')
+            f.close()
+            changed = ParseCache()
+            changed.version = version(directory)
+            if changed.key(source, p) == key:
+                print "changing %s leaves the cache key the same" % name
+                sys.exit(1)
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchCache(files):
+    """Times scanning and parsing each input against a ParseCache missing,
+       which parses and stores the result, and hitting in memory and on
+       disk, the last with a new cache as another process would have. The
+       keys are checked first with checkCacheVersion."""
+    checkCacheVersion()
+    inputs = [open(name).read() for name in files] or \
+        [sample(10), sample(100), sample(1000)]
+    directory = tempfile.mkdtemp()
+    p = ice9Parser()
+    s = ice9Scanner()
+    try:
+        print "%10s %10s %10s %10s %10s %10s" % (
+            'bytes', 'parse s', 'miss s', 'memory s', 'disk s', 'file')
+        for input in inputs:
+            parse = timeit(lambda: p.parseTokens(s.scanBuffer(input)))
+            cache = ParseCache(directory)
+            miss = timeit(cache.parse, input, p, s)
+            memory = timeit(cache.parse, input, p, s)
+            disk = timeit(ParseCache(directory).parse, input, p, s)
+            size = os.path.getsize(cache.path(cache.key(input, p)))
+            print "%10d %10.3f %10.3f %10.3f %10.3f %10d" % (
+                len(input), parse, miss, memory, disk, size)
+    finally:
+        shutil.rmtree(directory)
+
+
+# The tiers of the benchmark suite: name, tokens to generate, generator seed
+# and how many runs the best time is taken from.
+TIERS = [('small', 1000, 1, 5), ('medium', 10000, 2, 3),
+         ('large', 100000, 3, 3), ('huge', 1000000, 4, 1)]
+
+# slowdown or memory growth over a baseline that counts as a regression,
+# above the noise between runs on one machine
+TOLERANCE = 0.15
+
+
+def measureTier(name, size, seed, runs):
+    """Generates the program of a tier and measures scanning and parsing
+       it. Run in a process of its own, so the peak memory is the tier's."""
+    source = Generator(seed=seed).generate(size)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tokens = ice9Scanner().scan(source)
+    scan = min(timeit(ice9Scanner().scan, source) for run in xrange(runs))
+    p = ice9Parser()
+    parse = min(timeit(p.parse, tokens) for run in xrange(runs))
+    tree = p.parse(tokens)
+    return {
+        'name': name, 'size': size, 'seed': seed,
+        'bytes': len(source), 'checksum': zlib.crc32(source) & 0xffffffff,
+        'tokens': len(tokens),
+        'nodes': sum(1 for node in tree.iterPreorder()),
+        'scan_tokens_per_sec': len(tokens) / scan,
+        'parse_tokens_per_sec': len(tokens) / parse,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                     before,
+        }
+
+
+def runSuite():
+    """Runs every tier in TIERS and returns the results."""
+    tiers = []
+    for name, size, seed, runs in TIERS:
+        pool = multiprocessing.Pool(1)
+        try:
+            tiers.append(pool.apply(measureTier, (name, size, seed, runs)))
+        finally:
+            pool.close()
+            pool.join()
+    return {'python': sys.version.split()[0], 'tiers': tiers}
+
+
+def compareSuite(results, baseline):
+    """Prints how each tier did against the baseline and returns the number
+       of regressions: throughput down or peak memory up by more than
+       TOLERANCE, or a different tree for the same input. Tiers whose input
+       changed are not compared."""
+    old = dict((tier['name'], tier) for tier in baseline['tiers'])
+    regressions = 0
+    print "%8s %12s %12s %12s" % ('tier', 'scan', 'parse', 'peak memory')
+    for tier in results['tiers']:
+        before = old.get(tier['name'])
+        if before is None or before['checksum'] != tier['checksum']:
+            print "%8s %38s" % (tier['name'], 'different input, not compared')
+            continue
+        changes = []
+        for key, worse in (('scan_tokens_per_sec', -1),
+                           ('parse_tokens_per_sec', -1), ('peak_kb', 1)):
+            change = float(tier[key]) / before[key] - 1
+            flag = ' '
+            if change * worse > TOLERANCE:
+                flag = '!'
+                regressions += 1
+            changes.append("%+10.1f%%%s" % (change * 100, flag))
+        print "%8s %s" % (tier['name'], ' '.join(changes))
+        if tier['nodes'] != before['nodes']:
+            print "%8s %d nodes instead of %d" % ('', tier['nodes'],
+                                                  before['nodes'])
+            regressions += 1
+    return regressions
+
+
+def benchSuite(output=None, baseline=None):
+    """Times scanning and parsing generated programs of each size tier,
+       optionally saves the results as JSON and compares them with the
+       results of an earlier run. Exits with 1 on a regression."""
+    results = runSuite()
+    print "%8s %10s %10s %14s %14s %10s" % ('tier', 'tokens', 'nodes',
+                                            'scan tok/s', 'parse tok/s',
+                                            'peak KB')
+    for tier in results['tiers']:
+        print "%8s %10d %10d %14d %14d %10d" % (
+            tier['name'], tier['tokens'], tier['nodes'],
+            tier['scan_tokens_per_sec'], tier['parse_tokens_per_sec'],
+            tier['peak_kb'])
+    if output is not None:
+        f = open(output, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if baseline is not None:
+        f = open(baseline)
+        try:
+            regressions = compareSuite(results, json.load(f))
+        finally:
+            f.close()
+        if regressions:
+            print "%d regressions" % regressions
+            sys.exit(1)
+
+
+def command(args, source, env=None):
+    """Returns the wall clock time of running a command on source."""
+    start = time.time()
+    process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, env=env)
+    process.communicate(source)
+    return time.time() - start
+
+
+def benchServer(runs):
+    """Compares the latency of starting ice9.py for each source with
+       client.py and with a request on an open connection to a server.py
+       with one worker. Times are the median of runs in milliseconds."""
+    path = os.path.join(tempfile.mkdtemp(), 'ice9.sock')
+    here = os.path.dirname(os.path.abspath(__file__))
+    python = sys.executable
+    server = subprocess.Popen([python, os.path.join(here, 'server.py'),
+                               '--socket', path, '--jobs', '1'])
+    try:
+        while not os.path.exists(path):
+            time.sleep(0.05)
+        env = dict(os.environ, ICE9_SOCKET=path)
+        conn = client.connect(path)
+        ice9 = [python, os.path.join(here, 'ice9.py')]
+        thin = [python, os.path.join(here, 'client.py')]
+        print "%10s %12s %12s %12s" % ('tokens', 'ice9.py', 'client.py',
+                                       'connection')
+        for count in (1, 100, 1000):
+            source = sample(count)
+            tokens = len(ice9Scanner().scanBuffer(source))
+            times = []
+            for way in (lambda: command(ice9, source),
+                        lambda: command(thin, source, env),
+                        lambda: timeit(client.request, conn, [], source)):
+                times.append(sorted(way() for run in range(runs))[runs // 2])
+            print "%10d %12.1f %12.1f %12.1f" % (
+                tokens, times[0] * 1000, times[1] * 1000, times[2] * 1000)
+        conn.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] == 'parse':
+        benchParse([int(arg) for arg in sys.argv[2:]] or
+                   [10000, 100000, 1000000])
+    elif sys.argv[1] == 'scan':
+        benchScan(sys.argv[2:])
+    elif sys.argv[1] == 'tokens':
+        benchTokens(sys.argv[2:])
+    elif sys.argv[1] == 'nodes':
+        benchNodes(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif sys.argv[1] == 'ast':
+        benchAst(sys.argv[2:])
+    elif sys.argv[1] == 'incremental':
+        benchIncremental(int(sys.argv[2]) if len(sys.argv) > 2 else 50000)
+    elif sys.argv[1] == 'engines':
+        benchEngines(sys.argv[2:])
+    elif sys.argv[1] == 'expr':
+        benchExpressions(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+    elif sys.argv[1] == 'events':
+        benchEvents(sys.argv[2:])
+    elif sys.argv[1] == 'errors':
+        benchErrors([int(arg) for arg in sys.argv[2:]] or [1000, 10000])
+    elif sys.argv[1] == 'idents':
+        benchIdents(sys.argv[2:])
+    elif sys.argv[1] == 'query':
+        benchQuery(sys.argv[2:])
+    elif sys.argv[1] == 'arena':
+        benchArena(sys.argv[2:])
+    elif sys.argv[1] == 'rewrite':
+        benchRewrite([int(arg) for arg in sys.argv[2:]] or [1000, 4000])
+    elif sys.argv[1] == 'cache':
+        benchCache(sys.argv[2:])
+    elif sys.argv[1] == 'suite':
+        benchSuite(*sys.argv[2:4])
+    elif sys.argv[1] == 'server':
+        benchServer(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,368 @@
+#!/usr/bin/python
+"""Keeps the results of parses so unchanged sources are not parsed again.
+
+   A ParseCache finds a result by the SHA-1 of the source together with
+   VERSION, a hash of the code and grammar the trees come from, and the
+   engine and options of the parser, so editing the source, updating the
+   parser or asking for another kind of tree each give a different key.
+   Sources that fail to scan or parse are not kept.
+
+   The memory tier keeps the results used most recently, up to a number of
+   tokens, which the size of their trees follows. A hit there returns the
+   very tree given out before, so callers that change trees, including
+   with ice9Parser.fullTree, should leave it off or parse for themselves.
+
+   The disk tier is a directory with a file per key, which any number of
+   processes can share. It holds the tree as columns of its nodes' fields
+   in preorder and the symbol table as rows of those, written with marshal
+   and compressed with zlib, which takes a fraction of the time pickling
+   the nodes does. A file is written under a temporary name and renamed
+   into place, so readers see a whole file or none, and one removed while
+   it is being read is just a miss. Once the files pass a size cap the
+   least recently used, by modification time, which a hit updates, are
+   removed. Each cache keeps count of the bytes it has written since it
+   last looked at the directory, and only looks again when the count
+   passes the cap or every TRIM_WRITES writes, to catch the files of other
+   processes. A hit on disk still has to rebuild the tree, so it saves
+   less than one in memory.
+"""
+
+from tree import Node
+from symbols import SymbolTable
+from collections import OrderedDict
+from itertools import izip
+import hashlib
+import marshal
+import os
+import tempfile
+import time
+import weakref
+import zlib
+
+
+# the files whose contents decide what a parse gives, hashed into VERSION
+SOURCES = ['scanner.py', 'tokens.py', 'tokenstream.py', 'tree.py',
+           'symbols.py', 'parser.py', 'tableparser.py', 'grammar.py',
+           'grammar.txt']
+
+# defaults for the size of each tier
+MEMORY_TOKENS = 1000000
+DISK_BYTES = 256 * 1024 * 1024
+
+# the ending of the files of the disk tier
+SUFFIX = '.parse'
+
+# how old, in seconds, the temporary file of a write has to be to count as
+# left behind by a process that died while writing it
+STALE = 3600
+
+# how many writes a cache makes between looks at the whole directory, which
+# otherwise only happen when its own count of the bytes there passes the cap
+TRIM_WRITES = 256
+
+# the part of the cap a trim brings the files down to, so that a full
+# directory is not looked at again after the next write
+TRIM_TO = 0.9
+
+
+def version(directory=None):
+    """Returns a hash of SOURCES in directory, by default the one of this
+       module, the version of the parser."""
+    digest = hashlib.sha1()
+    here = directory or os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        f = open(os.path.join(here, name), 'rb')
+        try:
+            digest.update(f.read())
+        finally:
+            f.close()
+    return digest.hexdigest()[:16]
+
+VERSION = version()
+
+
+def pack(result):
+    """Returns a result of ParseCache.parse as a string, or None if its
+       tree is not under its root."""
+    tree, count, root, symbols, elided = result
+    nodes = list(root.iterPreorder())
+    rows = dict((id(node), row) for row, node in enumerate(nodes))
+    if id(tree) not in rows:
+        return None
+    # the nodes symbols has that are not in the tree, the names of forward
+    # declarations, with negative rows
+    loose = []
+
+    def row(node):
+        found = rows.get(id(node))
+        if found is None:
+            found = rows[id(node)] = -len(loose) - 1
+            loose.append((node.data, node.line, node.type, node.start,
+                          node.end))
+        return found
+    columns = ([node.data for node in nodes], [node.line for node in nodes],
+               [node.type for node in nodes], [node.start for node in nodes],
+               [node.end for node in nodes],
+               [len(node.children) for node in nodes])
+    return marshal.dumps((
+        columns, rows[id(tree)], count, symbols.names,
+        [map(row, each) for each in symbols.declared],
+        [map(row, each) for each in symbols.used], loose,
+        [(rows[id(node)], rules) for node, rules in elided
+         if id(node) in rows]))
+
+
+def unpack(data):
+    """Returns the result pack turned into data."""
+    (columns, current, count, names, declared, used, loose,
+     elided) = marshal.loads(data)
+    datas, lines, types, starts, ends, counts = columns
+    # the names are shared by the nodes for them, as after a parse
+    shared = dict((name, name) for name in names)
+    nodes = map(Node, [shared.get(data, data) for data in datas], lines,
+                types, starts, ends)
+    # the nodes with children still to come, innermost last, each with a
+    # weak reference to it and how many
+    open = []
+    for node, children in izip(nodes, counts):
+        if open:
+            top = open[-1]
+            top[0].children.append(node)
+            node.parentRef = top[1]
+            top[2] -= 1
+            if not top[2]:
+                open.pop()
+        if children:
+            open.append([node, weakref.ref(node), children])
+    loose = [Node(shared.get(fields[0], fields[0]), *fields[1:])
+             for fields in loose]
+    symbols = SymbolTable()
+    symbols.names = names
+    symbols.ids = dict((name, ident) for ident, name in enumerate(names))
+    symbols.declared = [[nodes[row] if row >= 0 else loose[-row - 1]
+                         for row in rows] for rows in declared]
+    symbols.used = [[nodes[row] if row >= 0 else loose[-row - 1]
+                     for row in rows] for rows in used]
+    return (nodes[current], count, nodes[0], symbols,
+            [(nodes[row], rules) for row, rules in elided])
+
+
+class ParseCache(object):
+    """Parse results by the hash of their source, in memory and, if it is
+       given a directory, on disk. hits and diskHits count the results
+       found in either tier, misses the sources that had to be parsed,
+       and evictions and diskEvictions the results each tier let go."""
+
+    def __init__(self, directory=None, memoryTokens=MEMORY_TOKENS,
+                 diskBytes=DISK_BYTES):
+        """Constructor. The memory tier holds results for up to
+           memoryTokens tokens, 0 for none, and the files in directory are
+           kept under diskBytes bytes."""
+        self.directory = directory
+        self.memoryTokens = memoryTokens
+        self.diskBytes = diskBytes
+        # the version of the parser in the keys
+        self.version = VERSION
+        if directory is not None and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        # the results in memory, least recently used first, and the tokens
+        # they were parsed from
+        self.entries = OrderedDict()
+        self.tokens = 0
+        # the bytes of the disk tier as of the last trim and the writes
+        # since, None before the first
+        self.diskUsed = None
+        self.writes = 0
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.diskEvictions = 0
+
+    def __len__(self):
+        """Returns the number of results in memory."""
+        return len(self.entries)
+
+    def counters(self):
+        """Returns the counters by name."""
+        return {'hits': self.hits, 'diskHits': self.diskHits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'diskEvictions': self.diskEvictions}
+
+    def key(self, source, parser):
+        """Returns the key of the result of parser parsing source, a
+           string or anything exposing the buffer interface."""
+        digest = hashlib.sha1(source)
+        digest.update('\0%s\0%s\0%d\0%d' % (
+            self.version, parser.engine, parser.compactExpr,
+            parser.compactTree))
+        return digest.hexdigest()
+
+    def parse(self, source, parser, scanner):
+        """Returns what parser.parseTokens gives for source scanned by
+           scanner, and the number of tokens, from the cache if it is
+           there. Either way parser is left as after the parse, with its
+           root, symbols and elided. Raises LexicalError or SyntaxError
+           like scanning and parsing."""
+        key = self.key(source, parser)
+        result = self.get(key)
+        if result is not None:
+            tree, count, root, symbols, elided = result
+            parser.restore(root, tree, symbols, elided)
+            return tree, count
+        self.misses += 1
+        tokens = scanner.scanBuffer(source)
+        tree = parser.parseTokens(tokens)
+        self.put(key, (tree, len(tokens), parser.root, parser.symbols,
+                       parser.elided.values()))
+        return tree, len(tokens)
+
+    def get(self, key):
+        """Returns the result kept under key, or None."""
+        result = self.entries.pop(key, None)
+        if result is not None:
+            self.entries[key] = result
+            self.hits += 1
+            return result
+        if self.directory is None:
+            return None
+        result = self.load(key)
+        if result is not None:
+            self.diskHits += 1
+            self.remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """Keeps a result under key in both tiers."""
+        self.remember(key, result)
+        if self.directory is not None:
+            self.save(key, result)
+
+    def remember(self, key, result):
+        """Keeps a result in memory, letting go of the least recently used
+           ones past memoryTokens."""
+        if result[1] > self.memoryTokens:
+            return
+        self.entries[key] = result
+        self.tokens += result[1]
+        while self.tokens > self.memoryTokens:
+            old, dropped = self.entries.popitem(last=False)
+            self.tokens -= dropped[1]
+            self.evictions += 1
+
+    def path(self, key):
+        """Returns the file of a key in the disk tier."""
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key):
+        """Returns the result in the file of key, or None if there is no
+           such file or it cannot be read."""
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        try:
+            result = unpack(zlib.decompress(data))
+        except Exception:
+            # unpacking a damaged file can raise nearly anything
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return result
+
+    def save(self, key, result):
+        """Writes a result to the file of key and trims the disk tier if it
+           may have grown past diskBytes. Results that cannot be written,
+           or do not fit, are not kept."""
+        data = pack(result)
+        if data is None:
+            return
+        data = zlib.compress(data, 1)
+        if len(data) > self.diskBytes:
+            return
+        fd, temp = tempfile.mkstemp(SUFFIX + '.tmp', '.', self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temp, self.path(key))
+        except (IOError, OSError):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+        self.writes += 1
+        if self.diskUsed is not None:
+            self.diskUsed += len(data)
+        if (self.diskUsed is None or self.diskUsed > self.diskBytes or
+                self.writes >= TRIM_WRITES):
+            self.trim()
+
+    def trim(self):
+        """Removes the least recently used files of the disk tier, if they
+           pass diskBytes, until they fit in TRIM_TO of it, and temporary
+           files left behind. Sets diskUsed to the bytes left."""
+        files = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another process
+                continue
+            if name.endswith(SUFFIX):
+                files.append((stat.st_mtime, path, stat.st_size))
+                total += stat.st_size
+            elif name.endswith('.tmp') and now - stat.st_mtime > STALE:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        files.sort()
+        if total > self.diskBytes:
+            limit = self.diskBytes * TRIM_TO
+            for mtime, path, size in files:
+                if total <= limit:
+                    break
+                total -= size
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.diskEvictions += 1
+        self.diskUsed = total
+        self.writes = 0
+
+
+# the caches of this process by directory, so a process that parses again
+# and again, such as a server.py worker, keeps its memory tier
+caches = {}
+
+
+def shared(directory):
+    """Returns this process's ParseCache for directory."""
+    cache = caches.get(directory)
+    if cache is None:
+        cache = caches[directory] = ParseCache(directory)
+    return cache
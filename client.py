@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""Runs ice9.py on a server.py instead of starting it.
+
+   python client.py [ice9.py options] < source.ice9
+
+   Takes the options of ice9.py and prints the same output with the same
+   exit status. Only the socket module is imported, so starting takes
+   little more than starting Python. Without a server to connect to the
+   work is handed to ice9.py.
+"""
+
+import os
+import socket
+import sys
+
+
+# the socket of server.py, which has the same default
+SOCKET = os.environ.get('ICE9_SOCKET', '/tmp/ice9-%d.sock' % os.getuid())
+
+
+def connect(path=SOCKET):
+    """Returns a socket connected to the server at path. Raises
+       socket.error if there is none."""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except socket.error:
+        conn.close()
+        raise
+    return conn
+
+
+def request(conn, args, source, cwd=None):
+    """Sends ice9.py arguments and source over a connection and returns the
+       exit status and what ice9.py would write to stdout and stderr. The
+       source can be a file object, read only if the server accepts the
+       arguments. Raises socket.error if the connection is lost."""
+    header = '\0'.join([cwd or os.getcwd()] + list(args))
+    conn.sendall("%d\n%s" % (len(header), header))
+    stream = conn.makefile('rb')
+    try:
+        line = stream.readline()
+        if line == "ready\n":
+            if hasattr(source, 'read'):
+                source = source.read()
+            conn.sendall("%d\n%s" % (len(source), source))
+            line = stream.readline()
+        if not line:
+            raise socket.error("the server closed the connection")
+        status, outSize, errSize = map(int, line.split())
+        out = stream.read(outSize)
+        err = stream.read(errSize)
+        if len(out) != outSize or len(err) != errSize:
+            raise socket.error("the server closed the connection")
+        return status, out, err
+    finally:
+        stream.close()
+
+
+def readsFile(args):
+    """True if the arguments name a --file, which optparse lets be
+       shortened as far as --fi."""
+    for arg in args:
+        if arg == '--':
+            return False
+        if arg.split('=', 1)[0] in ('--fi', '--fil', '--file'):
+            return True
+    return False
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    try:
+        conn = connect()
+    except socket.error:
+        ice9 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'ice9.py')
+        os.execv(sys.executable, [sys.executable, ice9] + args)
+    source = '' if readsFile(args) else sys.stdin
+    try:
+        status, out, err = request(conn, args, source)
+    except socket.error, e:
+        # the source may have been read already, so it is too late to
+        # hand the work to ice9.py
+        print >> sys.stderr, "client.py: %s" % e
+        sys.exit(1)
+    conn.close()
+    sys.stdout.write(out)
+    sys.stderr.write(err)
+    sys.exit(status)
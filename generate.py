@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""Generates random ice9 programs from the grammar in grammar.txt.
+
+   Programs are derived from the rules of a grammar.Grammar with a seeded
+   random number generator, so the same settings always give the same
+   program. size is roughly the number of tokens, depth limits how deeply
+   statements and expressions nest, density is the chance of an operator
+   wherever one may go, and declarations and mix set how many of each kind
+   of declaration start the program.
+"""
+
+from tokens import KINDS, ID, INT, STR
+from optparse import OptionParser
+import grammar
+import random
+
+
+# rules that go one level deeper
+NESTING = frozenset(['stms', 'Expr', 'proc'])
+
+# how often each kind of declaration is picked
+MIX = {'var': 4, 'type': 1, 'forward': 1, 'proc': 2}
+
+# the chance of going on with a repetition other than the top level
+# statements and declarations, or of picking a compound statement
+REPEAT = 0.4
+COMPOUND = 0.25
+
+# rules whose alternatives other than the empty one or End are operators
+OPERATORS = frozenset(['ExprPrime', 'LowPrime', 'MedPrime', 'High'])
+
+NAMES = ['a', 'b', 'c', 'i', 'j', 'n', 'x', 'y', 'sum', 'count', 'left',
+         'right', 'value', 'item', 'total', 'f', 'g', 'step', 'seen']
+WORDS = ['done', 'error', 'hello', 'x', 'left', 'right', '', 'a b c']
+
+# tokens a line break follows
+BREAKS = frozenset([';', '->', 'fi', 'od', 'af', 'end'])
+
+
+class Generator(object):
+    """Generates programs from a Grammar, by default the one in
+       grammar.txt."""
+
+    def __init__(self, rules=None, seed=None, depth=4, density=0.3,
+                 declarations=4, mix=None):
+        """Constructor. mix maps declaration kinds to how often each is
+           picked, see MIX."""
+        if rules is None:
+            rules = grammar.load()
+        self.grammar = rules
+        self.random = random.Random(seed)
+        self.depth = depth
+        self.density = density
+        self.declarations = declarations
+        self.mix = dict(MIX)
+        if mix is not None:
+            self.mix.update(mix)
+        self.findCosts()
+        self.repetitions = frozenset(rule for rule in rules.productions
+                                     if self.isRepetition(rule))
+
+    def findCosts(self):
+        """Computes the fewest tokens each nonterminal can derive."""
+        productions = self.grammar.productions
+        self.costs = dict((rule, None) for rule in productions)
+        changed = True
+        while changed:
+            changed = False
+            for rule, alternatives in productions.items():
+                for alternative in alternatives:
+                    cost = self.cost(alternative)
+                    if cost is not None and (self.costs[rule] is None or
+                                             cost < self.costs[rule]):
+                        self.costs[rule] = cost
+                        changed = True
+
+    def cost(self, alternative):
+        """Returns the fewest tokens an alternative derives, None if that
+           is not known yet."""
+        total = 0
+        for symbol in alternative:
+            if isinstance(symbol, str):
+                if self.costs[symbol] is None:
+                    return None
+                total += self.costs[symbol]
+            else:
+                total += 1
+        return total
+
+    def cheapest(self, alternatives):
+        """Returns the alternative that derives the fewest tokens."""
+        return min(alternatives, key=self.cost)
+
+    def isRepetition(self, rule):
+        """True for a helper rule made for a '{ ... }' repetition."""
+        return rule != self.grammar.owner[rule] and \
+            () in self.grammar.productions[rule] and \
+            all(not alternative or alternative[-1] == rule
+                for alternative in self.grammar.productions[rule])
+
+    def choose(self, rule, depth, tokens, size, declared):
+        """Picks an alternative of rule for a derivation depth levels deep
+           that has produced tokens tokens and declared declarations."""
+        alternatives = self.grammar.productions[rule]
+        owner = self.grammar.owner[rule]
+        rand = self.random
+        if depth > self.depth or tokens >= size:
+            # wrap up as quickly as possible
+            return self.cheapest(alternatives)
+        if rule in self.repetitions:
+            more = [alternative for alternative in alternatives if alternative]
+            if owner == 'program':
+                if declared >= self.declarations:
+                    return ()
+                return weighted(rand, more, [self.mix.get(alternative[0], 0)
+                                             for alternative in more])
+            if owner == 'stms' and depth == 1:
+                # the statements of the program go on until size is reached
+                return rand.choice(more)
+            if rand.random() < REPEAT:
+                return rand.choice(more)
+            return ()
+        if owner in OPERATORS:
+            plain = [alternative for alternative in alternatives
+                     if not alternative or alternative == ('End',)]
+            operators = [alternative for alternative in alternatives
+                         if alternative not in plain]
+            if plain and rand.random() >= self.density:
+                return plain[0]
+            return rand.choice(operators)
+        if owner == 'stm' and rule == 'stm':
+            compound = [alternative for alternative in alternatives
+                        if alternative[0] in ('if', 'do', 'fa')]
+            if rand.random() < COMPOUND:
+                return rand.choice(compound)
+            return rand.choice([alternative for alternative in alternatives
+                                if alternative not in compound])
+        return rand.choice(alternatives)
+
+    def text(self, kind):
+        """Returns the text of a token of the given kind."""
+        if kind == ID:
+            return self.random.choice(NAMES)
+        if kind == INT:
+            return str(self.random.randrange(1000))
+        if kind == STR:
+            return '"%s"' % self.random.choice(WORDS)
+        return KINDS[kind][1]
+
+    def generate(self, size=100):
+        """Returns a program of about size tokens."""
+        out = []
+        depth = 0
+        declared = 0
+        # None marks where a nesting rule ends
+        stack = [self.grammar.start]
+        while stack:
+            symbol = stack.pop()
+            if symbol is None:
+                depth -= 1
+            elif isinstance(symbol, str):
+                if symbol in NESTING:
+                    depth += 1
+                    stack.append(None)
+                alternative = self.choose(symbol, depth, len(out), size,
+                                          declared)
+                if alternative and symbol != self.grammar.start and \
+                   self.grammar.owner[symbol] == self.grammar.start:
+                    declared += 1
+                stack.extend(reversed(alternative))
+            else:
+                out.append(self.text(symbol))
+        lines = []
+        line = []
+        for text in out:
+            line.append(text)
+            if text in BREAKS:
+                lines.append(' '.join(line))
+                line = []
+        lines.append(' '.join(line))
+        return '\n'.join(lines).strip() + '\n'
+
+
+def weighted(rand, choices, weights):
+    """Picks one of choices, each as often as its weight says."""
+    point = rand.random() * sum(weights)
+    for choice, weight in zip(choices, weights):
+        point -= weight
+        if point < 0:
+            return choice
+    return choices[-1]
+
+if __name__ == "__main__":
+    options = OptionParser(usage="%prog [options]")
+    options.add_option("--size", type="int", default=100, metavar="N",
+                       help="generate about N tokens")
+    options.add_option("--depth", type="int", default=4, metavar="N",
+                       help="nest statements and expressions up to N deep")
+    options.add_option("--density", type="float", default=0.3, metavar="P",
+                       help="use an operator with probability P")
+    options.add_option("--declarations", type="int", default=4, metavar="N",
+                       help="start with N declarations")
+    options.add_option("--mix", default="", metavar="KIND=N,...",
+                       help="pick each kind of declaration N times as often, "
+                            "e.g. var=4,proc=2")
+    options.add_option("--seed", type="int", default=0, metavar="N",
+                       help="seed the random number generator with N")
+    opts, args = options.parse_args()
+    mix = {}
+    for item in filter(None, opts.mix.split(',')):
+        kind, weight = item.split('=')
+        if kind not in MIX:
+            options.error("unknown declaration kind %r" % kind)
+        mix[kind] = int(weight)
+    print Generator(seed=opts.seed, depth=opts.depth, density=opts.density,
+                    declarations=opts.declarations, mix=mix).generate(
+                        opts.size),
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+"""Reads the grammar in grammar.txt and builds an LL(1) prediction table.
+
+   Rules are written 'name -> symbols', with further alternatives on lines
+   starting with '|'. Quoted symbols are tokens, epsilon stands for the empty string and
+   '{ ... }' repeats its contents zero or more times. The lexical rules for
+   id, int and string stand for the ID, INT and STR tokens.
+
+   Repetitions are turned into helper rules and alternatives that share a
+   prefix are left factored, so 'forward' and 'End' can be predicted with
+   one token of lookahead. Helper rules are named after the rule they come
+   from and belong to it. Where a table entry still has two candidates the
+   conflict is recorded and the alternative that consumes the token wins,
+   which makes repetitions greedy like the loops of the hand written parser.
+"""
+
+from tokens import KINDS, TEXT_KINDS, EOF, ID, INT, STR
+import os
+import re
+import sys
+
+
+GRAMMAR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'grammar.txt')
+
+# lexical rules and the tokens they stand for
+LEXICAL = {'id': ID, 'int': INT, 'string': STR}
+
+# the empty string, written as a UTF-8 epsilon
+EPSILON = '\xce\xb5'
+
+SYMBOLS = re.compile(r"'[^']+'|[A-Za-z][A-Za-z0-9_]*|[{}|]|" + EPSILON)
+
+
+class GrammarError(Exception):
+    """Raised when grammar.txt cannot be read."""
+    pass
+
+
+class Grammar(object):
+    """An LL(1) grammar. Terminals are token kinds and nonterminals are rule
+       names. productions maps each nonterminal to its alternatives, each a
+       tuple of symbols, and owner maps it to the rule it comes from."""
+
+    def __init__(self, text, start='program'):
+        """Constructor that reads the grammar from text and builds the
+           FIRST and FOLLOW sets and the prediction table."""
+        self.start = start
+        self.productions = {}
+        self.owner = {}
+        self.rules = []
+        self.conflicts = []
+        self.read(text)
+        self.check()
+        self.factor()
+        self.findFirst()
+        self.findFollow()
+        self.buildTable()
+
+    def read(self, text):
+        """Reads the rules from the text of a grammar file."""
+        rule = None
+        alternatives = []
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if '->' in line and not line.startswith('|'):
+                name, body = line.split('->', 1)
+                rule = name.strip()
+                if rule in LEXICAL:
+                    rule = None
+                    continue
+                self.rules.append(rule)
+                self.owner[rule] = rule
+                alternatives = self.productions[rule] = []
+            elif rule is None:
+                continue
+            else:
+                body = line[1:]
+            symbols = SYMBOLS.findall(body)
+            if ''.join(symbols) != ''.join(body.split()):
+                raise GrammarError("line %d: cannot read %r" % (number, line))
+            alternatives.extend(self.alternatives(rule, symbols))
+
+    def alternatives(self, rule, symbols):
+        """Returns the alternatives in a list of symbols, turning each
+           repetition into a helper rule of the given rule."""
+        alternatives = [[]]
+        symbols = iter(symbols)
+        for symbol in symbols:
+            if symbol == '|':
+                alternatives.append([])
+            elif symbol == '{':
+                depth = 1
+                inner = []
+                for symbol in symbols:
+                    depth += {'{': 1, '}': -1}.get(symbol, 0)
+                    if not depth:
+                        break
+                    inner.append(symbol)
+                helper = self.helper(rule)
+                self.productions[helper] = [
+                    alternative + (helper,)
+                    for alternative in self.alternatives(rule, inner)] + [()]
+                alternatives[-1].append(helper)
+            elif symbol == EPSILON:
+                continue
+            elif symbol[0] == "'":
+                alternatives[-1].append(TEXT_KINDS[symbol[1:-1]])
+            elif symbol in LEXICAL:
+                alternatives[-1].append(LEXICAL[symbol])
+            else:
+                alternatives[-1].append(symbol)
+        return [tuple(alternative) for alternative in alternatives]
+
+    def helper(self, rule):
+        """Returns the name of a new helper rule of the given rule."""
+        name = "%s'%d" % (rule, len(self.owner))
+        self.owner[name] = rule
+        return name
+
+    def check(self):
+        """Makes sure every nonterminal used has a rule."""
+        for rule, alternatives in self.productions.items():
+            for alternative in alternatives:
+                for symbol in alternative:
+                    if isinstance(symbol, str) and \
+                       symbol not in self.productions:
+                        raise GrammarError("%s uses undefined rule %s" %
+                                           (rule, symbol))
+
+    def factor(self):
+        """Left factors alternatives that start with the same symbol."""
+        pending = list(self.productions)
+        while pending:
+            rule = pending.pop()
+            groups = {}
+            for alternative in self.productions[rule]:
+                if alternative:
+                    groups.setdefault(alternative[0], []).append(alternative)
+            for symbol, group in groups.items():
+                if len(group) < 2:
+                    continue
+                prefix = group[0]
+                for alternative in group[1:]:
+                    while alternative[:len(prefix)] != prefix:
+                        prefix = prefix[:-1]
+                helper = self.helper(self.owner[rule])
+                self.productions[helper] = [alternative[len(prefix):]
+                                            for alternative in group]
+                # the factored alternative takes the place of the first one
+                alternatives = self.productions[rule]
+                index = alternatives.index(group[0])
+                alternatives[index] = prefix + (helper,)
+                for alternative in group[1:]:
+                    alternatives.remove(alternative)
+                pending.append(helper)
+
+    def firstOf(self, symbols):
+        """Returns the FIRST set of a sequence of symbols and whether the
+           sequence can derive the empty string."""
+        first = set()
+        for symbol in symbols:
+            if not isinstance(symbol, str):
+                first.add(symbol)
+                return first, False
+            first |= self.first[symbol]
+            if symbol not in self.nullable:
+                return first, False
+        return first, True
+
+    def findFirst(self):
+        """Computes the FIRST set of every nonterminal."""
+        self.first = dict((rule, set()) for rule in self.productions)
+        self.nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for rule, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    first, nullable = self.firstOf(alternative)
+                    if not first <= self.first[rule]:
+                        self.first[rule] |= first
+                        changed = True
+                    if nullable and rule not in self.nullable:
+                        self.nullable.add(rule)
+                        changed = True
+
+    def findFollow(self):
+        """Computes the FOLLOW set of every nonterminal."""
+        self.follow = dict((rule, set()) for rule in self.productions)
+        self.follow[self.start].add(EOF)
+        changed = True
+        while changed:
+            changed = False
+            for rule, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    for index, symbol in enumerate(alternative):
+                        if not isinstance(symbol, str):
+                            continue
+                        first, nullable = self.firstOf(alternative[index + 1:])
+                        if nullable:
+                            first = first | self.follow[rule]
+                        if not first <= self.follow[symbol]:
+                            self.follow[symbol] |= first
+                            changed = True
+
+    def buildTable(self):
+        """Builds the prediction table, which maps each nonterminal to a
+           list of alternatives indexed by token kind. On a conflict the
+           alternative whose FIRST set has the token wins over one predicted
+           by FOLLOW, and otherwise the one listed first wins. Conflicts are
+           kept in conflicts as (rule, kind, chosen, rejected)."""
+        self.table = {}
+        for rule, alternatives in self.productions.items():
+            row = [None] * len(KINDS)
+            consumes = [False] * len(KINDS)
+            for alternative in alternatives:
+                first, nullable = self.firstOf(alternative)
+                predict = [(kind, True) for kind in first]
+                if nullable:
+                    predict.extend((kind, False) for kind in self.follow[rule])
+                for kind, consuming in predict:
+                    chosen = row[kind]
+                    if chosen is None:
+                        row[kind] = alternative
+                        consumes[kind] = consuming
+                    elif chosen != alternative:
+                        if consuming and not consumes[kind]:
+                            row[kind] = alternative
+                            consumes[kind] = True
+                            chosen, alternative = alternative, chosen
+                        self.conflicts.append((rule, kind, chosen, alternative))
+            self.table[rule] = row
+
+    def format(self, symbols):
+        """Returns a sequence of symbols written the way grammar.txt does."""
+        if not symbols:
+            return EPSILON
+        names = dict((kind, name) for name, kind in LEXICAL.items())
+        names[EOF] = 'EOF'
+        return ' '.join(symbol if isinstance(symbol, str)
+                        else names.get(symbol) or "'%s'" % KINDS[symbol][1]
+                        for symbol in symbols)
+
+    def report(self):
+        """Returns a description of every conflict in the table."""
+        return ["%s on %s: chose %s over %s" % (rule, self.format((kind,)),
+                                               self.format(chosen),
+                                               self.format(rejected))
+                for rule, kind, chosen, rejected in self.conflicts]
+
+
+def load(filename=GRAMMAR):
+    """Reads a grammar file."""
+    f = open(filename)
+    try:
+        return Grammar(f.read())
+    finally:
+        f.close()
+
+if __name__ == "__main__":
+    g = load(*sys.argv[1:])
+    for rule in sorted(g.productions):
+        for alternative in g.productions[rule]:
+            print "%-14s -> %s" % (rule, g.format(alternative))
+        print "%14s FIRST  %s" % ('', g.format(sorted(g.first[rule])))
+        print "%14s FOLLOW %s" % ('', g.format(sorted(g.follow[rule])))
+    for conflict in g.report():
+        print "conflict:", conflict
@@ -1,9 +1,160 @@
 #!/usr/bin/python
-from scanner import ice9Scanner
-from parser import ice9Parser
+from scanner import ice9Scanner, LexicalError, mapFile
+from parser import ice9Parser, ENGINES, SyntaxError, MAX_ERRORS
+from tokens import CATEGORY
+from optparse import OptionParser
 import sys
 
-p = ice9Parser()
-s = ice9Scanner()
-tree = p.parse(s.scan(sys.stdin.read()))
-print tree
+options = OptionParser(usage="%prog [--file source.ice9] < source.ice9")
+options.add_option("--file", metavar="FILE",
+                   help="memory map FILE instead of reading stdin")
+options.add_option("--engine", default="recursive", choices=list(ENGINES),
+                   help="parse with the recursive descent or table engine")
+options.add_option("--compact-expr", action="store_true", default=False,
+                   help="give expressions a compact tree without rule nodes")
+options.add_option("--compact-tree", action="store_true", default=False,
+                   help="leave out rule nodes with a single child that only "
+                        "pass it on")
+options.add_option("--all-errors", action="store_true", default=False,
+                   help="report every error in the source, not just the first")
+options.add_option("--max-errors", type="int", metavar="N",
+                   default=MAX_ERRORS,
+                   help="stop after N errors with --all-errors (default %d)"
+                        % MAX_ERRORS)
+options.add_option("--format", default="tree",
+                   choices=["tree", "sexp", "jsonl", "events", "xref"],
+                   help="print the parse tree as tree, sexp or jsonl, the "
+                        "parse events without building a tree, or where "
+                        "each identifier is declared and used")
+options.add_option("--max-depth", type="int", metavar="N",
+                   help="leave out nodes deeper than N")
+options.add_option("--max-nodes", type="int", metavar="N",
+                   help="print at most N nodes")
+options.add_option("--select", metavar="SELECTOR",
+                   help="print only the subtrees of the nodes SELECTOR "
+                        "matches, such as 'proc fa :=' or "
+                        "'End > [type=procCall]'")
+options.add_option("--cache", metavar="DIR",
+                   help="keep parse results in DIR and reuse them while the "
+                        "source and parser stay the same")
+options.add_option("--profile", choices=["table", "collapsed"],
+                   help="report the time and nodes of each rule on stderr "
+                        "as a table or as collapsed stacks")
+
+
+def check(opts):
+    """Returns what is wrong with a combination of options, or None."""
+    if opts.compact_expr and opts.engine != "recursive":
+        return "--compact-expr needs the recursive engine"
+    if opts.compact_tree and opts.engine != "recursive":
+        return "--compact-tree needs the recursive engine"
+    if opts.all_errors and (opts.engine != "recursive" or
+                            opts.format == "events"):
+        return "--all-errors needs the recursive engine and a tree format"
+    if opts.profile and (opts.engine != "recursive" or
+                         opts.format == "events"):
+        return "--profile needs the recursive engine and a tree format"
+    if opts.cache and (opts.all_errors or opts.profile or
+                       opts.format == "events"):
+        return "--cache cannot be used with --all-errors, --profile or " \
+               "the events format"
+    if opts.select:
+        if opts.format in ("events", "xref"):
+            return "--select needs a tree format"
+        from query import Selector
+        try:
+            Selector(opts.select)
+        except ValueError, e:
+            return str(e)
+    return None
+
+
+def run(opts, source, s, p, out=sys.stdout, err=sys.stderr):
+    """Scans and parses source, a string or mmap, with the scanner s and
+       parser p as the options say, writing what ice9.py prints to out and
+       err. Returns the exit status."""
+    if opts.profile:
+        from ruleprofile import RuleProfiler
+        profiler = RuleProfiler()
+        profiler.install(p)
+    if opts.cache:
+        from cache import shared
+        try:
+            tree, count = shared(opts.cache).parse(source, p, s)
+        except (LexicalError, SyntaxError), e:
+            print >> out, e
+            return 1
+    elif opts.all_errors:
+        errors = []
+        tokens = s.scanBuffer(source, errors)
+        tree, diagnostics = p.parseAll(tokens, opts.max_errors)
+        if errors or diagnostics:
+            # the sort is stable, so errors on one line stay in the order
+            # they were found in
+            errors = sorted(errors + diagnostics, key=lambda error: error.line)
+            for error in errors[:opts.max_errors]:
+                print >> out, error
+            return 1
+    else:
+        try:
+            tokens = s.scanBuffer(source)
+        except LexicalError, e:
+            print >> out, e
+            return 1
+    if opts.format == "events":
+        try:
+            for event in p.events(tokens):
+                if event[0] == "token":
+                    name, kind, text, line = event
+                    print >> out, line, name, CATEGORY[kind], text
+                elif event[0] != "error":
+                    name, rule, line = event
+                    print >> out, line, name, rule
+        except SyntaxError, e:
+            print >> out, e
+            return 1
+        return 0
+    if not opts.all_errors and not opts.cache:
+        try:
+            tree = p.parseTokens(tokens)
+        except SyntaxError, e:
+            print >> out, e
+            return 1
+    if opts.format == "xref":
+        p.symbols.write(out)
+    elif opts.select:
+        from query import TreeIndex
+        for node in TreeIndex(tree).select(opts.select):
+            node.write(out, opts.format, opts.max_depth, opts.max_nodes)
+            if opts.format == "tree":
+                out.write("\n")
+    else:
+        tree.write(out, opts.format, opts.max_depth, opts.max_nodes)
+        if opts.format == "tree":
+            out.write("\n")
+    if opts.profile:
+        lines = getattr(profiler, opts.profile)()
+        err.write("\n".join(lines) + "\n")
+    return 0
+
+
+def read(opts):
+    """Returns the source the options name, a mapped file or stdin."""
+    if opts.file:
+        return mapFile(opts.file)
+    return sys.stdin.read()
+
+if __name__ == "__main__":
+    opts, args = options.parse_args()
+    problem = check(opts)
+    if problem:
+        options.error(problem)
+    try:
+        status = run(opts, read(opts), ice9Scanner(),
+                     ice9Parser(opts.engine, opts.compact_expr,
+                                opts.compact_tree))
+    except RuntimeError:
+        # past the recursion limit, as server.py and batch.py report it
+        print >> sys.stderr, "nested too deeply"
+        status = 1
+    sys.exit(status)
@@ -0,0 +1,438 @@
+#!/usr/bin/python
+"""Incremental reparsing of an edited ice9 program.
+
+   An IncrementalParser keeps the source, its TokenBuffer, the parse tree and
+   the extent of every top-level unit: each 'var', 'type', 'forward' or
+   'proc' declaration and each top-level statement. After an edit only the
+   lines the edit touches are scanned again, and parsing restarts at the
+   unit the edit falls in. It stops as soon as a unit ends where an old
+   unit used to start, and the new units are spliced in place of the old
+   ones. No token spans a line and a unit's extent depends on at most one
+   token of lookahead, so the result is the tree a full parse would build.
+   Cases this cannot handle locally fall back to a full parse.
+"""
+
+from parser import ice9Parser, SyntaxError
+from scanner import ice9Scanner, LexicalError
+from tokenstream import BufferStream
+from tokens import TokenBuffer, KINDS, EOF
+from tree import Node
+from array import array
+from bisect import bisect_left
+
+
+# phases of a program, declarations come before statements
+DECL, STM = range(2)
+
+
+class Unit(object):
+    """A top-level declaration or statement. start is the index of its
+       first token, end the index of the token following it, line the line
+       it starts on and node the node it added to the tree, if any."""
+
+    __slots__ = ('phase', 'start', 'end', 'line', 'node')
+
+    def __init__(self, phase, start, end, line, node):
+        self.phase = phase
+        self.start = start
+        self.end = end
+        self.line = line
+        self.node = node
+
+
+class Resync(Exception):
+    """Raised when an edit cannot be handled without a full parse."""
+    pass
+
+
+class EditBuffer(TokenBuffer):
+    """A TokenBuffer that is cheap to edit. The offsets of the tokens from
+       index gap on are stored relative to the end of the source, so text
+       inserted or removed before them leaves them alone and an edit only
+       has to convert the tokens between it and the previous edit. The
+       nodes of an incremental tree have no spans, which every edit before
+       them would change."""
+
+    offsets = False
+
+    def __init__(self, source, gap=0):
+        """Constructor that takes the source and the index of the first
+           token stored relative to its end."""
+        TokenBuffer.__init__(self, source, True)
+        self.gap = gap
+
+    def text(self, i):
+        """Returns the text of the i-th token."""
+        kind = self.kinds[i]
+        text = KINDS[kind][1]
+        if text is None:
+            start = self.starts[i]
+            end = self.ends[i]
+            if i >= self.gap:
+                start += len(self.source)
+                end += len(self.source)
+            return self.source[start:end]
+        return text
+
+    def find(self, offset):
+        """Returns the index of the first token starting at or after
+           offset."""
+        index = bisect_left(self.starts, offset, 0, self.gap)
+        if index < self.gap:
+            return index
+        return bisect_left(self.starts, offset - len(self.source), self.gap,
+                           len(self.starts))
+
+    def replace(self, begin, stop, region, offset, source):
+        """Replaces the tokens from begin up to stop with those of region,
+           a TokenBuffer scanned from source[offset:], and makes source the
+           new source. The gap moves to the end of the new tokens. Returns
+           what revert needs to undo the change."""
+        count = len(region) - 1
+        low = min(self.gap, begin)
+        high = max(self.gap, stop)
+        size = len(self.source)
+        saved = (low, high + count - (stop - begin), self.source, self.gap,
+                 self.kinds[low:high], self.starts[low:high],
+                 self.ends[low:high])
+        self.kinds[begin:stop] = region.kinds[:count]
+        for values, scanned in ((self.starts, region.starts),
+                                (self.ends, region.ends)):
+            values[low:high] = shifted(values[low:begin], size) + \
+                shifted(scanned[:count], offset) + \
+                shifted(values[stop:high], -size)
+        self.source = source
+        self.gap = begin + count
+        return saved
+
+    def revert(self, saved):
+        """Undoes a replace."""
+        low, high, self.source, self.gap, kinds, starts, ends = saved
+        self.kinds[low:high] = kinds
+        self.starts[low:high] = starts
+        self.ends[low:high] = ends
+
+
+def shifted(values, delta):
+    """Returns a copy of an array of offsets with delta added to each."""
+    return array(values.typecode, map(delta.__add__, values))
+
+
+class IncrementalParser(object):
+    """Keeps a program parsed as it is edited. Like the tokens, the units
+       from index gap on store their start and end relative to the number
+       of tokens and their line relative to the number of lines, so the
+       units past an edit do not need to be touched."""
+
+    def __init__(self, source):
+        """Constructor that scans and parses source in full. Raises
+           LexicalError or SyntaxError if it is not a valid program."""
+        self.scanner = ice9Scanner()
+        self.parser = ice9Parser()
+        self.fullParse(source)
+
+    def fullParse(self, source):
+        """Scans and parses the whole source."""
+        scanned = self.scanner.scanBuffer(source, lines=True)
+        tokens = EditBuffer(source, len(scanned))
+        tokens.kinds = scanned.kinds
+        tokens.starts = scanned.starts
+        tokens.ends = scanned.ends
+        units, stopped = self.parseUnits(tokens, 0, 1, DECL, False)
+        self.source = source
+        self.tokens = tokens
+        self.count = len(tokens)
+        self.lines = source.count('\n')
+        self.units = units
+        self.gap = len(units)
+        self.stopped = stopped
+        if stopped:
+            # a parse ignores the tokens it stopped at and returns whatever
+            # tree it got to, build the same tree
+            p = self.parser
+            p.__init__()
+            p.tokens = BufferStream(tokens)
+            p.Goal()
+            self.tree = p.current
+            return
+        self.tree = Node('#PGRM#')
+        self.block = Node('#Stms#')
+        self.block.parent = self.tree
+        self.buildTree()
+
+    def parseUnits(self, tokens, pos, line, phase, seenStm, sync=None):
+        """Parses units starting with the token at pos on the given line
+           and returns the list of units and whether parsing stopped on a
+           token that cannot start a statement, like ice9Parser.parse does.
+           sync is called with the phase and end of each unit and returns
+           True to stop early. Raises SyntaxError on a syntax error."""
+        p = self.parser
+        p.__init__()
+        p.tokens = BufferStream(tokens)
+        p.tokens.pos = pos
+        p.currentLine = line
+        p.kind = p.getNextToken()
+        units = []
+        while True:
+            container = p.current = Node()
+            start = p.tokens.pos - 1
+            line = p.currentLine
+            if phase == DECL:
+                if p.var() or p.type() or p.forward() or p.proc():
+                    pass
+                else:
+                    phase = STM
+                    continue
+            elif p.kind == EOF:
+                if not seenStm:
+                    raise SyntaxError(line, p.tokens.last())
+                return units, False
+            elif p.Stm():
+                seenStm = True
+            elif seenStm:
+                return units, True
+            else:
+                raise SyntaxError(line, p.tokens.last())
+            end = p.tokens.pos - 1
+            node = container.children[0] if container.children else None
+            units.append(Unit(phase, start, end, line, node))
+            if sync is not None and sync(phase, end):
+                return units, False
+
+    def unitStart(self, index):
+        """Returns the index of the first token of a unit."""
+        if index >= self.gap:
+            return self.units[index].start + self.count
+        return self.units[index].start
+
+    def unitEnd(self, index):
+        """Returns the index of the token following a unit."""
+        if index >= self.gap:
+            return self.units[index].end + self.count
+        return self.units[index].end
+
+    def unitLine(self, index):
+        """Returns the line a unit starts on."""
+        if index >= self.gap:
+            return self.units[index].line + self.lines
+        return self.units[index].line
+
+    def moveGap(self, gap):
+        """Moves the gap of the units, converting the units in between."""
+        units = self.units
+        tokens = self.count
+        lines = self.lines
+        for unit in units[self.gap:gap]:
+            unit.start += tokens
+            unit.end += tokens
+            unit.line += lines
+        for unit in units[gap:self.gap]:
+            unit.start -= tokens
+            unit.end -= tokens
+            unit.line -= lines
+        self.gap = gap
+
+    def buildTree(self):
+        """Assembles the tree from the nodes of all the units. The root
+           and statement block are reused."""
+        root = self.tree
+        block = self.block
+        decls = [unit for unit in self.units if unit.phase == DECL]
+        stms = self.units[len(decls):]
+        for unit in decls:
+            if unit.node is not None:
+                unit.node.parent = root
+        for unit in stms:
+            if unit.node is not None:
+                unit.node.parent = block
+        root.children = [unit.node for unit in decls if unit.node is not None]
+        block.children = [unit.node for unit in stms if unit.node is not None]
+        if block.children:
+            root.children.append(block)
+        self.decls = len(decls)
+        block.line = self.unitLine(self.decls)
+
+    def spliceTree(self, first, old, new):
+        """Replaces the nodes of the old units, which started at index first,
+           with those of the new units. Falls back to building the whole tree
+           when the units change phase or the statement block empties."""
+        phases = set(unit.phase for unit in old + new)
+        if len(phases) != 1 or (not self.block.children and STM in phases):
+            self.buildTree()
+            return
+        phase, = phases
+        if phase == DECL:
+            parent = self.tree
+            guess = first
+            self.decls += len(new) - len(old)
+        else:
+            parent = self.block
+            guess = first - self.decls
+        children = parent.children
+        nodes = [unit.node for unit in old if unit.node is not None]
+        if nodes:
+            # units without a node are rare, so the node is usually found
+            # at the unit's own index
+            if guess < len(children) and children[guess] is nodes[0]:
+                index = guess
+            else:
+                index = children.index(nodes[0])
+        else:
+            # the nodes go after those of the units before
+            index = 0
+            for before in xrange(first - 1, -1, -1):
+                unit = self.units[before]
+                if unit.phase != phase:
+                    break
+                if unit.node is not None:
+                    index = children.index(unit.node) + 1
+                    break
+        added = [unit.node for unit in new if unit.node is not None]
+        for node in added:
+            node.parent = parent
+        children[index:index + len(nodes)] = added
+        if not self.block.children:
+            self.buildTree()
+        self.block.line = self.unitLine(self.decls)
+
+    def edit(self, offset, removed, inserted):
+        """Replaces removed characters at offset with the inserted text and
+           returns the updated tree. Raises LexicalError or SyntaxError, and
+           leaves the previous state alone, if the result is not a valid
+           program."""
+        old = self.source
+        source = old[:offset] + inserted + old[offset + removed:]
+        if self.stopped:
+            self.fullParse(source)
+            return self.tree
+        try:
+            self.reparse(source, offset, removed, inserted)
+        except Resync:
+            self.fullParse(source)
+        return self.tree
+
+    def relex(self, source, offset, removed, inserted):
+        """Scans the lines touched by an edit again and replaces their tokens
+           in place. Returns the indexes of the first rescanned token and of
+           the one after the last, the change in the number of tokens and of
+           lines, and what the token buffer needs to revert the change."""
+        old = self.source
+        tokens = self.tokens
+        # the edit covers whole lines [first, last) of the old source
+        first = old.rfind('\n', 0, offset) + 1
+        last = old.find('\n', offset + removed)
+        last = len(old) if last < 0 else last + 1
+        delta = len(inserted) - removed
+        try:
+            region = self.scanner.scanBuffer(source[first:last + delta],
+                                             lines=True)
+        except LexicalError, e:
+            e.line += old.count('\n', 0, first)
+            raise
+        count = len(region) - 1
+        begin = tokens.find(first)
+        stop = tokens.find(last)
+        saved = tokens.replace(begin, stop, region, first, source)
+        lines = inserted.count('\n') - old.count('\n', offset, offset + removed)
+        return begin, begin + count, count - (stop - begin), lines, saved
+
+    def findUnit(self, begin):
+        """Returns the index of the first unit ending at or after the token
+           index begin."""
+        low = 0
+        high = len(self.units)
+        while low < high:
+            middle = (low + high) // 2
+            if self.unitEnd(middle) < begin:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def reparse(self, source, offset, removed, inserted):
+        """Reparses the units an edit touches and splices them in."""
+        begin, stop, shift, lines, saved = self.relex(source, offset, removed,
+                                                      inserted)
+        try:
+            first, last, new = self.reparseUnits(begin, stop, shift)
+        except (SyntaxError, Resync):
+            self.tokens.revert(saved)
+            raise
+        # the units up to the edit become absolute and the ones after it
+        # relative, so only their nodes need to move if lines were added
+        if self.gap < first:
+            self.moveGap(first)
+        elif self.gap > last:
+            self.moveGap(last)
+        units = self.units
+        old = units[first:last]
+        if lines:
+            for unit in units[last:]:
+                if unit.node is not None:
+                    for node in unit.node.iterPreorder():
+                        node.line += lines
+        units[first:last] = new
+        self.gap = first + len(new)
+        self.source = source
+        self.count += shift
+        self.lines += lines
+        self.spliceTree(first, old, new)
+
+    def reparseUnits(self, begin, stop, shift):
+        """Parses the edited tokens from the first unit reaching the token
+           at begin until a unit ends where an old one started, past the
+           rescanned tokens that end at stop. Returns the index of the first
+           unit replaced, of the one after the last and the new units."""
+        units = self.units
+        tokens = self.tokens
+        # the first unit reaching the edit, including one that ends right
+        # before it since its end was decided by looking at the next token
+        first = self.findUnit(begin)
+        if first == 0:
+            pos, line, phase, seenStm = 0, 1, DECL, False
+        elif first == len(units):
+            raise Resync()
+        else:
+            pos = self.unitStart(first)
+            line = self.unitLine(first)
+            phase = units[first].phase
+            seenStm = units[first - 1].phase == STM
+        # the old unit the reparse may sync with, found by walking forward
+        # as the new units end
+        following = [first]
+        match = []
+
+        def sync(phase, end):
+            if end < stop:
+                return False
+            index = following[0]
+            while index < len(units) and self.unitStart(index) < end - shift:
+                index += 1
+            following[0] = index
+            if index < len(units) and self.unitStart(index) == end - shift \
+               and units[index].phase == phase:
+                match.append(index)
+                return True
+            return False
+
+        new, stopped = self.parseUnits(tokens, pos, line, phase, seenStm, sync)
+        if stopped:
+            raise Resync()
+        last = match[0] if match else len(units)
+        # statements come last, a program without any is a syntax error
+        if last < len(units):
+            final = units[-1]
+        elif new:
+            final = new[-1]
+        else:
+            final = units[first - 1]
+        if final.phase != STM:
+            raise Resync()
+        return first, last, new
+
+if __name__ == "__main__":
+    doc = IncrementalParser('var x: int\nx := 1;\nwrite x;\n')
+    print doc.tree
+    print '*' * 10
+    doc.edit(doc.source.index('1'), 1, '2 + y')
+    print doc.tree
@@ -1,7 +1,14 @@
 #!/usr/bin/python
 
 from scanner import ice9Scanner
+from tokenstream import TokenStream, makeStream, advanceLine, NEVER
+from tokens import EOF, NL, ID, INT, STR, IF, FI, ELSE, DO, OD, FA, AF, TO, \
+    PROC, END, RETURN, FORWARD, VAR, TYPE, BREAK, EXIT, TRUE, FALSE, WRITES, \
+    WRITE, READ, ARROW, LPAREN, RPAREN, BOX, LBRACK, RBRACK, SEMI, ASSIGN, \
+    COLON, COMMA, PLUS, MINUS, DIV, TIMES, EQ, MOD, NE, GE, LE, GT, LT, \
+    QUEST, CATEGORY
 from tree import Node
+from symbols import SymbolTable
 import sys
 
 
@@ -10,10 +17,11 @@ DEBUG = 0
 
 class SyntaxError(Exception):
     """A custom exception to represent a syntax error."""
-    def __init__(self, line, token):
+    def __init__(self, line, token, column=None):
         """Constructor that stores the line and token error was encountered
-           at."""
+           at, and the column of the token if it is known."""
         self.line = line
+        self.column = column
         self.token = token
 
     def __str__(self):
@@ -25,14 +33,114 @@ class SyntaxError(Exception):
         return  "line " + str(self.line) + ": syntax error near " + self.token[1]
 
 
+# the ways ice9Parser can parse: its own recursive descent methods, or the
+# LL(1) table built from grammar.txt by tableparser
+ENGINES = ('recursive', 'table')
+
+# default for the number of syntax errors ice9Parser.parseAll reports
+MAX_ERRORS = 100
+
+# What parseAll skips over after a syntax error. Tokens that open and
+# close a construct, nodes of the constructs a failed rule left open, and
+# the declarations that only start at the top of a program or procedure.
+OPENERS = frozenset([IF, DO, FA])
+CLOSERS = frozenset([FI, OD, AF, END])
+OPEN_NODES = frozenset(['if', 'do', 'fa', '#proc#'])
+DECLARATIONS = frozenset([VAR, TYPE, FORWARD])
+# tokens parsing can pick up at after skipping a token nothing starts with
+RESUME = CLOSERS | DECLARATIONS | frozenset([
+    EOF, PROC, BOX, ELSE, IF, DO, FA, BREAK, EXIT, RETURN, WRITE, WRITES,
+    SEMI, LPAREN, INT, STR, TRUE, FALSE, READ, ID, MINUS, QUEST])
+
+# The operator table of ice9Parser.Expr. Binary operators map to the level
+# whose '#rule#' node their chain goes under, so the higher the level the
+# tighter they bind. Comparisons do not chain.
+LEVELS = ('#Expr#', '#Low#', '#Med#', '#High#')
+BINARY = {EQ: 0, NE: 0, GT: 0, LT: 0, GE: 0, LE: 0,
+          PLUS: 1, MINUS: 1,
+          TIMES: 2, DIV: 2, MOD: 2}
+# prefix operators, binding tighter than any binary one, and the data of
+# their nodes
+UNARY = {MINUS: 'neg', QUEST: '?'}
+
+# The rules whose '#rule#' nodes a compactTree parse leaves out when they
+# have a single child, which then takes their place. They only pass one
+# operand, statement, type name or name on, where the nodes that are kept,
+# statements, declarations, operators and tokens, say what the code is.
+PASS_THROUGH = frozenset(['Expr', 'Low', 'Med', 'High', 'End', 'ifStm',
+                          'doStm', 'faStm', 'ifPrime', 'ifDoublePrime',
+                          'typeid', 'idlist', 'ProcCall'])
+
+
+def syntaxError(tokens, line):
+    """Returns a SyntaxError at the most recently consumed token of a
+       stream, which is on the given line."""
+    start, end = tokens.lastSpan()
+    column = None
+    if start is not None:
+        column = tokens.position(start)[1]
+    return SyntaxError(line, tokens.last(), column)
+
+
+def combine(operator, operands):
+    """Makes the last two operands the children of a binary operator's
+       node, which takes their place."""
+    right = operands.pop()
+    operator.addChild(operands.pop())
+    operator.addChild(right)
+    operands.append(operator)
+
+
 class ice9Parser:
     """An ice9 Parser class."""
-    def __init__(self):
-        """Constructor that initializes member variables."""
-        self.token = ""
-        self.tokens = []
+
+    # makes the nodes of the tree, replaced on one parser by ruleprofile
+    makeNode = Node
+
+    def __init__(self, engine='recursive', compactExpr=False,
+                 compactTree=False):
+        """Constructor that initializes member variables. engine is one of
+           ENGINES. If compactExpr is true expressions get a compact tree
+           without '#rule#' nodes, see compactExpression. If compactTree is
+           true the '#rule#' nodes of PASS_THROUGH rules with one child are
+           left out as the tree is built, and recorded in elided. Only the
+           recursive engine builds either."""
+        if engine not in ENGINES:
+            raise ValueError("unknown engine %r" % engine)
+        if compactExpr and engine != 'recursive':
+            raise ValueError("compact expressions need the recursive engine")
+        if compactTree and engine != 'recursive':
+            raise ValueError("compact trees need the recursive engine")
+        self.engine = engine
+        self.compactExpr = compactExpr
+        self.compactTree = compactTree
+        # the rules to leave out, but not End and ProcCall when
+        # compactOperand needs their nodes
+        self.passThrough = frozenset()
+        if compactTree:
+            self.passThrough = PASS_THROUGH - frozenset(
+                ['End', 'ProcCall'] if compactExpr else [])
+        # the '#rule#' nodes left out of a compactTree parse, by the id of
+        # the node that took their place, as that node and the data and
+        # line of each node left out above it, outermost first
+        self.elided = {}
+        # set by parseAll, which records syntax errors in diagnostics
+        self.recovering = False
+        self.maxErrors = MAX_ERRORS
+        self.diagnostics = []
+        self.kind = None
+        self.tokens = TokenStream([])
         self.currentLine = 1
+        # where lines start in the stream, and the position past which the
+        # line of the next token has to be looked up there
+        self.breaks = None
+        self.lineEnd = -1
         self.current = None
+        # the identifiers of the parse and where they are declared and used
+        self.symbols = SymbolTable()
+        # nodes only hold weak references to their parents, so the parser
+        # keeps the root alive while it builds the tree
+        self.root = None
 
     def makenode(rule):
         """Decorator that constructs a parse tree based on the order methods
@@ -40,41 +148,180 @@ class ice9Parser:
         def modify(self):
             """The function that wraps each function that accepts a part of the
             grammar."""
-            self.current = self.current.addChild(Node('#' + rule.func_name + '#', self.currentLine))
-            val = rule(self)
-            if val:
-                if len(self.current.children) == 0:
-                    node = self.current.remove()
-                    self.current = node.parent
-                else:
-                    self.current = self.current.parent
-            else:
+            if rule.func_name in self.passThrough:
+                return self.passOn(rule)
+            self.current = self.current.addChild(self.makeNode('#' + rule.func_name + '#', self.currentLine))
+            return self.closeRule(rule(self))
+        # kept for ruleprofile, which wraps the rule its own way
+        modify.rule = rule
+        return modify
+
+    def closeRule(self, val):
+        """Ends the '#rule#' node of a rule makenode called, which returned
+           val, leaving it in the tree if the rule succeeded and added
+           nodes under it."""
+        if val:
+            if len(self.current.children) == 0:
                 node = self.current.remove()
                 self.current = node.parent
-            return val
-        return modify
+            else:
+                self.current = self.current.parent
+        else:
+            node = self.current.remove()
+            self.current = node.parent
+            if node.children:
+                self.symbols.discard(node)
+        return val
+
+    def passOn(self, rule):
+        """Calls rule, one of passThrough, for makenode without a '#rule#'
+           node to start with. What the rule adds goes straight under the
+           current node, and only if it adds more than one node are they
+           moved under a '#rule#' node of their own. A single node is
+           recorded in elided instead."""
+        parent = self.current
+        children = parent.children
+        count = len(children)
+        line = self.currentLine
+        val = rule(self)
+        added = len(children) - count
+        if self.current is not parent:
+            # the rule failed without getting back to where it started,
+            # which closeRule takes care of with the node it would have had
+            self.adopt(parent, count, rule, line)
+            return self.closeRule(val)
+        if not val:
+            if added:
+                dropped = children[count:]
+                del children[count:]
+                for node in dropped:
+                    self.symbols.discard(node)
+        elif added == 1:
+            self.record(children[-1], '#' + rule.func_name + '#', line)
+        elif added:
+            self.adopt(parent, count, rule, line)
+        return val
+
+    def adopt(self, parent, count, rule, line):
+        """Moves the children of parent past the first count under a new
+           '#rule#' node for rule, on the given line, which takes their
+           place."""
+        children = parent.children
+        node = self.makeNode('#' + rule.func_name + '#', line)
+        node.children = children[count:]
+        for child in node.children:
+            child.parent = node
+        del children[count:]
+        parent.addChild(node)
+
+    def record(self, node, data, line):
+        """Records a '#rule#' node with the given data and line as elided
+           right above node, under any recorded above it already."""
+        below = self.elided.get(id(node))
+        self.elided[id(node)] = (node, ((data, line),) +
+                                 (below[1] if below else ()))
+
+    def elide(self, node):
+        """Puts the only child of a '#rule#' node in its place and records
+           the node in elided, for ruleprofile, which makes the nodes of
+           rules itself."""
+        child = node.children[0]
+        elided = self.elided
+        above = elided.pop(id(node), None)
+        below = elided.get(id(child))
+        elided[id(child)] = (child, (above[1] if above else ()) +
+                             ((node.data, node.line),) +
+                             (below[1] if below else ()))
+        node.inPlaceRemove()
+
+    def fullTree(self):
+        """Puts the '#rule#' nodes a compactTree parse left out back into
+           its tree and returns the tree, the one a parse without
+           compactTree builds. The records of nodes parseAll dropped are
+           ignored."""
+        root = self.root
+        if root is None:
+            return root
+        elided = self.elided
+        self.elided = {}
+        for node in list(root.iterPreorder()):
+            entry = elided.get(id(node))
+            if entry is None or entry[0] is not node:
+                continue
+            for data, line in reversed(entry[1]):
+                node = node.addParent(Node(data, line))
+        return root
+
+    def restore(self, root, current, symbols, elided):
+        """Leaves the parser as after a parse that gave current, the tree
+           under root, with symbols and the nodes a compactTree parse left
+           out as pairs of a node and what elided records for it, such as
+           cache.ParseCache keeps."""
+        self.__init__(self.engine, self.compactExpr, self.compactTree)
+        self.root = root
+        self.current = current
+        self.symbols = symbols
+        self.elided = dict((id(node), (node, rules))
+                           for node, rules in elided)
 
     def getCurrentLine(self):
         """Function that simply returns the current line."""
         return self.currentLine
 
     def getNextToken(self):
-        """Token that returns the next token from the list of tokens.
+        """Consumes the next token and returns its kind.
            If the next Token is a newline, increment the line count
-           and get a new token until it is not a newline."""
-        token = self.tokens.pop(0)
-        while token == ('NL', 'NL'):
-            token = self.tokens.pop(0)
+           and get a new token until it is not a newline. Streams without
+           newline tokens say where their lines start instead."""
+        kind = self.tokens.nextKind()
+        if self.tokens.pos > self.lineEnd:
+            self.nextLine()
+        while kind == NL:
+            kind = self.tokens.nextKind()
             self.currentLine += 1
-        return token
+        return kind
+
+    def nextLine(self):
+        """Moves currentLine on to the line of the token just consumed."""
+        if self.breaks is None:
+            self.breaks = self.tokens.lineBreaks()
+            if self.breaks is None:
+                # the stream has newline tokens
+                self.lineEnd = NEVER
+                return
+        self.currentLine, self.lineEnd = advanceLine(
+            self.breaks, self.currentLine, self.tokens.pos)
+
+    def tokenNode(self, data=None, type=None):
+        """Returns a node for the current token, with the token's text
+           unless data is given, that spans the token in the source."""
+        tokens = self.tokens
+        if data is None:
+            data = tokens.lastText()
+        start, end = tokens.lastSpan()
+        return self.makeNode(data, self.currentLine, type, start, end)
+
+    def idNode(self, type=None):
+        """Returns a node for the current token, an id, like tokenNode but
+           with the name interned in symbols."""
+        tokens = self.tokens
+        start, end = tokens.lastSpan()
+        return self.makeNode(self.symbols.intern(tokens.lastText()),
+                             self.currentLine, type, start, end)
+
+    def syntaxError(self):
+        """Returns a SyntaxError at the current token."""
+        return syntaxError(self.tokens, self.currentLine)
+
+    def text(self):
+        """Returns the text of the current token."""
+        return self.tokens.lastText()
 
     def parse(self, tokens):
-        """Parses a list of tokens."""
-        # make sure each parse tree is fresh
-        self.__init__()
-        self.tokens = tokens
+        """Parses a list, iterable, TokenBuffer or TokenStream of tokens.
+           Prints a syntax error and exits."""
         try:
-            self.Goal()
+            self.parseTokens(tokens)
             if DEBUG:
                 print self.current
         except SyntaxError, e:
@@ -82,14 +329,143 @@ class ice9Parser:
             sys.exit(1)
         return self.current
 
+    def parseTokens(self, tokens):
+        """Parses tokens like parse and returns the tree, but raises
+           SyntaxError instead of exiting."""
+        # make sure each parse tree is fresh
+        self.__init__(self.engine, self.compactExpr, self.compactTree)
+        self.tokens = makeStream(tokens)
+        if self.engine == 'table':
+            # imported here since tableparser imports this module
+            import tableparser
+            builder = tableparser.getDefault().parse(self.tokens)
+            self.root = self.current = builder.root
+            self.symbols = builder.symbols
+        else:
+            self.Goal()
+        return self.current
+
+    def parseArena(self, tokens):
+        """Parses tokens like parseTokens and returns the tree as an
+           arena.Arena. The table engine builds the arena directly, the
+           recursive engine's tree is converted, so only the tree that is
+           kept is smaller."""
+        import arena
+        if self.engine != 'table':
+            return arena.fromNode(self.parseTokens(tokens))
+        import tableparser
+        self.__init__(self.engine, self.compactExpr, self.compactTree)
+        self.tokens = makeStream(tokens)
+        return tableparser.getDefault().parse(self.tokens,
+                                              arena.ArenaBuilder()).arena
+
+    def parseAll(self, tokens, maxErrors=MAX_ERRORS):
+        """Parses tokens with the recursive engine, carrying on after each
+           syntax error instead of exiting, up to maxErrors errors. Returns
+           the tree, which leaves out the declarations and statements that
+           failed, and the list of SyntaxErrors in the order found."""
+        if self.engine != 'recursive':
+            raise ValueError("error recovery needs the recursive engine")
+        self.__init__(self.engine, self.compactExpr, self.compactTree)
+        self.tokens = makeStream(tokens)
+        self.recovering = True
+        self.maxErrors = maxErrors
+        self.symbols.log = []
+        try:
+            self.Goal()
+        except SyntaxError, e:
+            # past the limit, or outside of any declaration or statement
+            if not self.diagnostics or self.diagnostics[-1] is not e:
+                self.diagnostics.append(e)
+        self.recovering = False
+        self.symbols.log = None
+        return self.root, self.diagnostics
+
+    def attempt(self, rule):
+        """Calls rule, the method of a declaration or statement, and
+           returns what it returns. When parseAll is recovering, a syntax
+           error in the rule is recorded, whatever the rule added to the
+           tree is dropped and True is returned once the tokens have been
+           skipped to where parsing can go on."""
+        if not self.recovering:
+            return rule()
+        node = self.current
+        count = len(node.children)
+        start = self.tokens.pos
+        mark = self.symbols.mark()
+        try:
+            return rule()
+        except SyntaxError, e:
+            if not self.recovering:
+                raise
+            self.recover(e, node, count, start, mark)
+            return True
+
+    def recover(self, error, node, count, start, mark=None):
+        """Records a syntax error and gets past it. The children node had
+           past the first count are dropped, along with the ids recorded in
+           symbols since mark, and tokens are skipped up to the next ';' or
+           a closing or declaration keyword of the construct that was being
+           parsed. If no token was consumed since the stream
+           position start nothing can start with the token at the error, so
+           only it and the tokens up to one in RESUME are skipped. Raises
+           the error again once maxErrors errors are recorded."""
+        self.diagnostics.append(error)
+        if len(self.diagnostics) >= self.maxErrors:
+            self.recovering = False
+            raise error
+        # the constructs the failed rule opened and did not close
+        depth = 0
+        open = self.current
+        while open is not None and open is not node:
+            if open.data in OPEN_NODES:
+                depth += 1
+            open = open.parent
+        self.current = node
+        del node.children[count:]
+        if mark is not None:
+            self.symbols.rollback(mark)
+        kind = self.kind
+        if self.tokens.pos == start and kind != EOF:
+            kind = self.getNextToken()
+            while kind not in RESUME:
+                kind = self.getNextToken()
+            self.kind = kind
+            return
+        while kind != EOF and kind != PROC:
+            if not depth:
+                if kind == SEMI:
+                    kind = self.getNextToken()
+                    break
+                if kind in CLOSERS or kind in DECLARATIONS:
+                    break
+            if kind in OPENERS:
+                depth += 1
+            elif kind in CLOSERS:
+                depth -= 1
+                if not depth:
+                    kind = self.getNextToken()
+                    break
+            kind = self.getNextToken()
+        self.kind = kind
+
+    def events(self, tokens, handler=None):
+        """Parses tokens without building a tree. The events go to handler,
+           a tableparser.Handler, which is returned, or without a handler a
+           generator of events is returned. Events always come from the
+           table engine, since the recursive one builds its tree as it
+           goes. Raises SyntaxError."""
+        import tableparser
+        return tableparser.events(tokens, handler)
+
     def Goal(self):
         """The first hop in our recursive descent parser.
            Our Goal is to recognize a valid program. We
            set out on this task by getting the first token and checking
            to see if it is a valid program."""
-        self.token = self.getNextToken()
+        self.kind = self.getNextToken()
         # Goal -> Program
-        if self.Program() and self.token[0] == 'EOF':
+        if self.Program() and self.kind == EOF:
             return True
         else:
             #error
@@ -99,20 +475,32 @@ class ice9Parser:
         """The start of our program.
            Grammar Rule: program -> {var|type|forward|proc} stms
            """
-        self.current = Node('#PGRM#')
-        while self.var() or self.type() or self.forward() or self.proc():
-            pass
-        else:
-            # Program -> Stms
-            if not self.Stms():
-                raise SyntaxError(self.getCurrentLine(), self.token)
-        return True
+        self.root = self.current = self.makeNode('#PGRM#')
+        while True:
+            while self.attempt(self.var) or self.attempt(self.type) or \
+                  self.attempt(self.forward) or self.attempt(self.proc):
+                pass
+            else:
+                errors = len(self.diagnostics)
+                # Program -> Stms
+                if not self.attempt(self.Stms):
+                    raise self.syntaxError()
+            if not self.recovering or self.kind == EOF:
+                return True
+            if len(self.diagnostics) == errors:
+                # nothing can follow the statements of a program, so the
+                # token is skipped and parsing starts over after it
+                self.recover(self.syntaxError(),
+                             self.root, len(self.root.children),
+                             self.tokens.pos)
+                if self.kind == EOF:
+                    return True
 
     @makenode
     def var(self):
         """Grammar Rule: var -> 'var' varlist"""
-        if self.token == ('KEY', 'var'):
-            self.token = self.getNextToken()
+        if self.kind == VAR:
+            self.kind = self.getNextToken()
             return self.varlist()
         return False
 
@@ -122,43 +510,43 @@ class ice9Parser:
         varlist-> idlist ':' typeid { '[' int ']' } {',' varlist }
         """
         if self.idlist():
-            if self.token == ('SYM', ':'):
-                self.token = self.getNextToken()
+            if self.kind == COLON:
+                self.kind = self.getNextToken()
                 if self.typeid():
-                    while self.token == ('SYM', '['):
-                        self.current = self.current.addChild(Node('[]', self.currentLine))
-                        self.token = self.getNextToken()
-                        if self.token[0] == 'INT':
-                            self.current.addChild(Node(self.token[1], self.currentLine))
-                            self.token = self.getNextToken()
-                            if self.token == ('SYM', ']'):
+                    while self.kind == LBRACK:
+                        self.current = self.current.addChild(self.tokenNode('[]'))
+                        self.kind = self.getNextToken()
+                        if self.kind == INT:
+                            self.current.addChild(self.tokenNode())
+                            self.kind = self.getNextToken()
+                            if self.kind == RBRACK:
                                 self.current = self.current.parent
-                                self.token = self.getNextToken()
+                                self.kind = self.getNextToken()
                                 continue
-                        raise SyntaxError(self.getCurrentLine(), self.token)
+                        raise self.syntaxError()
                     else:
-                        while self.token == ('SYM', ','):
-                            self.token = self.getNextToken()
+                        while self.kind == COMMA:
+                            self.kind = self.getNextToken()
                             if self.varlist():
                                 continue
                             else:
-                                raise SyntaxError(self.getCurrentLine(), self.token)
+                                raise self.syntaxError()
                     return True
-        raise SyntaxError(self.getCurrentLine(), self.token)
+        raise self.syntaxError()
 
     @makenode
     def idlist(self):
         """Grammar Rule: idlist-> id { ',' id}"""
-        if self.token[0] == 'ID':
-            self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
-            while self.token == ('SYM', ','):
-                self.token = self.getNextToken()
-                if self.token[0] == 'ID':
-                    self.current.addChild(Node(self.token[1], self.currentLine))
-                    self.token = self.getNextToken()
+        if self.kind == ID:
+            self.current.addChild(self.symbols.declare(self.idNode()))
+            self.kind = self.getNextToken()
+            while self.kind == COMMA:
+                self.kind = self.getNextToken()
+                if self.kind == ID:
+                    self.current.addChild(self.symbols.declare(self.idNode()))
+                    self.kind = self.getNextToken()
                     continue
-                raise SyntaxError(self.getCurrentLine(), self.token)
+                raise self.syntaxError()
             return True
         return False
 
@@ -167,27 +555,27 @@ class ice9Parser:
         """Grammar Rule:
             type-> 'type' id  '=' typeid { '[' int ']' }
         """
-        if self.token == ('KEY', 'type'):
-            self.token = self.getNextToken()
-            if self.token[0] == 'ID':
-                self.current.addChild(Node(self.token[1], self.currentLine))
-                self.token = self.getNextToken()
-                if self.token == ('OP', '='):
-                    self.token = self.getNextToken()
+        if self.kind == TYPE:
+            self.kind = self.getNextToken()
+            if self.kind == ID:
+                self.current.addChild(self.symbols.declare(self.idNode()))
+                self.kind = self.getNextToken()
+                if self.kind == EQ:
+                    self.kind = self.getNextToken()
                     if self.typeid():
-                        while self.token == ('SYM', '['):
-                            self.current = self.current.addChild(Node('[]', self.currentLine))
-                            self.token = self.getNextToken()
-                            if self.token[0] == 'INT':
-                                self.current.addChild(Node(self.token[1], self.currentLine))
-                                self.token = self.getNextToken()
-                                if self.token == ('SYM', ']'):
+                        while self.kind == LBRACK:
+                            self.current = self.current.addChild(self.tokenNode('[]'))
+                            self.kind = self.getNextToken()
+                            if self.kind == INT:
+                                self.current.addChild(self.tokenNode())
+                                self.kind = self.getNextToken()
+                                if self.kind == RBRACK:
                                     self.current = self.current.parent
-                                    self.token = self.getNextToken()
+                                    self.kind = self.getNextToken()
                                     continue
-                            raise SyntaxError(self.getCurrentLine(), self.token)
+                            raise self.syntaxError()
                         return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     @makenode
@@ -196,67 +584,73 @@ class ice9Parser:
             forward-> 'forward' id '(' declist ')'
                     | 'forward' id '(' declist ')' ':' typeid
         """
-        if self.token == ('KEY', 'forward'):
-            self.token = self.getNextToken()
-            if self.token[0] == 'ID':
-                self.token = self.getNextToken()
-                if self.token == ('SYM', '('):
-                    self.token = self.getNextToken()
+        if self.kind == FORWARD:
+            self.kind = self.getNextToken()
+            if self.kind == ID:
+                # the name stays out of the tree, so it is only declared
+                # once the declaration is known to be whole
+                name = self.idNode()
+                self.kind = self.getNextToken()
+                if self.kind == LPAREN:
+                    self.kind = self.getNextToken()
                     if self.declist():
-                        if self.token == ('SYM', ')'):
-                            self.token = self.getNextToken()
-                            if self.token == ('SYM', ':'):
-                                self.token = self.getNextToken()
+                        if self.kind == RPAREN:
+                            self.kind = self.getNextToken()
+                            if self.kind == COLON:
+                                self.kind = self.getNextToken()
                                 if self.typeid():
+                                    self.symbols.declare(name)
                                     return True
                                 else:
-                                    raise SyntaxError(self.getCurrentLine(), self.token)
+                                    raise self.syntaxError()
+                            self.symbols.declare(name)
                             return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     @makenode
     def proc(self):
         """Grammar Rule: proc-> 'proc' id '(' declist ')' procPrime"""
-        if self.token == ('KEY', 'proc'):
-            self.token = self.getNextToken()
-            if self.token[0] == 'ID':
-                self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-                self.token = self.getNextToken()
-                if self.token == ('SYM', '('):
-                    #self.current = self.current.addChild(Node('()', self.currentLine))
-                    self.token = self.getNextToken()
+        if self.kind == PROC:
+            self.kind = self.getNextToken()
+            if self.kind == ID:
+                self.current = self.current.addChild(
+                    self.symbols.declare(self.idNode()))
+                self.kind = self.getNextToken()
+                if self.kind == LPAREN:
+                    #self.current = self.current.addChild(self.tokenNode('()'))
+                    self.kind = self.getNextToken()
                     if self.declist():
                         self.current = self.current.parent
-                        if self.token == ('SYM', ')'):
-                            self.token = self.getNextToken()
+                        if self.kind == RPAREN:
+                            self.kind = self.getNextToken()
                             res = self.procPrime()
                             #self.current = self.current.parent
                             return res
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     def procPrime(self):
         """Grammar Rule: procPrime -> ':' typeid procEnd | procEnd"""
-        if self.token == ('SYM', ':'):
-            #self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == COLON:
+            #self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             if self.typeid():
                 return self.procEnd()
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return self.procEnd()
 
     def procEnd(self):
         """Grammar Rule: procEnd-> {type|var} {stms} 'end'"""
-        while self.type() or self.var():
+        while self.attempt(self.type) or self.attempt(self.var):
             continue
-        while self.Stm():
+        while self.attempt(self.Stm):
             continue
-        if self.token == ('KEY', 'end'):
+        if self.kind == END:
             #self.current.addChild(Node('#ProcEnd#', self.currentLine))
-            self.token = self.getNextToken()
+            self.kind = self.getNextToken()
             return True
-        raise SyntaxError(self.getCurrentLine(), self.token)
+        raise self.syntaxError()
         return False
 
     def declist(self):
@@ -264,27 +658,27 @@ class ice9Parser:
                                  | nullProduction
         """
         if self.idlist():
-            if self.token == ('SYM', ':'):
-                self.token = self.getNextToken()
+            if self.kind == COLON:
+                self.kind = self.getNextToken()
                 if self.typeid():
-                    while self.token == ('SYM', ','):
-                        self.token = self.getNextToken()
+                    while self.kind == COMMA:
+                        self.kind = self.getNextToken()
                         if not self.declist():
-                            raise SyntaxError(self.getCurrentLine(), self.token)
+                            raise self.syntaxError()
                     else:
                         return True
 
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return True
 
     @makenode
     def Stms(self):
         """Grammar Rule: stms -> stm { stm }"""
-        if self.Stm():
-            while self.token != ('EOF', 'EOF') and self.Stm():
+        if self.attempt(self.Stm):
+            while self.kind != EOF and self.attempt(self.Stm):
                 pass
             return True
-        raise SyntaxError(self.getCurrentLine(), self.token)
+        raise self.syntaxError()
 
     @makenode
     def Stm(self):
@@ -308,35 +702,35 @@ class ice9Parser:
         elif self.faStm():
             return True
         # Stm -> return | exit | break
-        elif self.token[0] == 'KEY' and (self.token[1] == 'return' or self.token[1] == 'exit' or self.token[1] == 'break'):
-            self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
-            if self.token == ('SYM', ';'):
-                self.token = self.getNextToken()
+        elif self.kind == RETURN or self.kind == EXIT or self.kind == BREAK:
+            self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
+            if self.kind == SEMI:
+                self.kind = self.getNextToken()
                 return True
             else:
                 #syntax error
                 return False
         # Stm -> writes | write
-        elif self.token[0] == 'KEY' and (self.token[1] == 'writes' or self.token[1] == 'write'):
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        elif self.kind == WRITES or self.kind == WRITE:
+            self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             if self.Expr():
                 self.current = self.current.parent
-                if self.token == ('SYM', ';'):
-                    self.token = self.getNextToken()
+                if self.kind == SEMI:
+                    self.kind = self.getNextToken()
                     return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         # Stm -> Expr
         elif self.Expr():
-            if self.token == ('SYM', ';'):
-                self.token = self.getNextToken()
+            if self.kind == SEMI:
+                self.kind = self.getNextToken()
                 return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         # Stm -> ;
-        elif self.token == ('SYM', ';'):
+        elif self.kind == SEMI:
             # Don't add ; to the tree
-            self.token = self.getNextToken()
+            self.kind = self.getNextToken()
             return True
         else:
             return False
@@ -344,18 +738,18 @@ class ice9Parser:
     @makenode
     def ifStm(self):
         """Grammar Rule: if -> 'if' Expr '->' stms ifPrime"""
-        if self.token[0] == "KEY" and self.token[1] == "if":
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == IF:
+            self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             if self.Expr():
-                if self.token[0] == 'SYM' and self.token[1] == '->':
-                    self.token = self.getNextToken()
+                if self.kind == ARROW:
+                    self.kind = self.getNextToken()
                     if self.Stms():
                         res = self.ifPrime()
-                        self.current.addChild(Node('#EndIf#', self.currentLine))
+                        self.current.addChild(self.makeNode('#EndIf#', self.currentLine))
                         self.current = self.current.parent
                         return res
-                raise SyntaxError(self.getCurrentLine(), self.token)
+                raise self.syntaxError()
         return False
 
     @makenode
@@ -364,13 +758,13 @@ class ice9Parser:
             ifPrime -> '[]' ifPrime2
                     | 'fi'
         """
-        if self.token[0] == 'SYM' and self.token[1] == '[]':
-            #self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == BOX:
+            #self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             return self.ifDoublePrime()
-        elif self.token[0] == 'KEY' and self.token[1] == 'fi':
-            self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        elif self.kind == FI:
+            self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             return True
         return False
 
@@ -380,182 +774,257 @@ class ice9Parser:
             ifPrime2 -> 'else' '->' stms 'fi'
                      | Expr '->' stms ifPrime
         """
-        if self.token[0] == 'KEY' and self.token[1] == 'else':
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
-            if self.token[0] == 'SYM' and self.token[1] == '->':
-                self.token = self.getNextToken()
+        if self.kind == ELSE:
+            self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
+            if self.kind == ARROW:
+                self.kind = self.getNextToken()
                 if self.Stms():
-                    if self.token[0] == 'KEY' and self.token[1] == 'fi':
+                    if self.kind == FI:
                         self.current = self.current.parent
-                        self.token = self.getNextToken()
+                        self.kind = self.getNextToken()
                         return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         elif self.Expr():
-            if self.token[0] == 'SYM' and self.token[1] == '->':
-                self.token = self.getNextToken()
+            if self.kind == ARROW:
+                self.kind = self.getNextToken()
                 if self.Stms():
                     return self.ifPrime()
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     @makenode
     def doStm(self):
         """Grammar Rule: do -> 'do' Expr '->' stms 'od'"""
-        if self.token[0] == 'KEY' and self.token[1] == 'do':
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == DO:
+            self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
             if self.Expr():
-                if self.token[0] == 'SYM' and self.token[1] == '->':
+                if self.kind == ARROW:
 
-                    self.token = self.getNextToken()
+                    self.kind = self.getNextToken()
                     if self.Stms():
-                        if self.token[0] == 'KEY' and self.token[1] == 'od':
-                            self.current.addChild(Node('#doEnd#', self.currentLine))
+                        if self.kind == OD:
+                            self.current.addChild(self.tokenNode('#doEnd#'))
                             self.current = self.current.parent
-                            self.token = self.getNextToken()
+                            self.kind = self.getNextToken()
                             return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     @makenode
     def faStm(self):
         """Grammar Rule: fa -> 'fa' id ':=' Expr 'to' Expr '->' stms 'af'"""
-        if self.token[0] == 'KEY' and self.token[1] == 'fa':
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
-            if self.token[0] == "ID":
-                self.current.addChild(Node(self.token[1], self.currentLine))
-                self.token = self.getNextToken()
-                if self.token[0] == 'SYM' and self.token[1] == ':=':
-                    self.current.addChild(Node(self.token[1], self.currentLine))
-                    self.token = self.getNextToken()
+        if self.kind == FA:
+            self.current = self.current.addChild(self.tokenNode())
+            self.kind = self.getNextToken()
+            if self.kind == ID:
+                self.current.addChild(self.symbols.declare(self.idNode()))
+                self.kind = self.getNextToken()
+                if self.kind == ASSIGN:
+                    self.current.addChild(self.tokenNode())
+                    self.kind = self.getNextToken()
                     if self.Expr():
-                        if self.token[0] == 'KEY' and self.token[1] == 'to':
-                            self.current.addChild(Node(self.token[1], self.currentLine))
-                            self.token = self.getNextToken()
+                        if self.kind == TO:
+                            self.current.addChild(self.tokenNode())
+                            self.kind = self.getNextToken()
                             if self.Expr():
-                                if self.token[0] == 'SYM' and self.token[1] == '->':
-                                    self.token = self.getNextToken()
+                                if self.kind == ARROW:
+                                    self.kind = self.getNextToken()
                                     if self.Stms():
-                                        if self.token[0] == 'KEY' and self.token[1] == 'af':
-                                            self.current.addChild(Node('#EndFa#', self.currentLine))
+                                        if self.kind == AF:
+                                            self.current.addChild(self.tokenNode('#EndFa#'))
                                             self.current = self.current.parent
-                                            self.token = self.getNextToken()
+                                            self.kind = self.getNextToken()
                                             return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return False
 
     @makenode
     def typeid(self):
         """Grammar Rule: typeid -> id"""
-        if self.token[0] == 'ID':
-            self.current.addChild(Node(self.token[1], self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == ID:
+            self.current.addChild(self.symbols.use(self.idNode()))
+            self.kind = self.getNextToken()
             return True
         return False
 
-    @makenode
     def Expr(self):
-        """Grammar Rule: Expr -> Low ExprPrime"""
-        if self.Low():
-            return self.ExprPrime()
-        else:
-            return False
-
-    def ExprPrime(self):
-        """Grammar Rule:
-            ExprPrime -> '=' Low
-               | '!=' Low
-               | '>' Low
-               | '<' Low
-               | '>=' Low
-               | '<=' Low
-               | nullProduction
-        """
-        if self.token == ('OP', '=') or self.token == ('OP', '!=') or \
-            self.token == ('OP', '>') or self.token == ('OP', '<') or \
-            self.token == ('OP', '>=') or self.token == ('OP', '<='):
-                self.current = self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-                self.token = self.getNextToken()
-                if not self.Low():
-                    raise SyntaxError(self.getCurrentLine(), self.token)
-                self.current = self.current.parent
-        # empty string
-        return True
-
-    @makenode
-    def Low(self):
-        """Grammar Rule: Low -> Med LowPrime"""
-        if self.Med():
-            return self.LowPrime()
-        else:
-            return False
-
-    def LowPrime(self):
-        """Grammar Rule: LowPrime -> '+' Med LowPrime
-                                  | '-' Med LowPrime
-                                  | nullProduction
-        """
-        if self.token == ('OP', '+') or self.token == ('OP', '-'):
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-            self.token = self.getNextToken()
-            if self.Med():
-                ret = self.LowPrime()
-                self.current = self.current.parent
-                return ret
-            raise SyntaxError(self.getCurrentLine(), self.token)
-        # empty string
-        return True
+        """Grammar Rules:
+            Expr -> Low ExprPrime
+            Low  -> Med LowPrime
+            Med  -> High MedPrime
+            High -> '-' High | '?' High | End
+           Parses a whole expression by precedence climbing over BINARY and
+           UNARY instead of calling a method per rule, so a chain of
+           operators is a loop rather than a recursion. Unless compactExpr
+           is set the tree is the one the rules above describe, a '#rule#'
+           node per level with each further operator of a chain under the
+           one before it."""
+        if self.compactExpr:
+            return self.compactExpression()
+        if self.passThrough:
+            return self.elidingExpression()
+        top = self.current
+        parent = top
+        # the levels still open, innermost last, each with the node its
+        # next operator goes under, None once a comparison is done
+        open = []
+        level = 0
+        consumed = False
+        while True:
+            node = parent
+            while level < len(LEVELS):
+                node = node.addChild(self.makeNode(LEVELS[level], self.currentLine))
+                open.append([level, node])
+                level += 1
+            while self.kind in UNARY:
+                node = node.addChild(self.tokenNode(UNARY[self.kind], 'OP'))
+                self.kind = self.getNextToken()
+                node = node.addChild(self.makeNode('#High#', self.currentLine))
+                consumed = True
+            self.current = node
+            if not self.End():
+                if consumed:
+                    raise self.syntaxError()
+                self.symbols.discard(open[0][1].remove())
+                self.current = top
+                return False
+            # close levels until one goes on with an operator
+            while open:
+                level, node = open[-1]
+                if node is not None and BINARY.get(self.kind) == level:
+                    parent = node.addChild(self.tokenNode(type='OP'))
+                    self.kind = self.getNextToken()
+                    consumed = True
+                    open[-1][1] = parent if level else None
+                    level += 1
+                    break
+                open.pop()
+            else:
+                self.current = top
+                return True
 
-    @makenode
-    def Med(self):
-        """Grammar Rule: Med -> High MedPrime"""
-        if self.High():
-            return self.MedPrime()
-        else:
-            return False
+    def elidingExpression(self):
+        """Parses an expression like Expr into the tree Expr builds, but
+           with the level nodes that would have one child recorded in
+           elided instead of made. A level node is only made when an
+           operator goes under it, around the operand already parsed."""
+        top = self.current
+        container = top
+        # the levels still open, innermost last, each with the node its
+        # next operator goes under, None while the level has no node and
+        # False once a comparison is done, and the node, position and line
+        # its node takes or would take
+        open = []
+        level = 0
+        consumed = False
+        while True:
+            pos = len(container.children)
+            line = self.currentLine
+            while level < len(LEVELS):
+                open.append([level, None, container, pos, line])
+                level += 1
+            node = container
+            # the unary operators, each with the line of the '#High#' node
+            # left out under it
+            unary = []
+            while self.kind in UNARY:
+                node = node.addChild(self.tokenNode(UNARY[self.kind], 'OP'))
+                self.kind = self.getNextToken()
+                unary.append((node, self.currentLine))
+                consumed = True
+            self.current = node
+            if not self.End():
+                if consumed:
+                    raise self.syntaxError()
+                self.current = top
+                return False
+            for node, line in reversed(unary):
+                self.record(node.children[0], '#High#', line)
+            # close levels until one goes on with an operator
+            while open:
+                entry = open[-1]
+                level, under, container, pos, line = entry
+                if under is not False and BINARY.get(self.kind) == level:
+                    if under is None:
+                        under = self.makeNode(LEVELS[level], line)
+                        child = container.children[pos]
+                        container.children[pos] = under
+                        under.parent = container
+                        under.addChild(child)
+                    container = under.addChild(self.tokenNode(type='OP'))
+                    self.kind = self.getNextToken()
+                    consumed = True
+                    entry[1] = container if level else False
+                    level += 1
+                    break
+                if under is None:
+                    self.record(container.children[pos], LEVELS[level], line)
+                open.pop()
+            else:
+                self.current = top
+                return True
 
-    def MedPrime(self):
-        """Grammar Rule:
-            MedPrime  -> '*' High MedPrime
-               | '/' High MedPrime
-               | '%' High MedPrime
-               | nullProduction
-        """
-        if self.token == ('OP', '*') or self.token == ('OP', '/') or self.token == ('OP', '%'):
-                self.current = self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-                self.token = self.getNextToken()
-                if self.High():
-                    res = self.MedPrime()
-                    self.current = self.current.parent
-                    return res
-                raise SyntaxError(self.getCurrentLine(), self.token)
-        # empty string
+    def compactExpression(self):
+        """Parses an expression into a compact tree: operators are the
+           parents of their operands, binary ones left associative, and
+           there are no '#rule#' nodes."""
+        top = self.current
+        operands = []
+        # pending binary operators, innermost last, with their levels
+        operators = []
+        compared = False
+        while True:
+            prefixes = []
+            while self.kind in UNARY:
+                prefixes.append(self.tokenNode(UNARY[self.kind], 'OP'))
+                self.kind = self.getNextToken()
+            operand = self.compactOperand()
+            if operand is None:
+                if prefixes or operators:
+                    raise self.syntaxError()
+                self.current = top
+                return False
+            for prefix in reversed(prefixes):
+                prefix.addChild(operand)
+                operand = prefix
+            operands.append(operand)
+            level = BINARY.get(self.kind)
+            if level is None or (level == 0 and compared):
+                break
+            compared = compared or level == 0
+            while operators and operators[-1][0] >= level:
+                combine(operators.pop()[1], operands)
+            operators.append((level, self.tokenNode(type='OP')))
+            self.kind = self.getNextToken()
+        while operators:
+            combine(operators.pop()[1], operands)
+        self.current = top
+        top.addChild(operands[0])
         return True
 
-    @makenode
-    def High(self):
-        """Grammar Rule:
-            High -> '-' High
-               | '?' High
-               | End
-        """
-        if self.End():
-            # rewind tree
-            return True
-        elif self.token == ("OP", '-') or self.token == ('OP', '?'):
-                if self.token == ("OP", '-'):
-                    self.current = self.current.addChild(Node('neg', self.currentLine, self.token[0]))
-                else:
-                    self.current = self.current.addChild(Node('?', self.currentLine, self.token[0]))
-                self.token = self.getNextToken()
-                if not self.High():
-                    raise SyntaxError(self.getCurrentLine(), self.token)
-                self.current = self.current.parent
-                return True
-        # empty string
-        return False
+    def compactOperand(self):
+        """Parses an operand with End and returns its node, not yet added
+           to the tree, or None if there is no operand. An assignment
+           becomes a ':=' node over the target and the value, and the
+           arguments of a call go right under it."""
+        holder = self.current = self.makeNode('#End#')
+        if not self.End():
+            return None
+        children = holder.children[0].children
+        node = children[0]
+        if node.type == 'procCall' and node.children:
+            call = node.children[0]
+            node.children = call.children
+            for child in node.children:
+                child.parent = node
+        if len(children) == 2:
+            assign = children[1]
+            assign.children.insert(0, node)
+            node.parent = assign
+            node = assign
+        return node
 
     @makenode
     def End(self):
@@ -569,33 +1038,34 @@ class ice9Parser:
                | id '(' ProcCall
                | id lvaluePrime ValueOrAssn
         """
-        if self.token[1] == '(':
-            self.current = self.current.addChild(Node('()', self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == LPAREN:
+            self.current = self.current.addChild(self.tokenNode('()'))
+            self.kind = self.getNextToken()
             if self.Expr():
-                if self.token[1] == ')':
+                if self.kind == RPAREN:
                     self.current = self.current.parent
-                    self.token = self.getNextToken()
+                    self.kind = self.getNextToken()
                     return True
-            raise SyntaxError(self.getCurrentLine(), self.token)
-        elif self.token[0] == 'INT' or self.token[0] == "STR":
-            self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-            self.token = self.getNextToken()
+            raise self.syntaxError()
+        elif self.kind == INT or self.kind == STR:
+            self.current.addChild(self.tokenNode(type=CATEGORY[self.kind]))
+            self.kind = self.getNextToken()
             return True
-        elif self.token[0] == 'KEY':
-            if self.token[1] == 'true' or self.token[1] == 'false' or self.token[1] == 'read':
-                if self.token[1] == 'true' or self.token[1] == 'false':
-                    self.current.addChild(Node(self.token[1], self.currentLine, 'bool'))
+        elif CATEGORY[self.kind] == 'KEY':
+            if self.kind == TRUE or self.kind == FALSE or self.kind == READ:
+                if self.kind == TRUE or self.kind == FALSE:
+                    self.current.addChild(self.tokenNode(type='bool'))
                 else:
-                    self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-                self.token = self.getNextToken()
+                    self.current.addChild(self.tokenNode(type=CATEGORY[self.kind]))
+                self.kind = self.getNextToken()
                 return True
             return False
-        elif self.token[0] == "ID":
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine, self.token[0]))
-            self.token = self.getNextToken()
-            if self.token[0] == 'SYM' and self.token[1] == '(':
-                self.token = self.getNextToken()
+        elif self.kind == ID:
+            self.current = self.current.addChild(
+                self.symbols.use(self.idNode(CATEGORY[self.kind])))
+            self.kind = self.getNextToken()
+            if self.kind == LPAREN:
+                self.kind = self.getNextToken()
                 res = self.ProcCall()
                 if res:
                     self.current.type = 'procCall'
@@ -611,40 +1081,40 @@ class ice9Parser:
     def LValuePrime(self):
         """Grammar Rule: lvaluePrime -> '[' Expr ']' lValuePrime |
         nullProduction"""
-        if self.token[0] == 'SYM' and self.token[1] == '[':
-            self.current = self.current.addChild(Node('[]', self.currentLine))
-            self.token = self.getNextToken()
+        if self.kind == LBRACK:
+            self.current = self.current.addChild(self.tokenNode('[]'))
+            self.kind = self.getNextToken()
             if self.Expr():
-                if self.token[0] == 'SYM' and self.token[1] == ']':
+                if self.kind == RBRACK:
                     self.current = self.current.parent
-                    self.token = self.getNextToken()
+                    self.kind = self.getNextToken()
                     return self.LValuePrime()
 
-            raise SyntaxError(self.getCurrentLine(), self.token)
+            raise self.syntaxError()
         return True
 
     def Assn(self):
         """Grammar Rule: ValueOrAssn -> ':=' Expr | nullProduction"""
-        if self.token[0] == 'SYM' and self.token[1] == ':=':
-            self.current = self.current.addChild(Node(self.token[1], self.currentLine, 'OP'))
-            self.token = self.getNextToken()
+        if self.kind == ASSIGN:
+            self.current = self.current.addChild(self.tokenNode(type='OP'))
+            self.kind = self.getNextToken()
             if not self.Expr():
-                raise SyntaxError(self.getCurrentLine(), self.token)
+                raise self.syntaxError()
             self.current = self.current.parent
         return True
 
     @makenode
     def ProcCall(self):
         """Grammar Rule: ProcCall -> Expr { ',' Expr } ')' | ')'"""
-        if self.token[0] == 'SYM' and self.token[1] == ')':
-            self.token = self.getNextToken()
+        if self.kind == RPAREN:
+            self.kind = self.getNextToken()
             return True
         else:
             while self.Expr():
-                if self.token[0] == 'SYM' and self.token[1] == ",":
-                    self.token = self.getNextToken()
-                elif self.token[0] == 'SYM' and self.token[1] == ')':
-                    self.token = self.getNextToken()
+                if self.kind == COMMA:
+                    self.kind = self.getNextToken()
+                elif self.kind == RPAREN:
+                    self.kind = self.getNextToken()
                     return True
             return False
 
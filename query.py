@@ -0,0 +1,371 @@
+#!/usr/bin/python
+"""Finds nodes of a parse tree by kind, type or selector without walking it.
+
+   A TreeIndex walks a tree once and lists its nodes by kind, the data of a
+   node with the '#' of a rule node left off, so '#proc#' and 'proc' are
+   both of kind proc, and by type. Lookups return the nodes in document
+   order. The index follows the changes addChild, addParent, remove and
+   inPlaceRemove make to the tree as they happen. Code that changes the
+   children, data or type of a node directly has to tell the index with
+   update, or build a new one.
+
+   Selectors are compounds separated by '>', for a child, or by spaces, for
+   a descendant, like 'proc > fa :=' or 'End > [type=procCall]'. A compound
+   is a kind, '*' for any, or a "quoted" kind like "[]", followed by tests
+   of an attribute in brackets: [type=procCall], [data="a b"], [line=3]
+   or [type] for a type that is set. The nodes for the last compound come
+   from the index and the rest are checked against their ancestors. A kind
+   is also the name of every id with that name, as ids are kept as they
+   are, so 'End' finds ids named End too. [data=#End#] does not.
+"""
+
+import re
+import tree
+import weakref
+
+
+# a selector token: a '>', an attribute test, a quoted kind or a kind
+TOKEN = re.compile(r'''(>)
+    |\[\s*(\w+)\s*(?:=\s*(?:"([^"]*)"|([^\]\s"]*))\s*)?\]
+    |"([^"]*)"
+    |([^\s>\["]+)''', re.X)
+
+# the attributes a selector can test
+ATTRIBUTES = frozenset(['data', 'type', 'line'])
+
+# how a compound is related to the one before it
+CHILD, DESCENDANT = range(2)
+
+
+def kindOf(data):
+    """Returns the kind of a node with the given data."""
+    if isinstance(data, str) and len(data) > 2 and data[0] == '#' and \
+       data[-1] == '#':
+        return data[1:-1]
+    return data
+
+
+def unwatch(ref, keys):
+    """Stops telling the index behind a weak reference about changes to
+       the nodes whose ids are the keys of keys."""
+    if ref not in tree.watchers:
+        return
+    tree.watchers.remove(ref)
+    indexed = tree.indexed
+    for key in keys:
+        if indexed[key] == 1:
+            del indexed[key]
+        else:
+            indexed[key] -= 1
+
+
+class Entry(object):
+    """The nodes of one kind or type. order is the nodes in document order,
+       None if it has to be sorted again, and stale if nodes have left
+       since it was last filtered."""
+    __slots__ = ('nodes', 'order', 'stale')
+
+    def __init__(self):
+        self.nodes = {}
+        self.order = []
+        self.stale = False
+
+
+class Selector(object):
+    """A parsed selector, compounds with the combinators that join them.
+       Each compound is a kind, None for any, and a list of (attribute,
+       value) tests, value None for any value but None."""
+
+    def __init__(self, text):
+        """Constructor. Raises ValueError if text is not a selector."""
+        self.text = text
+        self.compounds = []
+        self.combinators = []
+        combinator = None
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            spaced = text[pos].isspace()
+            while text[pos].isspace():
+                pos += 1
+            match = TOKEN.match(text, pos)
+            if match is None:
+                raise ValueError("bad selector %r at %d" % (self.text, pos))
+            pos = match.end()
+            child, attribute, quoted, value, name, bare = match.groups()
+            if child:
+                if combinator is not None or not self.compounds:
+                    raise ValueError("misplaced '>' in selector %r"
+                                     % self.text)
+                combinator = CHILD
+                continue
+            if attribute is not None and not spaced and combinator is None \
+               and self.compounds:
+                if attribute not in ATTRIBUTES:
+                    raise ValueError("unknown attribute %r in selector %r"
+                                     % (attribute, self.text))
+                self.compounds[-1][1].append(
+                    (attribute, quoted if quoted is not None else value))
+                continue
+            if self.compounds:
+                self.combinators.append(DESCENDANT if combinator is None
+                                        else combinator)
+            elif combinator is not None:
+                raise ValueError("misplaced '>' in selector %r" % self.text)
+            combinator = None
+            if attribute is not None:
+                if attribute not in ATTRIBUTES:
+                    raise ValueError("unknown attribute %r in selector %r"
+                                     % (attribute, self.text))
+                self.compounds.append(
+                    (None, [(attribute,
+                             quoted if quoted is not None else value)]))
+            else:
+                kind = name if name is not None else bare
+                self.compounds.append(
+                    (None if kind == '*' else kindOf(kind), []))
+        if not self.compounds or combinator is not None:
+            raise ValueError("incomplete selector %r" % self.text)
+
+
+def matches(node, compound):
+    """True if node matches a compound of a Selector."""
+    kind, tests = compound
+    if kind is not None and kindOf(node.data) != kind:
+        return False
+    for attribute, value in tests:
+        actual = getattr(node, attribute)
+        if actual is None:
+            return False
+        if value is not None and str(actual) != value:
+            return False
+    return True
+
+
+def ancestry(node, selector, index, within=None, memo=None):
+    """True if the ancestors of node match the compounds of selector up to
+       index, joined the way the selector says. Only ancestors whose ids
+       are in within count, if it is given. memo keeps what was found about
+       the ancestors of one node for the next, which often shares them."""
+    if index < 0:
+        return True
+    compound = selector.compounds[index]
+    parent = node.parent
+    if selector.combinators[index] == CHILD:
+        return parent is not None and \
+            (within is None or id(parent) in within) and \
+            matches(parent, compound) and \
+            ancestry(parent, selector, index - 1, within, memo)
+    if memo is None:
+        memo = {}
+    # the ancestors looked at, which have a match at or above them if one
+    # of them does
+    path = []
+    found = False
+    while parent is not None and (within is None or id(parent) in within):
+        key = id(parent), index
+        known = memo.get(key)
+        if known is not None:
+            found = known
+            break
+        path.append(key)
+        if matches(parent, compound) and \
+           ancestry(parent, selector, index - 1, within, memo):
+            found = True
+            break
+        parent = parent.parent
+    for key in path:
+        memo[key] = found
+    return found
+
+
+class TreeIndex(object):
+    """The nodes of a tree by kind and type, kept up to date as the tree
+       is changed through the methods of Node."""
+
+    def __init__(self, root):
+        """Constructor that indexes the tree under root."""
+        self.root = root
+        self.kinds = {}
+        self.types = {}
+        # every node, by id, with the kind and type it is listed under
+        self.keys = {}
+        self.everything = Entry()
+        for node in root.iterPreorder():
+            self.add(node, True)
+        keys = self.keys
+        self.watch = weakref.ref(self, lambda ref: unwatch(ref, keys))
+        tree.watchers.append(self.watch)
+
+    def close(self):
+        """Stops following changes to the tree and empties the index."""
+        unwatch(self.watch, self.keys)
+        self.kinds = {}
+        self.types = {}
+        self.keys = {}
+        self.everything = Entry()
+
+    def __len__(self):
+        """Returns the number of nodes in the tree."""
+        return len(self.keys)
+
+    def __contains__(self, node):
+        """True if node is in the tree."""
+        return id(node) in self.keys
+
+    def entries(self, node, kind, type):
+        """Returns the entries a node of the given kind and type goes in."""
+        entries = [self.everything, self.kinds.get(kind)]
+        if entries[1] is None:
+            entries[1] = self.kinds[kind] = Entry()
+        if type is not None:
+            entry = self.types.get(type)
+            if entry is None:
+                entry = self.types[type] = Entry()
+            entries.append(entry)
+        return entries
+
+    def add(self, node, last=False):
+        """Lists a node that is new to the tree. If last it follows every
+           node listed so far in document order, as while the index is
+           built, otherwise the lists it goes in are sorted again."""
+        kind = kindOf(node.data)
+        self.keys[id(node)] = (kind, node.type)
+        tree.indexed[id(node)] = tree.indexed.get(id(node), 0) + 1
+        for entry in self.entries(node, kind, node.type):
+            entry.nodes[id(node)] = node
+            if not last:
+                entry.order = None
+            elif entry.order is not None:
+                entry.order.append(node)
+
+    def drop(self, node):
+        """Takes a node out of the lists it is in."""
+        kind, type = self.keys.pop(id(node))
+        if tree.indexed[id(node)] == 1:
+            del tree.indexed[id(node)]
+        else:
+            tree.indexed[id(node)] -= 1
+        for entry in self.entries(node, kind, type):
+            del entry.nodes[id(node)]
+            entry.stale = True
+
+    def moved(self, node):
+        """Has the lists of a node sorted again."""
+        kind, type = self.keys[id(node)]
+        for entry in self.entries(node, kind, type):
+            entry.order = None
+
+    def added(self, node):
+        """Follows node and its subtree being added to a node, or nodes of
+           the tree being moved under it."""
+        parent = node.parent
+        if parent is None or id(parent) not in self.keys:
+            return
+        for node in node.iterPreorder():
+            if id(node) in self.keys:
+                self.moved(node)
+            else:
+                self.add(node)
+
+    def removed(self, node, subtree=True):
+        """Follows node, and its subtree unless subtree is false, leaving
+           the tree."""
+        if id(node) not in self.keys:
+            return
+        if not subtree:
+            self.drop(node)
+            return
+        for node in node.iterPreorder():
+            if id(node) in self.keys:
+                self.drop(node)
+
+    def replaced(self, node, child):
+        """Follows node leaving the tree and its only child taking its
+           place."""
+        if id(node) not in self.keys:
+            return
+        self.drop(node)
+        if node is self.root:
+            self.root = child
+        else:
+            self.added(child)
+
+    def update(self, node):
+        """Lists node under its current data and type, and its subtree as
+           it is now, after they were changed directly."""
+        self.removed(node)
+        if node is self.root or (node.parent is not None and
+                                 node in node.parent.children):
+            for node in node.iterPreorder():
+                self.add(node)
+
+    def ordered(self, entry):
+        """Returns the nodes of an entry in document order."""
+        if entry.order is None:
+            entry.order = self.sort(entry.nodes.values())
+        elif entry.stale:
+            nodes = entry.nodes
+            entry.order = [node for node in entry.order if id(node) in nodes]
+        entry.stale = False
+        return entry.order
+
+    def sort(self, nodes):
+        """Returns nodes of the tree sorted in document order, by the
+           positions of them and their ancestors among their siblings."""
+        positions = {}
+
+        def path(node):
+            steps = []
+            parent = node.parent
+            while parent is not None:
+                where = positions.get(id(parent))
+                if where is None:
+                    where = positions[id(parent)] = dict(
+                        (id(child), i)
+                        for i, child in enumerate(parent.children))
+                steps.append(where[id(node)])
+                node = parent
+                parent = node.parent
+            steps.reverse()
+            return steps
+        return sorted(nodes, key=path)
+
+    def kind(self, kind):
+        """Returns the nodes of a kind, such as 'proc' or '#proc#' for the
+           nodes of proc declarations, or ':=', in document order."""
+        entry = self.kinds.get(kindOf(kind))
+        if entry is None:
+            return []
+        return list(self.ordered(entry))
+
+    def type(self, type):
+        """Returns the nodes of a type, such as 'procCall', in document
+           order."""
+        entry = self.types.get(type)
+        if entry is None:
+            return []
+        return list(self.ordered(entry))
+
+    def select(self, selector):
+        """Returns the nodes matching a selector, a string or Selector, in
+           document order. Raises ValueError for a bad selector."""
+        if not isinstance(selector, Selector):
+            selector = Selector(selector)
+        last = len(selector.compounds) - 1
+        kind, tests = selector.compounds[last]
+        entry = self.everything
+        if kind is not None:
+            entry = self.kinds.get(kind)
+        else:
+            for attribute, value in tests:
+                if attribute == 'type':
+                    entry = self.types.get(value) if value is not None \
+                        else entry
+                    break
+        if entry is None:
+            return []
+        memo = {}
+        return [node for node in self.ordered(entry)
+                if matches(node, selector.compounds[last]) and
+                ancestry(node, selector, last - 1, self.keys, memo)]
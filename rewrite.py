@@ -0,0 +1,187 @@
+#!/usr/bin/python
+"""Rewrites parse trees with passes run together in one traversal.
+
+   A Pass has a handler for each kind of node it rewrites, kinds as in
+   query, so 'Stm' and '#Stm#' are the same. A handler is called with a
+   node once everything under it has been rewritten and returns None to
+   keep it, which includes changing its data or type in place, another
+   node to put in its place, which can have the node under it, or a list
+   of nodes to put in its place, empty to drop it or its children to
+   splice them into its parent.
+
+   A PassManager runs its passes in order, putting passes that can share
+   a traversal together and making one postorder walk for each group. At
+   a node the passes of the group run one after the other, each seeing
+   what the ones before it made of the node. That is the tree the pass
+   would see running on its own as long as its handlers look no further
+   than the node and what is under it, which they are free to change. A
+   pass that has to see more sets fusable to False and gets a walk of its
+   own. Nodes a handler makes are not visited by the passes of its group
+   other than the node or nodes it returns.
+
+   The new children of a node are collected as the walk goes through
+   them and put in place once, so each change costs the same however many
+   siblings a node has, where remove, addParent and inPlaceRemove look
+   the node up among them. Indexes from query follow the changes.
+"""
+
+from query import kindOf
+import tree
+
+
+# what a handler returns to drop a node and its subtree
+REMOVE = ()
+
+
+class Pass(object):
+    """A rewrite of a tree, as a handler for each kind of node it changes.
+       The handlers are kept by data, under both forms of each kind."""
+
+    # False if the handlers look at more than a node and its subtree, such
+    # as its parent, its siblings or what other passes do to the tree
+    fusable = True
+
+    def __init__(self, handlers=None):
+        """Constructor, with handlers by kind."""
+        self.handlers = {}
+        for kind, handler in (handlers or {}).iteritems():
+            self.on(kind, handler)
+
+    def on(self, kind, handler):
+        """Has handler called on the nodes of a kind. Returns the pass."""
+        kind = kindOf(kind)
+        self.handlers[kind] = handler
+        self.handlers['#%s#' % kind] = handler
+        return self
+
+
+class PassManager(object):
+    """Runs passes over trees, fusing the passes that can share a walk."""
+
+    def __init__(self, passes=()):
+        """Constructor, with the passes to run in order."""
+        self.passes = list(passes)
+
+    def add(self, rewrite):
+        """Adds a pass to run after the others. Returns the pass."""
+        self.passes.append(rewrite)
+        return rewrite
+
+    def groups(self):
+        """Returns the passes split into the groups that share a walk,
+           runs of fusable passes and each other pass on its own."""
+        groups = []
+        for rewrite in self.passes:
+            if rewrite.fusable and groups and groups[-1][-1].fusable:
+                groups[-1].append(rewrite)
+            else:
+                groups.append([rewrite])
+        return groups
+
+    def run(self, root):
+        """Runs the passes over the tree under root and returns the root of
+           the result, which is a different node if a handler replaced
+           it, or None if one dropped it. Raises ValueError if a handler
+           replaces the root with several nodes."""
+        for group in self.groups():
+            if root is None:
+                break
+            root = rewrite(root, [each.handlers for each in group])
+        return root
+
+
+def visit(node, tables):
+    """Runs the handlers of tables, one table per pass, on node. Returns
+       the nodes to put in its place, or None to keep it."""
+    items = None
+    for handlers in tables:
+        if items is None:
+            handler = handlers.get(node.data)
+            if handler is None:
+                continue
+            result = handler(node)
+            if result is None:
+                continue
+            if isinstance(result, (list, tuple)):
+                items = list(result)
+            else:
+                node = result
+                items = [node]
+        else:
+            changed = []
+            for item in items:
+                handler = handlers.get(item.data)
+                result = None if handler is None else handler(item)
+                if result is None:
+                    changed.append(item)
+                elif isinstance(result, (list, tuple)):
+                    changed.extend(result)
+                else:
+                    changed.append(result)
+            items = changed
+    return items
+
+
+def rewrite(root, tables):
+    """Runs the handlers of tables, one table per pass, over the tree
+       under root in one postorder walk, without recursion. Returns the
+       root of the result, see PassManager.run."""
+    live = set()
+    for handlers in tables:
+        live.update(handlers)
+    # a frame per node on the path down: the node, its children, where the
+    # walk is among them and its new children, None while they are the
+    # ones it had
+    stack = [[root, root.children, 0, None]]
+    while True:
+        frame = stack[-1]
+        node, children, pos, kept = frame
+        if pos < len(children):
+            frame[2] = pos + 1
+            child = children[pos]
+            if child.children:
+                stack.append([child, child.children, 0, None])
+                continue
+            items = visit(child, tables) if child.data in live else None
+        else:
+            stack.pop()
+            if kept is not None:
+                place(node, kept)
+            items = visit(node, tables) if node.data in live else None
+            if not stack:
+                break
+            frame = stack[-1]
+            pos = frame[2] - 1
+            child = node
+        if items is None or (len(items) == 1 and items[0] is child):
+            if frame[3] is not None:
+                frame[3].append(child)
+            continue
+        if frame[3] is None:
+            frame[3] = frame[1][:pos]
+        frame[3].extend(items)
+    if items is None:
+        return root
+    if len(items) > 1:
+        raise ValueError("the root was replaced by %d nodes" % len(items))
+    if not items:
+        return None
+    items[0].parent = None
+    return items[0]
+
+
+def place(node, children):
+    """Gives node its new children, telling the indexes watching it."""
+    old = node.children
+    node.children = children
+    for child in children:
+        child.parent = node
+    if tree.indexed and id(node) in tree.indexed:
+        kept = set(map(id, children))
+        for child in old:
+            if id(child) not in kept:
+                tree.notify('removed', child)
+        were = set(map(id, old))
+        for child in children:
+            if id(child) not in were:
+                tree.notify('added', child)
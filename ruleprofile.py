@@ -0,0 +1,162 @@
+#!/usr/bin/python
+"""Profiles the rules of the recursive descent parser.
+
+   RuleProfiler.install puts instrumented copies of the rule methods on one
+   ice9Parser, so parsers it is not installed on run the plain methods and
+   pay nothing for it. For each rule it records the calls, how many
+   succeeded and failed, the nodes it created and the '#rule#' nodes it
+   dropped along with anything under them, its cumulative and self time,
+   and how deeply it recursed into itself. Nodes are counted by standing
+   in for the makeNode of the parser it is installed on. The report
+   is a table, or collapsed stacks of self time in microseconds, one line
+   per call path, which flamegraph.pl and speedscope read.
+"""
+
+from tree import Node
+import parser
+import time
+
+
+# the rules that are not wrapped by makenode, so they open no '#rule#' node
+PLAIN = ('Goal', 'Program', 'procPrime', 'procEnd', 'declist', 'Expr',
+         'LValuePrime', 'Assn')
+
+# the columns of the table, with the attributes of RuleStats they show
+COLUMNS = [('calls', 'calls'), ('ok', 'succeeded'), ('failed', 'failed'),
+           ('created', 'created'), ('dropped', 'discarded'),
+           ('cum ms', 'cumulative'), ('self ms', 'self'),
+           ('depth', 'maxDepth')]
+
+
+class RuleStats(object):
+    """What a RuleProfiler recorded for one rule. Times are in seconds."""
+    __slots__ = ('calls', 'succeeded', 'failed', 'created', 'discarded',
+                 'cumulative', 'self', 'depth', 'maxDepth')
+
+    def __init__(self):
+        """Constructor. depth is how many calls of the rule are running."""
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class RuleProfiler(object):
+    """Collects RuleStats for the rules of the parsers it is installed on."""
+
+    def __init__(self, timer=time.time):
+        """Constructor. timer returns the time in seconds."""
+        self.timer = timer
+        self.stats = {}
+        # calls in progress, innermost last, each [stats, name, start, time
+        # spent in the rules it called]
+        self.frames = []
+        # the self time of each call path, a tuple of rule names
+        self.stacks = {}
+
+    def install(self, p):
+        """Replaces the rule methods and makeNode of the ice9Parser p with
+           instrumented ones. Raises ValueError unless p uses the recursive
+           engine."""
+        if p.engine != 'recursive':
+            raise ValueError("profiling needs the recursive engine")
+        for name, method in vars(parser.ice9Parser).items():
+            rule = getattr(method, 'rule', None)
+            if rule is not None:
+                setattr(p, name, self.wrap(p, name, rule, True))
+        for name in PLAIN:
+            rule = getattr(parser.ice9Parser, name).im_func
+            setattr(p, name, self.wrap(p, name, rule, False))
+        p.makeNode = self.node
+        return p
+
+    def node(self, *args):
+        """Stands in for ice9Parser.makeNode, counting the node for the
+           innermost rule being parsed."""
+        if self.frames:
+            self.frames[-1][0].created += 1
+        return Node(*args)
+
+    def wrap(self, p, name, rule, wrapped):
+        """Returns an instrumented version of the function rule, called on
+           p. If wrapped it opens a '#rule#' node like makenode does."""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = RuleStats()
+        frames = self.frames
+        timer = self.timer
+
+        def profiled():
+            stats.calls += 1
+            stats.depth += 1
+            if stats.depth > stats.maxDepth:
+                stats.maxDepth = stats.depth
+            frame = [stats, name, timer(), 0.0]
+            frames.append(frame)
+            val = False
+            try:
+                if not wrapped:
+                    val = rule(p)
+                    return val
+                p.current = p.current.addChild(
+                    self.node('#' + name + '#', p.currentLine))
+                val = rule(p)
+                if val and len(p.current.children):
+                    node = p.current
+                    p.current = node.parent
+                    if name in p.passThrough and len(node.children) == 1:
+                        p.elide(node)
+                else:
+                    node = p.current.remove()
+                    p.current = node.parent
+                    if node.children:
+                        p.symbols.discard(node)
+                    stats.discarded += sum(1 for n in node.iterPreorder())
+                return val
+            finally:
+                self.finish(frame, val)
+        profiled.__name__ = name
+        return profiled
+
+    def finish(self, frame, val):
+        """Records the end of the call frame, which returned val."""
+        stats, name, start, inner = frame
+        elapsed = self.timer() - start
+        if val:
+            stats.succeeded += 1
+        else:
+            stats.failed += 1
+        stats.depth -= 1
+        if not stats.depth:
+            # time spent in a recursive call is already in the outer one
+            stats.cumulative += elapsed
+        stats.self += elapsed - inner
+        path = tuple(entry[1] for entry in self.frames)
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - inner
+        self.frames.pop()
+        if self.frames:
+            self.frames[-1][3] += elapsed
+
+    def table(self):
+        """Returns the report as lines of a table, the rule that took the
+           most self time first."""
+        header = "%-14s" % 'rule' + ''.join("%9s" % title
+                                             for title, name in COLUMNS)
+        lines = [header]
+        for name, stats in sorted(self.stats.items(),
+                                  key=lambda item: -item[1].self):
+            if not stats.calls:
+                continue
+            line = "%-14s" % name
+            for title, attribute in COLUMNS:
+                value = getattr(stats, attribute)
+                if isinstance(value, float):
+                    line += "%9.2f" % (value * 1000)
+                else:
+                    line += "%9d" % value
+            lines.append(line)
+        return lines
+
+    def collapsed(self):
+        """Returns the report as collapsed stacks, one 'rule;rule;... time'
+           line per call path with its self time in microseconds."""
+        return ["%s %d" % (';'.join(path), round(elapsed * 1000000))
+                for path, elapsed in sorted(self.stacks.items())]
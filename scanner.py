@@ -1,85 +1,225 @@
 #!/usr/bin/python
 
-#Handle deprecation of sre module for version of python prior to 2.5
-try:
-    from re import Scanner
-except ImportError:
-    from sre import Scanner
-
+from tokens import TokenBuffer, TEXT_KINDS, ID, INT, STR, NL as NL_KIND, EOF
+import mmap
+import re
 import sys
 
 
-class ice9Scanner:
-    """Class that creates an ice9 lexical scanner."""
-
-    def __init__(self):
-        """Constructor. Simply initializes the current line to 1."""
-        self.line = 1
+# Every token in a single compiled pattern. Alternatives are tried in order,
+# so '->' is a symbol before '-' is an operator. Keywords are matched as ID
+# and told apart with a lookup in KEYWORDS.
+PATTERN = r"""
+      (?P<NL>\n)
+    | (?P<ID>[A-Za-z][A-Za-z0-9_]*)
+    | (?P<SYM>->|\(|\)|\[\]|\[|\]|;|:=|:|,)
+    | (?P<OP>!=|>=|<=|[-+/*=%?<>])
+    | (?P<INT>[0-9]+)
+    | (?P<STR>"[^"\n]*"|'[^'\n]*')
+    | (?P<SKIP>[\t\ ]+|\#[^\n]*)
+    | (?P<ERR>.)
+    """
+TOKENS = re.compile(PATTERN, re.VERBOSE)
+
+# The same without NL tokens, for scanBuffer. Newlines are skipped along
+# with the blanks around them, and lines are found from token offsets.
+OFFSET_TOKENS = re.compile(PATTERN.replace(r"(?P<NL>\n)" + "\n    |", "")
+                           .replace(r"[\t\ ]+", r"[\t\ \n]+"), re.VERBOSE)
+
+KEYWORDS = frozenset([
+    'if', 'fi', 'else', 'do', 'od', 'fa', 'af', 'to', 'proc', 'end',
+    'return', 'forward', 'var', 'type', 'break', 'exit', 'true', 'false',
+    'writes', 'write', 'read'])
+
+NL = ('NL', 'NL')
+
+# kinds of the pattern groups whose tokens do not have a fixed text
+GROUP_KINDS = {'NL': NL_KIND, 'INT': INT, 'STR': STR}
+
+
+def tokenize(text):
+    """Splits text into tokens. Returns the list of tokens and the first
+       illegal character, or None if the whole text was scanned."""
+    tokens, illegal, last = splitTokens(text)
+    return tokens, illegal
+
+
+def splitTokens(text):
+    """Splits text into tokens like tokenize, also returning the match of
+       the last token, blank or illegal character scanned, or None."""
+    tokens = []
+    append = tokens.append
+    keywords = KEYWORDS
+    match = None
+    for match in TOKENS.finditer(text):
+        kind = match.lastgroup
+        if kind == 'ID':
+            value = match.group()
+            if value in keywords:
+                append(('KEY', value))
+            else:
+                append(('ID', value))
+        elif kind == 'SKIP':
+            continue
+        elif kind == 'NL':
+            append(NL)
+        elif kind == 'ERR':
+            return tokens, match.group(), match
+        else:
+            append((kind, match.group()))
+    return tokens, None, match
 
-    # Token definitions
-    def ignore(self, scanner, token):
-        """For tokens that should be ignored."""
-        pass
 
-    def key(self, scanner, token):
-        """For tokens that are keywords."""
-        return "KEY", token
+def mapFile(filename):
+    """Maps a file into memory read only, for scanBuffer."""
+    f = open(filename, 'rb')
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return ''
+    finally:
+        f.close()
 
-    def identifier(self, scanner, token):
-        """For tokens that are identifiers."""
-        return "ID", token
 
-    def operator(self, scanner, token):
-        """For tokens that are operators."""
-        return "OP", token
+class LexicalError(Exception):
+    """A custom exception to represent a lexical error."""
+    def __init__(self, line, char, column=None):
+        """Constructor that stores the line and column, if known, and the
+           illegal character."""
+        self.line = line
+        self.column = column
+        self.char = char
 
-    def symbol(self, scanner, token):
-        """For tokens that are symbols."""
-        return "SYM", token
+    def __str__(self):
+        """Custom string representation of this exception."""
+        return "line %s: illegal character (%s)" % (self.line, self.char)
 
-    def integer(self, scanner, token):
-        """For tokens that are integers."""
-        return "INT", token
 
-    def newline(self, scanner, token):
-        """For tokens that are newlines. Increase line count."""
-        self.line += 1
-        return "NL", "NL"
+class ice9Scanner:
+    """Class that creates an ice9 lexical scanner."""
 
-    def string(self, scanner, token):
-        """For tokens that are strings."""
-        return "STR", token
+    def __init__(self):
+        """Constructor. Simply initializes the current line to 1."""
+        self.line = 1
 
     def scan(self, input):
         """Preforms the scan of the input and outputs any errors including
            line on which the lexical error occured."""
-        scanner = Scanner([
-            (r"[\n]", self.newline),
-            (r"\"[^\"\n]*\"", self.string),
-            (r"\'[^\'\n]*\'", self.string),
-            (r"\b(if|fi|else|do|od|fa|af|to|proc)\b", self.key),
-            (r"\b(end|return|forward|var|type|break)\b", self.key),
-            (r"\b(exit|true|false|writes|write|read)\b", self.key),
-            (r"[A-Za-z][A-Za-z0-9_]*", self.identifier),
-            (r"\-\>|\(|\)|\[\]|\[|\]|;|:\=|:|\,", self.symbol),
-            (r"\+|\-|\/|\*|\=|\%|!\=|\>=|\<=|\>|\<|\?", self.operator),
-            (r"[0-9]+", self.integer),
-            (r"#.*(?=\n?)", self.ignore),
-            (r"[\t ]+", self.ignore),
-            ])
-        tokens, remainder = scanner.scan(input)
+        tokens, illegal = tokenize(input)
+        # the line the scan ended on, which is where an illegal character
+        # was found
+        self.line = 1 + tokens.count(NL)
         tokens.append(('EOF', 'EOF'))
 
-        if remainder:
-            print "line %s: illegal character (%s)" % (
-                    self.line, remainder[:1])
+        if illegal:
+            print "line %s: illegal character (%s)" % (self.line, illegal)
             sys.exit(1)
         else:
             return tokens
 
+    def scanBuffer(self, input, errors=None, lines=False):
+        """Scans the input into a TokenBuffer ending with the EOF token.
+           The input can be a string or anything exposing the buffer
+           interface, such as an mmap. The re module cannot read a
+           memoryview, so those are copied first. Newlines only become NL
+           tokens if lines is true. Raises LexicalError on an illegal
+           character, unless errors is a list, in which case the
+           LexicalError is appended to it and the character skipped."""
+        if isinstance(input, memoryview):
+            input = input.tobytes()
+        tokens = TokenBuffer(input, lines)
+        kinds = tokens.kinds.append
+        starts = tokens.starts.append
+        ends = tokens.ends.append
+        textKinds = TEXT_KINDS
+        groupKinds = GROUP_KINDS
+        line = 1
+        for match in (TOKENS if lines else OFFSET_TOKENS).finditer(input):
+            group = match.lastgroup
+            if group == 'SKIP':
+                continue
+            start, end = match.span()
+            if group == 'ID':
+                kind = textKinds.get(input[start:end], ID)
+            elif group == 'SYM' or group == 'OP':
+                kind = textKinds[input[start:end]]
+            elif group == 'ERR':
+                if lines:
+                    column = start - input.rfind('\n', 0, start)
+                else:
+                    line, column = tokens.position(start)
+                error = LexicalError(line, match.group(), column)
+                if errors is None:
+                    raise error
+                errors.append(error)
+                continue
+            else:
+                kind = groupKinds[group]
+                if kind == NL_KIND:
+                    line += 1
+            kinds(kind)
+            starts(start)
+            ends(end)
+        tokens.append(EOF, len(input), len(input))
+        return tokens
+
+    def scanFile(self, filename, errors=None):
+        """Scans a file into a TokenBuffer without reading it into memory.
+           The file is mapped read only and the tokens refer to offsets in
+           the mapping, so text is only copied out when a token's text is
+           asked for. Raises LexicalError on an illegal character, or
+           adds it to errors like scanBuffer."""
+        return self.scanBuffer(mapFile(filename), errors)
+
+    def scanIter(self, fileobj, chunkSize=65536):
+        """Generator that scans a file object chunkSize characters at a time
+           and yields tokens as it goes, ending with the EOF token. Each
+           chunk is scanned up to where its last token begins, so long
+           lines do not pile up, and the rest is carried over to the next
+           chunk. A comment that runs on past the chunk is carried over as
+           just its '#'. Raises LexicalError on an illegal character."""
+        line = 1
+        pending = ''
+        while True:
+            chunk = fileobj.read(chunkSize)
+            if not chunk:
+                break
+            text = pending + chunk
+            tokens, illegal, last = splitTokens(text)
+            # hold back the last token of a line that goes on, or a quote
+            # that is not closed yet
+            if (last is not None and last.start() > text.rfind('\n') and
+                (last.end() == len(text) or illegal in '"\'')):
+                cut = last.start()
+                if illegal is None and last.lastgroup != 'SKIP':
+                    tokens.pop()
+                illegal = None
+            else:
+                cut = len(text)
+            pending = text[cut:]
+            if pending[:1] == '#':
+                pending = '#'
+            for token in tokens:
+                if token is NL:
+                    line += 1
+                yield token
+            if illegal:
+                raise LexicalError(line, illegal)
+        tokens, illegal = tokenize(pending)
+        for token in tokens:
+            yield token
+        if illegal:
+            raise LexicalError(line, illegal)
+        yield ('EOF', 'EOF')
+
 if __name__ == "__main__":
     s = ice9Scanner()
     f = open(sys.argv[1])
-    tokens = s.scan(f.read())
-    for token in tokens:
-        print token
+    try:
+        for token in s.scanIter(f):
+            print token
+    except LexicalError, e:
+        print e
+        sys.exit(1)
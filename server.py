@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""Keeps ice9.py running behind a Unix socket.
+
+   python server.py [--socket PATH] [--jobs N]
+
+   Starting ice9.py costs more than parsing most sources, so editors and
+   builds can run client.py instead, which sends its arguments and source
+   here and prints what ice9.py would have. Parses run in a pool of worker
+   processes, each with the modules imported, the table engine's grammar
+   loaded and a scanner and parsers kept from one request to the next.
+
+   A request is the length of the header on a line, then the header, the
+   working directory and ice9.py arguments of the client separated by NUL
+   characters. If the arguments are fine the server answers with a line
+   saying ready and the client sends the length of the source on a line
+   and the source, which is empty with --file. The response is a line
+   with the exit status and the lengths of what ice9.py writes to stdout
+   and stderr, followed by those. It comes straight after the header when
+   the arguments end the run, such as with --help or a mistake, so the
+   client does not read its source for nothing.
+"""
+
+from scanner import ice9Scanner
+from parser import ice9Parser
+from optparse import OptionParser
+from cStringIO import StringIO
+import errno
+import ice9
+import multiprocessing
+import os
+import signal
+import socket
+import SocketServer
+import sys
+
+
+# where the server listens unless told otherwise, also known to client.py
+SOCKET = os.environ.get('ICE9_SOCKET', '/tmp/ice9-%d.sock' % os.getuid())
+
+# the scanner and parsers of a worker process, by engine, compactExpr and
+# compactTree
+scanner = None
+parsers = {}
+
+
+def setup():
+    """Readies a worker process for its first request."""
+    global scanner
+    # ^C is for the server, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import tableparser
+    tableparser.getDefault()
+    scanner = ice9Scanner()
+    # usage and errors name the program they stand in for
+    ice9.options.prog = 'ice9.py'
+
+
+def parse(args):
+    """Parses ice9.py arguments, in a worker. Returns the options and None,
+       or None and the response if they end the run."""
+    out = StringIO()
+    err = StringIO()
+    # optparse prints usage and help itself and exits, and a worker
+    # handles one request at a time, so borrowing stdout and stderr is safe
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        try:
+            opts, rest = ice9.options.parse_args(args)
+            problem = ice9.check(opts)
+            if problem:
+                ice9.options.error(problem)
+        except SystemExit, e:
+            return None, (e.code or 0, out.getvalue(), err.getvalue())
+    finally:
+        sys.stdout, sys.stderr = saved
+    return opts, None
+
+
+def work(cwd, opts, source):
+    """Runs ice9.py with the options parse gave in the directory cwd on
+       source, in a worker. Returns the exit status and what was written
+       to stdout and stderr."""
+    out = StringIO()
+    err = StringIO()
+    if opts.cache:
+        opts.cache = os.path.join(cwd, opts.cache)
+    if opts.file:
+        try:
+            source = ice9.mapFile(os.path.join(cwd, opts.file))
+        except (IOError, OSError), e:
+            return 1, '', "%s: %s\n" % (opts.file, e.strerror)
+    if opts.profile:
+        # the profiler stays on the parser it is installed on
+        p = ice9Parser(opts.engine, opts.compact_expr, opts.compact_tree)
+    else:
+        key = opts.engine, opts.compact_expr, opts.compact_tree
+        p = parsers.get(key)
+        if p is None:
+            p = parsers[key] = ice9Parser(*key)
+    try:
+        status = ice9.run(opts, source, scanner, p, out, err)
+    except RuntimeError:
+        return 1, out.getvalue(), "nested too deeply\n"
+    return status, out.getvalue(), err.getvalue()
+
+
+def readHeader(stream):
+    """Reads the header of a request from a file object. Returns the
+       working directory and arguments, or None at the end of the stream."""
+    length = stream.readline()
+    if not length:
+        return None
+    header = stream.read(int(length)).split('\0')
+    return header[0], header[1:]
+
+
+def readSource(stream):
+    """Reads the source of a request from a file object."""
+    return stream.read(int(stream.readline()))
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    """Answers the requests of one client connection."""
+
+    def handle(self):
+        """Hands each request to a worker and writes back the response."""
+        pool = self.server.pool
+        while True:
+            header = readHeader(self.rfile)
+            if header is None:
+                return
+            cwd, args = header
+            opts, response = pool.apply(parse, (args,))
+            if opts is not None:
+                self.wfile.write("ready\n")
+                self.wfile.flush()
+                source = readSource(self.rfile)
+                response = pool.apply(work, (cwd, opts, source))
+            status, out, err = response
+            self.wfile.write("%d %d %d\n" % (status, len(out), len(err)))
+            self.wfile.write(out)
+            self.wfile.write(err)
+            self.wfile.flush()
+
+
+class AlreadyRunning(Exception):
+    """Raised when another server is listening on the socket."""
+    pass
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """A Unix socket server with a thread per connection and a pool of
+       worker processes that do the parsing."""
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET, jobs=None):
+        """Constructor. Listens on path, replacing a socket left there by a
+           server that did not shut down, with jobs workers, one per CPU by
+           default. Raises AlreadyRunning if a server still listens there."""
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error, e:
+                if e.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(path)
+            else:
+                raise AlreadyRunning("already running on %s" % path)
+            finally:
+                probe.close()
+        self.pool = multiprocessing.Pool(jobs, setup)
+        SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        # the socket this server made, so it only removes its own
+        self.inode = os.stat(path).st_ino
+
+    def server_close(self):
+        """Stops the workers and removes the socket, unless another server
+           has put its own in its place."""
+        SocketServer.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        try:
+            if os.stat(self.server_address).st_ino == self.inode:
+                os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def terminate(signum, frame):
+    """Turns SIGTERM into a normal exit, so the socket is removed."""
+    sys.exit(0)
+
+if __name__ == "__main__":
+    options = OptionParser(usage="%prog [--socket PATH] [--jobs N]")
+    options.add_option("--socket", default=SOCKET, metavar="PATH",
+                       help="listen on PATH (default %default, or "
+                            "$ICE9_SOCKET)")
+    options.add_option("-j", "--jobs", type="int", metavar="N",
+                       help="parse in N processes (default one per CPU)")
+    opts, args = options.parse_args()
+    try:
+        server = Server(opts.socket, opts.jobs)
+    except AlreadyRunning, e:
+        options.error(str(e))
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
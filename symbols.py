@@ -0,0 +1,119 @@
+#!/usr/bin/python
+"""The identifiers of a parse and where they are declared and used.
+
+   A SymbolTable is filled in by the parser as it builds the tree. Each
+   distinct identifier is kept as one string, which every node for it
+   shares, and numbered in the order first seen. For each one the table
+   lists the nodes that declare it, the names of var, type, proc and fa
+   and of parameters, and the nodes that use it, ids in expressions and
+   calls and type names, so finding them takes no walk of the tree.
+
+   The name of a forward declaration has no node in the tree, so its
+   declaration is a node of its own, with the name's line and offsets.
+"""
+
+
+class SymbolTable(object):
+    """Interned identifiers, numbered from 0, with the nodes declaring and
+       using each."""
+
+    def __init__(self):
+        """Constructor. ids maps each name to its number, and names,
+           declared and used are indexed by the number."""
+        self.ids = {}
+        self.names = []
+        self.declared = []
+        self.used = []
+        # the nodes recorded, in order, while a parse is able to drop
+        # nodes again after a syntax error, otherwise None
+        self.log = None
+
+    def __len__(self):
+        """Returns the number of distinct identifiers."""
+        return len(self.names)
+
+    def __contains__(self, name):
+        """True if name was seen in the parse."""
+        return name in self.ids
+
+    def intern(self, text):
+        """Returns the one copy of the identifier text kept by the table,
+           numbering it if it is new."""
+        ident = self.ids.get(text)
+        if ident is None:
+            ident = self.ids[text] = len(self.names)
+            self.names.append(text)
+            self.declared.append([])
+            self.used.append([])
+        return self.names[ident]
+
+    def declare(self, node):
+        """Records node, whose data is an interned name, as declaring it.
+           Returns node."""
+        self.declared[self.ids[node.data]].append(node)
+        if self.log is not None:
+            self.log.append(node)
+        return node
+
+    def use(self, node):
+        """Records node, whose data is an interned name, as using it.
+           Returns node."""
+        self.used[self.ids[node.data]].append(node)
+        if self.log is not None:
+            self.log.append(node)
+        return node
+
+    def declarations(self, name):
+        """Returns the nodes declaring name, in the order parsed."""
+        ident = self.ids.get(name)
+        if ident is None:
+            return []
+        return self.declared[ident]
+
+    def uses(self, name):
+        """Returns the nodes using name, in the order parsed."""
+        ident = self.ids.get(name)
+        if ident is None:
+            return []
+        return self.used[ident]
+
+    def mark(self):
+        """Returns a mark for rollback. Needs a log."""
+        return len(self.log)
+
+    def rollback(self, mark):
+        """Forgets the nodes recorded since mark was returned."""
+        nodes = self.log[mark:]
+        del self.log[mark:]
+        self.forget(nodes)
+
+    def discard(self, root):
+        """Forgets the nodes of the subtree under root, which was dropped
+           from the tree."""
+        self.forget(root.iterPreorder())
+
+    def forget(self, nodes):
+        """Takes nodes out of the declarations and uses they are in."""
+        gone = {}
+        for node in nodes:
+            ident = self.ids.get(node.data)
+            if ident is not None:
+                gone.setdefault(ident, set()).add(id(node))
+        for ident, nodes in gone.iteritems():
+            for index in (self.declared, self.used):
+                index[ident][:] = [node for node in index[ident]
+                                   if id(node) not in nodes]
+
+    def write(self, stream):
+        """Writes a cross reference to a file-like stream, a line per name
+           in sorted order with the lines it is declared and used on."""
+        for name in sorted(self.ids):
+            ident = self.ids[name]
+            stream.write("%s declared %s used %s\n" % (
+                name, lineList(self.declared[ident]),
+                lineList(self.used[ident])))
+
+
+def lineList(nodes):
+    """Returns the lines of nodes separated by commas, or '-'."""
+    return ','.join(str(node.line) for node in nodes) or '-'
@@ -0,0 +1,378 @@
+#!/usr/bin/python
+"""A table driven ice9 parser.
+
+   TableParser predicts productions from the LL(1) table grammar.Grammar
+   builds out of grammar.txt and keeps the symbols still to be matched on
+   an explicit stack, so nesting is only limited by memory. As it goes it
+   tells a handler when a rule of grammar.txt is entered and exited and
+   when a token is matched. Rules that match no tokens, and helper rules
+   made up by the grammar for repetitions and left factoring, are not
+   reported.
+
+   The events are the calls of a Handler's methods, and events returns
+   them from a generator instead, so tools that only need to look at
+   rules and tokens never allocate a tree. TreeBuilder is the handler
+   that builds the same parse tree as ice9Parser. Rules that ice9Parser
+   wraps in a '#rule#' node get one here too, and ACTIONS says which
+   tokens add a node to the tree.
+"""
+
+from parser import SyntaxError, syntaxError
+from tokenstream import makeStream, advanceLine, NEVER
+from tokens import KINDS, EOF, NL, ID, INT, STR, IF, FI, ELSE, DO, OD, FA, \
+    AF, TO, RETURN, BREAK, EXIT, TRUE, FALSE, WRITES, WRITE, READ, LPAREN, \
+    RPAREN, LBRACK, RBRACK, ASSIGN, PLUS, MINUS, DIV, TIMES, EQ, MOD, NE, GE, \
+    LE, GT, LT, QUEST
+from tree import Node
+from symbols import SymbolTable
+import grammar
+import sys
+
+
+# the '#rule#' node each rule of grammar.txt is wrapped in, named after the
+# ice9Parser method that parses it
+WRAPPERS = {
+    'var': '#var#', 'varlist': '#varlist#', 'idlist': '#idlist#',
+    'type': '#type#', 'forward': '#forward#', 'proc': '#proc#',
+    'stms': '#Stms#', 'stm': '#Stm#', 'if': '#ifStm#',
+    'ifPrime': '#ifPrime#', 'ifPrime2': '#ifDoublePrime#', 'do': '#doStm#',
+    'fa': '#faStm#', 'typeid': '#typeid#', 'Expr': '#Expr#', 'Low': '#Low#',
+    'Med': '#Med#', 'High': '#High#', 'End': '#End#',
+    'ProcCall': '#ProcCall#',
+    }
+
+# What matching a token does to the tree, looked up by the rule the token
+# belongs to and its kind. LEAF adds a node, PUSH adds a node that the
+# following nodes go under until POP or the end of the rule, and CALL is
+# either a call or a parenthesized expression. Each action comes with the
+# data of the node, None for the token's text, and its type.
+LEAF, PUSH, POP, CALL = range(4)
+
+ACTIONS = {
+    ('varlist', LBRACK): (PUSH, '[]', None),
+    ('varlist', INT): (LEAF, None, None),
+    ('varlist', RBRACK): (POP, None, None),
+    ('idlist', ID): (LEAF, None, None),
+    ('type', ID): (LEAF, None, None),
+    ('type', LBRACK): (PUSH, '[]', None),
+    ('type', INT): (LEAF, None, None),
+    ('type', RBRACK): (POP, None, None),
+    ('proc', ID): (PUSH, None, None),
+    ('proc', RPAREN): (POP, None, None),
+    ('stm', BREAK): (LEAF, None, None),
+    ('stm', EXIT): (LEAF, None, None),
+    ('stm', RETURN): (LEAF, None, None),
+    ('stm', WRITE): (PUSH, None, None),
+    ('stm', WRITES): (PUSH, None, None),
+    ('if', IF): (PUSH, None, None),
+    ('ifPrime', FI): (LEAF, None, None),
+    ('ifPrime2', ELSE): (PUSH, None, None),
+    ('do', DO): (PUSH, None, None),
+    ('do', OD): (LEAF, '#doEnd#', None),
+    ('fa', FA): (PUSH, None, None),
+    ('fa', ID): (LEAF, None, None),
+    ('fa', ASSIGN): (LEAF, None, None),
+    ('fa', TO): (LEAF, None, None),
+    ('fa', AF): (LEAF, '#EndFa#', None),
+    ('typeid', ID): (LEAF, None, None),
+    ('High', MINUS): (PUSH, 'neg', 'OP'),
+    ('High', QUEST): (PUSH, '?', 'OP'),
+    ('End', LPAREN): (CALL, '()', None),
+    ('End', INT): (LEAF, None, 'INT'),
+    ('End', STR): (LEAF, None, 'STR'),
+    ('End', TRUE): (LEAF, None, 'bool'),
+    ('End', FALSE): (LEAF, None, 'bool'),
+    ('End', READ): (LEAF, None, 'KEY'),
+    ('End', ID): (PUSH, None, 'ID'),
+    ('lvaluePrime', LBRACK): (PUSH, '[]', None),
+    ('lvaluePrime', RBRACK): (POP, None, None),
+    ('ValueOrAssn', ASSIGN): (PUSH, None, 'OP'),
+    }
+for kind in (EQ, NE, GT, LT, GE, LE):
+    ACTIONS[('ExprPrime', kind)] = (PUSH, None, 'OP')
+for kind in (PLUS, MINUS):
+    ACTIONS[('LowPrime', kind)] = (PUSH, None, 'OP')
+for kind in (TIMES, DIV, MOD):
+    ACTIONS[('MedPrime', kind)] = (PUSH, None, 'OP')
+
+# the rules whose ids use a name rather than declare it
+USES = frozenset(['typeid', 'End'])
+
+# rules that do more than open a '#rule#' node when they start
+SPECIAL = frozenset(['program', 'ValueOrAssn'])
+
+
+class Handler(object):
+    """Receives the events of a TableParser. Each method does nothing, so
+       a handler only overrides the events it wants."""
+
+    def enter(self, rule, line):
+        """Called when a rule of grammar.txt starts."""
+        pass
+
+    def exit(self, rule, line):
+        """Called when a rule of grammar.txt is done."""
+        pass
+
+    def token(self, kind, text, line):
+        """Called when a token of the given kind and text is matched."""
+        pass
+
+    def error(self, line, token):
+        """Called with the (category, text) of the token a syntax error is
+           found at, just before SyntaxError is raised."""
+        pass
+
+
+class TreeBuilder(Handler):
+    """Builds an ice9Parser parse tree from the events of a TableParser,
+       filling in a SymbolTable as it goes."""
+
+    def __init__(self):
+        """Constructor. The tree is in root once the parse is done."""
+        self.root = None
+        self.symbols = SymbolTable()
+        # nodes that new nodes are added under, innermost last
+        self.nodes = []
+        # the rules being parsed and how many nodes were open when each
+        # rule's own nodes started
+        self.frames = []
+
+    def enter(self, rule, line):
+        """Starts a rule, wrapping it in a '#rule#' node if it has one."""
+        nodes = self.nodes
+        if rule in SPECIAL:
+            if rule == 'program':
+                self.root = Node('#PGRM#')
+                nodes.append(self.root)
+            else:
+                # an assignment goes next to the id, not under it
+                del nodes[self.frames[-1][1]:]
+        wrapper = WRAPPERS.get(rule)
+        if wrapper is not None:
+            nodes.append(nodes[-1].addChild(Node(wrapper, line)))
+        self.frames.append((rule, len(nodes)))
+
+    def exit(self, rule, line):
+        """Ends a rule, closing the nodes it left open and dropping its
+           '#rule#' node if nothing was added to it."""
+        nodes = self.nodes
+        depth = self.frames.pop()[1]
+        if rule == 'if':
+            nodes[depth].addChild(Node('#EndIf#', line))
+        if len(nodes) > depth:
+            del nodes[depth:]
+        if rule in WRAPPERS:
+            node = nodes.pop()
+            if not node.children:
+                node.remove()
+
+    def token(self, kind, text, line):
+        """Adds the node for a token, if its rule has one."""
+        rule, depth = self.frames[-1]
+        action = ACTIONS.get((rule, kind))
+        if kind == ID:
+            text = self.symbols.intern(text)
+            if action is None:
+                # the name of a forward declaration has no node in the tree
+                self.symbols.declare(Node(text, line))
+                return
+        elif action is None:
+            return
+        action, data, type = action
+        nodes = self.nodes
+        if action == POP:
+            nodes.pop()
+            return
+        if action == CALL:
+            if len(nodes) > depth:
+                # the id of a call is open
+                nodes[-1].type = 'procCall'
+                return
+            action = PUSH
+        node = nodes[-1].addChild(Node(text if data is None else data, line,
+                                       type))
+        if kind == ID:
+            if rule in USES:
+                self.symbols.use(node)
+            else:
+                self.symbols.declare(node)
+        if action == PUSH:
+            nodes.append(node)
+
+
+class TableParser(object):
+    """An LL(1) parser driven by the prediction table of a Grammar."""
+
+    def __init__(self, rules=None):
+        """Constructor that takes a grammar.Grammar, by default the one in
+           grammar.txt. Nonterminals are numbered from nonterminal up, below
+           it are token kinds, and ~rule marks the end of a rule."""
+        if rules is None:
+            rules = grammar.load()
+        self.grammar = rules
+        names = sorted(rules.productions)
+        self.names = names
+        numbers = dict((name, number) for number, name in enumerate(names))
+        self.nonterminal = len(KINDS)
+        self.start = self.nonterminal + numbers[rules.start]
+        self.rows = []
+        for name in names:
+            row = []
+            for alternative in rules.table[name]:
+                if alternative is None:
+                    row.append(None)
+                    continue
+                symbols = [self.nonterminal + numbers[symbol]
+                           if isinstance(symbol, str) else symbol
+                           for symbol in reversed(alternative)]
+                if rules.owner[name] == name and alternative:
+                    # a rule of grammar.txt, reported when it is done
+                    symbols.insert(0, ~numbers[name])
+                    row.append((name, symbols))
+                else:
+                    row.append((None, symbols))
+            self.rows.append(row)
+
+    def parse(self, tokens, handler=None):
+        """Parses a list, iterable, TokenBuffer or TokenStream of tokens and
+           returns the handler, by default a TreeBuilder. Raises
+           SyntaxError."""
+        if handler is None:
+            handler = TreeBuilder()
+        tokens = makeStream(tokens)
+        nextKind = tokens.nextKind
+        lastText = tokens.lastText
+        enter = handler.enter
+        exit = handler.exit
+        token = handler.token
+        names = self.names
+        rows = self.rows
+        NONTERMINAL = self.nonterminal
+        line = 1
+        # streams without newline tokens say where their lines start
+        breaks = tokens.lineBreaks()
+        lineEnd = NEVER if breaks is None else -1
+        kind = nextKind()
+        if tokens.pos > lineEnd:
+            line, lineEnd = advanceLine(breaks, line, tokens.pos)
+        while kind == NL:
+            kind = nextKind()
+            line += 1
+        stack = [self.start]
+        pop = stack.pop
+        extend = stack.extend
+        try:
+            while stack:
+                symbol = pop()
+                if symbol >= NONTERMINAL:
+                    entry = rows[symbol - NONTERMINAL][kind]
+                    if entry is None:
+                        raise syntaxError(tokens, line)
+                    rule, symbols = entry
+                    if rule is not None:
+                        enter(rule, line)
+                    extend(symbols)
+                elif symbol >= 0:
+                    if symbol != kind:
+                        raise syntaxError(tokens, line)
+                    token(kind, lastText(), line)
+                    kind = nextKind()
+                    if tokens.pos > lineEnd:
+                        line, lineEnd = advanceLine(breaks, line, tokens.pos)
+                    while kind == NL:
+                        kind = nextKind()
+                        line += 1
+                else:
+                    exit(names[~symbol], line)
+            if kind != EOF:
+                raise syntaxError(tokens, line)
+        except SyntaxError, e:
+            handler.error(e.line, e.token)
+            raise
+        return handler
+
+    def events(self, tokens):
+        """Generator that parses tokens like parse and yields each event as
+           a tuple of the name of the Handler method and its arguments,
+           such as ('token', kind, text, line). A syntax error is yielded
+           as an 'error' event before SyntaxError is raised. This is the
+           loop of parse again, since dispatching parse's events from here
+           slows building a tree by about a tenth."""
+        tokens = makeStream(tokens)
+        nextKind = tokens.nextKind
+        lastText = tokens.lastText
+        names = self.names
+        rows = self.rows
+        NONTERMINAL = self.nonterminal
+        line = 1
+        # streams without newline tokens say where their lines start
+        breaks = tokens.lineBreaks()
+        lineEnd = NEVER if breaks is None else -1
+        kind = nextKind()
+        if tokens.pos > lineEnd:
+            line, lineEnd = advanceLine(breaks, line, tokens.pos)
+        while kind == NL:
+            kind = nextKind()
+            line += 1
+        stack = [self.start]
+        pop = stack.pop
+        extend = stack.extend
+        while stack:
+            symbol = pop()
+            if symbol >= NONTERMINAL:
+                entry = rows[symbol - NONTERMINAL][kind]
+                if entry is None:
+                    break
+                rule, symbols = entry
+                if rule is not None:
+                    yield 'enter', rule, line
+                extend(symbols)
+            elif symbol >= 0:
+                if symbol != kind:
+                    break
+                yield 'token', kind, lastText(), line
+                kind = nextKind()
+                if tokens.pos > lineEnd:
+                    line, lineEnd = advanceLine(breaks, line, tokens.pos)
+                while kind == NL:
+                    kind = nextKind()
+                    line += 1
+            else:
+                yield 'exit', names[~symbol], line
+        else:
+            if kind == EOF:
+                return
+        yield 'error', line, tokens.last()
+        raise syntaxError(tokens, line)
+
+
+# the parser for grammar.txt, built when first needed
+default = None
+
+
+def getDefault():
+    """Returns the parser for grammar.txt."""
+    global default
+    if default is None:
+        default = TableParser()
+    return default
+
+
+def parse(tokens):
+    """Parses tokens with the grammar in grammar.txt and returns the root of
+       the parse tree. Raises SyntaxError."""
+    return getDefault().parse(tokens).root
+
+
+def events(tokens, handler=None):
+    """Parses tokens with the grammar in grammar.txt without building a
+       tree. The events go to the handler, which is returned, or without a
+       handler a generator of events is returned. Raises SyntaxError."""
+    if handler is None:
+        return getDefault().events(tokens)
+    return getDefault().parse(tokens, handler)
+
+if __name__ == "__main__":
+    from scanner import ice9Scanner
+    print parse(ice9Scanner().scan(open(sys.argv[1]).read()))
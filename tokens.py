@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+from array import array
+from bisect import bisect_left
+
+
+# Token kinds. Every keyword, symbol and operator has a kind of its own so
+# tokens can be compared as small integers. KINDS lists the (category, text)
+# of each kind, text is None where it varies from token to token.
+KINDS = [
+    ('EOF', 'EOF'), ('NL', 'NL'), ('ID', None), ('INT', None), ('STR', None),
+    ('KEY', 'if'), ('KEY', 'fi'), ('KEY', 'else'), ('KEY', 'do'),
+    ('KEY', 'od'), ('KEY', 'fa'), ('KEY', 'af'), ('KEY', 'to'),
+    ('KEY', 'proc'), ('KEY', 'end'), ('KEY', 'return'), ('KEY', 'forward'),
+    ('KEY', 'var'), ('KEY', 'type'), ('KEY', 'break'), ('KEY', 'exit'),
+    ('KEY', 'true'), ('KEY', 'false'), ('KEY', 'writes'), ('KEY', 'write'),
+    ('KEY', 'read'),
+    ('SYM', '->'), ('SYM', '('), ('SYM', ')'), ('SYM', '[]'), ('SYM', '['),
+    ('SYM', ']'), ('SYM', ';'), ('SYM', ':='), ('SYM', ':'), ('SYM', ','),
+    ('OP', '+'), ('OP', '-'), ('OP', '/'), ('OP', '*'), ('OP', '='),
+    ('OP', '%'), ('OP', '!='), ('OP', '>='), ('OP', '<='), ('OP', '>'),
+    ('OP', '<'), ('OP', '?'),
+    ]
+
+(EOF, NL, ID, INT, STR,
+ IF, FI, ELSE, DO, OD, FA, AF, TO, PROC, END, RETURN, FORWARD, VAR, TYPE,
+ BREAK, EXIT, TRUE, FALSE, WRITES, WRITE, READ,
+ ARROW, LPAREN, RPAREN, BOX, LBRACK, RBRACK, SEMI, ASSIGN, COLON, COMMA,
+ PLUS, MINUS, DIV, TIMES, EQ, MOD, NE, GE, LE, GT, LT, QUEST) = range(len(KINDS))
+
+# category of each kind, e.g. CATEGORY[PLUS] == 'OP'
+CATEGORY = [category for category, text in KINDS]
+
+# the kind of every keyword, symbol and operator, looked up by its text
+TEXT_KINDS = dict((text, kind) for kind, (category, text) in enumerate(KINDS)
+                  if category in ('KEY', 'SYM', 'OP'))
+
+# the kind of every category whose tokens do not have a fixed text
+CATEGORY_KINDS = dict((category, kind) for kind, (category, text)
+                      in enumerate(KINDS) if text is None or text == category)
+
+
+def kindOf(token):
+    """Returns the kind of a (category, text) token tuple."""
+    kind = CATEGORY_KINDS.get(token[0])
+    if kind is None:
+        return TEXT_KINDS[token[1]]
+    return kind
+
+
+class TokenBuffer(object):
+    """A compact sequence of tokens. Kinds are stored as bytes and each
+       token's start and end offsets into the source are stored as longs.
+       Token text is only sliced out of the source when it is asked for.
+       Indexing returns the same (category, text) tuples the scanner does.
+       Newlines are not tokens unless lineTokens is set, lines and columns
+       are worked out from the offsets when they are asked for."""
+
+    # whether starts and ends are plain offsets into the source
+    offsets = True
+
+    def __init__(self, source, lineTokens=False):
+        """Constructor that takes the source text the tokens refer to and
+           whether the tokens include an NL token for every newline."""
+        self.source = source
+        self.lineTokens = lineTokens
+        self.kinds = array('B')
+        self.starts = array('l')
+        self.ends = array('l')
+        # the offset of every newline and the index of the first token
+        # after each, built when first needed
+        self.newlines = None
+        self.breaks = None
+
+    def append(self, kind, start, end):
+        """Adds a token of the given kind spanning source[start:end]."""
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def kind(self, i):
+        """Returns the kind of the i-th token."""
+        return self.kinds[i]
+
+    def text(self, i):
+        """Returns the text of the i-th token."""
+        kind = self.kinds[i]
+        text = KINDS[kind][1]
+        if text is None:
+            return self.source[self.starts[i]:self.ends[i]]
+        return text
+
+    def lineIndex(self):
+        """Returns an array of the offsets of the newlines in the source."""
+        if self.newlines is None:
+            newlines = array('l')
+            append = newlines.append
+            find = self.source.find
+            offset = find('\n')
+            while offset >= 0:
+                append(offset)
+                offset = find('\n', offset + 1)
+            self.newlines = newlines
+        return self.newlines
+
+    def position(self, offset):
+        """Returns the line and column, both counted from 1, of an offset
+           into the source."""
+        newlines = self.lineIndex()
+        line = bisect_left(newlines, offset)
+        if line:
+            return line + 1, offset - newlines[line - 1]
+        return 1, offset + 1
+
+    def lineBreaks(self):
+        """Returns a list with the index of the first token after each
+           newline, so a token is on line 1 plus the number of entries not
+           above its index. None if the tokens include NL tokens."""
+        if self.lineTokens:
+            return None
+        if self.breaks is None:
+            starts = self.starts
+            self.breaks = [bisect_left(starts, offset)
+                           for offset in self.lineIndex()]
+        return self.breaks
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.kinds)
+        return CATEGORY[self.kinds[i]], self.text(i)
+
+    def __iter__(self):
+        for i in xrange(len(self.kinds)):
+            yield self[i]
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+from tokens import EOF, TokenBuffer, kindOf
+import sys
+
+
+EOF_TOKEN = ('EOF', 'EOF')
+
+# where the line of a stream without line breaks never ends
+NEVER = sys.maxint
+
+
+def advanceLine(breaks, line, pos):
+    """Returns the line of the token before the stream position pos, going
+       on from an earlier line, and the position past which the line after
+       it starts. breaks is the lineBreaks of the stream."""
+    count = len(breaks)
+    while line <= count and pos > breaks[line - 1]:
+        line += 1
+    if line <= count:
+        return line, breaks[line - 1]
+    return line, NEVER
+
+
+class TokenStream(object):
+    """A cursor over a sequence of tokens. Supports arbitrary lookahead,
+       marking and rewinding. The tokens can be a list or any iterable,
+       iterables are only pulled from as far as lookahead requires."""
+
+    # number of consumed tokens to keep around before the buffer is trimmed
+    TRIM = 4096
+
+    def __init__(self, tokens):
+        """Constructor. Lists and tuples are indexed in place, anything else
+           is read lazily into an internal buffer."""
+        if isinstance(tokens, (list, tuple)):
+            self.buffer = tokens
+            self.source = None
+        else:
+            self.buffer = []
+            self.source = iter(tokens)
+        self.pos = 0
+        self.marks = []
+        self.current = EOF_TOKEN
+
+    def fill(self, count):
+        """Make sure count tokens past the cursor are buffered. Returns
+           False if the stream ends first."""
+        need = self.pos + count - len(self.buffer)
+        if need <= 0:
+            return True
+        if self.source is None:
+            return False
+        append = self.buffer.append
+        next = self.source.next
+        try:
+            while need > 0:
+                append(next())
+                need -= 1
+        except StopIteration:
+            self.source = None
+            return False
+        return True
+
+    def peek(self, k=1):
+        """Returns the k-th upcoming token without consuming it. peek(1) is
+           the token next() would return. Past the end of the stream the
+           EOF token is returned."""
+        if self.fill(k):
+            return self.buffer[self.pos + k - 1]
+        return EOF_TOKEN
+
+    def peekKind(self, k=1):
+        """Returns the kind of the k-th upcoming token."""
+        return kindOf(self.peek(k))
+
+    def next(self):
+        """Consumes and returns the next token. Once the stream is exhausted
+           the EOF token is returned on every call."""
+        pos = self.pos
+        if pos < len(self.buffer) or self.fill(1):
+            self.pos = pos + 1
+            token = self.current = self.buffer[pos]
+            if pos >= self.TRIM and self.source is not None and not self.marks:
+                self.trim()
+            return token
+        self.current = EOF_TOKEN
+        return EOF_TOKEN
+
+    def nextKind(self):
+        """Consumes the next token and returns its kind."""
+        return kindOf(self.next())
+
+    def last(self):
+        """Returns the most recently consumed token."""
+        return self.current
+
+    def lastText(self):
+        """Returns the text of the most recently consumed token."""
+        return self.current[1]
+
+    def lastSpan(self):
+        """Returns the start and end offsets of the most recently consumed
+           token, which tuples do not have."""
+        return None, None
+
+    def position(self, offset):
+        """Returns the line and column of an offset, None for tuples."""
+        return None
+
+    def lineBreaks(self):
+        """Returns where lines start like TokenBuffer.lineBreaks, None since
+           tuples include NL tokens."""
+        return None
+
+    def atEnd(self):
+        """Returns True if there are no more tokens to consume."""
+        return not self.fill(1)
+
+    def mark(self):
+        """Remember the current position so it can be rewound to later.
+           Every mark must be matched by a rewind or a release."""
+        self.marks.append(self.pos)
+        return self.pos
+
+    def rewind(self):
+        """Return to the most recent mark and forget it."""
+        self.pos = self.marks.pop()
+        if self.pos:
+            self.current = self.buffer[self.pos - 1]
+        else:
+            self.current = EOF_TOKEN
+
+    def release(self):
+        """Forget the most recent mark without moving the cursor."""
+        self.marks.pop()
+
+    def trim(self):
+        """Drop consumed tokens from a lazily filled buffer."""
+        del self.buffer[:self.pos]
+        self.pos = 0
+
+
+class BufferStream(TokenStream):
+    """A TokenStream over a TokenBuffer. Kinds are read straight out of the
+       buffer's arrays and token text is only materialized on request."""
+
+    def __init__(self, buffer):
+        """Constructor that takes the TokenBuffer to read."""
+        self.buffer = buffer
+        self.kinds = buffer.kinds
+        # offsets that are not the buffer's to give are left out
+        if buffer.offsets:
+            self.starts = buffer.starts
+            self.ends = buffer.ends
+        else:
+            self.starts = self.ends = None
+        self.source = None
+        self.pos = 0
+        self.marks = []
+
+    def peekKind(self, k=1):
+        """Returns the kind of the k-th upcoming token."""
+        pos = self.pos + k - 1
+        if pos < len(self.kinds):
+            return self.kinds[pos]
+        return EOF
+
+    def next(self):
+        """Consumes and returns the next token as a tuple."""
+        self.nextKind()
+        return self.last()
+
+    def nextKind(self):
+        """Consumes the next token and returns its kind."""
+        pos = self.pos
+        if pos < len(self.kinds):
+            self.pos = pos + 1
+            return self.kinds[pos]
+        self.pos = len(self.kinds) + 1
+        return EOF
+
+    def last(self):
+        """Returns the most recently consumed token as a tuple."""
+        if 0 < self.pos <= len(self.kinds):
+            return self.buffer[self.pos - 1]
+        return EOF_TOKEN
+
+    def lastText(self):
+        """Returns the text of the most recently consumed token."""
+        if 0 < self.pos <= len(self.kinds):
+            return self.buffer.text(self.pos - 1)
+        return 'EOF'
+
+    def lastSpan(self):
+        """Returns the start and end offsets of the most recently consumed
+           token, the end of the source past the end of the tokens."""
+        pos = self.pos
+        if 0 < pos <= len(self.kinds):
+            if self.starts is None:
+                return None, None
+            return self.starts[pos - 1], self.ends[pos - 1]
+        end = len(self.buffer.source)
+        return end, end
+
+    def position(self, offset):
+        """Returns the line and column of an offset into the source."""
+        return self.buffer.position(offset)
+
+    def lineBreaks(self):
+        """Returns the buffer's lineBreaks."""
+        return self.buffer.lineBreaks()
+
+    def rewind(self):
+        """Return to the most recent mark and forget it."""
+        self.pos = self.marks.pop()
+
+
+def makeStream(tokens):
+    """Returns a stream over tokens, which can be a TokenStream, a
+       TokenBuffer, a list of tokens or any iterable of tokens."""
+    if isinstance(tokens, TokenStream):
+        return tokens
+    if isinstance(tokens, TokenBuffer):
+        return BufferStream(tokens)
+    return TokenStream(tokens)
+
+if __name__ == "__main__":
+    s = TokenStream(iter([('ID', 'x'), ('OP', '+'), ('INT', '2'), ('SYM', ';')]))
+    print s.peek(), s.peek(2)
+    s.mark()
+    print s.next(), s.next()
+    s.rewind()
+    while not s.atEnd():
+        print s.next()
+    print s.next()
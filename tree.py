@@ -1,39 +1,115 @@
 #!/usr/bin/env python
 
+from collections import deque
+from cStringIO import StringIO
+import json
+import weakref
+
+
+# The indexes that follow the changes the methods of Node make to trees, as
+# weak references, see query.TreeIndex, and the ids of the nodes they list
+# with the number of indexes listing each. A change is only passed on if it
+# is made to a node that is listed, so trees without an index pay for no
+# more than a lookup, and each index ignores changes to other trees.
+watchers = []
+indexed = {}
+
+
+def notify(method, *args):
+    """Calls a method of each index that is watching."""
+    for ref in watchers[:]:
+        index = ref()
+        if index is not None:
+            getattr(index, method)(*args)
+
 
 class Node(object):
-    """A node class to be used in a parse tree"""
+    """A node class to be used in a parse tree. A node only holds a weak
+       reference to its parent so trees contain no reference cycles and
+       are freed as soon as the root is dropped. Whoever builds a tree
+       has to keep a reference to its root."""
+
+    __slots__ = ('data', 'children', 'type', 'line', 'start', 'end',
+                 'parentRef', 'cursors', '__weakref__')
 
-    def __init__(self, data=None, line=1, type=None):
+    def __init__(self, data=None, line=1, type=None, start=None, end=None):
         self.data = data
         self.children = []
-        self.parent = None
+        self.parentRef = None
         self.type = type
-        self.preorderList = []
-        self.preorderCurrent = -1
-        self.postorderList = []
-        self.postorderCurrent = -1
         self.line = line
+        # the offsets in the source of the token the node stands for, None
+        # if it stands for no token in particular
+        self.start = start
+        self.end = end
+        # traversal cursors, only created when getPreorderNode or
+        # getPostorderNode is used
+        self.cursors = None
+
+    def getParent(self):
+        """Returns the parent node, or None for a root."""
+        if self.parentRef is None:
+            return None
+        return self.parentRef()
+
+    def setParent(self, node):
+        """Sets the parent node."""
+        if node is None:
+            self.parentRef = None
+        else:
+            self.parentRef = weakref.ref(node)
+
+    parent = property(getParent, setParent)
+
+    def __getstate__(self):
+        """Pickles the node without its parent link or cursors."""
+        return (self.data, self.children, self.type, self.line, self.start,
+                self.end)
+
+    def __setstate__(self, state):
+        """Restores a pickled node and the parent links of its children."""
+        (self.data, self.children, self.type, self.line, self.start,
+         self.end) = state
+        self.parentRef = None
+        self.cursors = None
+        for child in self.children:
+            child.parentRef = weakref.ref(self)
+
+    def span(self):
+        """Returns the start and end offsets in the source of the node's
+           own token and the tokens of its subtree, or None if none of them
+           are known."""
+        starts = [node.start for node in self.iterPreorder()
+                  if node.start is not None]
+        if not starts:
+            return None
+        return min(starts), max(node.end for node in self.iterPreorder()
+                                if node.end is not None)
 
     def addChild(self, node):
         """Add a child node to the current node."""
         self.children.append(node)
         node.parent = self
+        if indexed and id(self) in indexed:
+            notify('added', node)
         return node
 
     def addParent(self, node):
         """Replace the parent node of this node with another node.
-           Make the old parent node a parent of the newly added node."""
+           Make the old parent node a parent of the newly added node,
+           which takes this node's place among its siblings."""
         if self.parent == None:
             self.parent = node
             node.children.append(self)
         else:
             oldParent = self.parent
+            pos = oldParent.children.index(self)
             self.parent = node
             node.parent = oldParent
             node.children.append(self)
-            oldParent.children.remove(self)
-            oldParent.children.append(node)
+            oldParent.children[pos] = node
+        if indexed and id(self) in indexed:
+            notify('added', node)
         return node
 
     def inPlaceRemove(self):
@@ -47,59 +123,209 @@ class Node(object):
                 self.children[0].parent = self.parent
             else:
                 self.children[0].parent = None
+            if indexed and id(self) in indexed:
+                notify('replaced', self, self.children[0])
 
     def remove(self):
         """Deletes a node and it's subtree"""
-        self.parent.children.remove(self)
+        children = self.parent.children
+        # the parser takes back the node it added last, so look there first
+        if children and children[-1] is self:
+            children.pop()
+        else:
+            children.remove(self)
+        if indexed and id(self) in indexed:
+            notify('removed', self)
         return self
 
-    def preorder(self, root=None):
-        """Recursive method to create a preorder list of the node's
-           subtree."""
-        if not root:
-            root = self
-        root.preorderList.append(self)
+    def iterPreorder(self, predicate=None, prune=None):
+        """Generator over the node's subtree in preorder. Only nodes for
+           which predicate returns true are yielded, and the children of
+           nodes for which prune returns true are skipped. Uses an explicit
+           stack, so extra memory is proportional to the tree's depth and
+           the tree can be as deep as it likes. Children are read as the
+           traversal reaches them, so a new traversal always sees the
+           current shape of the tree."""
+        stack = [iter((self,))]
+        while stack:
+            for node in stack[-1]:
+                if predicate is None or predicate(node):
+                    yield node
+                if node.children and (prune is None or not prune(node)):
+                    stack.append(iter(node.children))
+                break
+            else:
+                stack.pop()
+
+    def iterPostorder(self, predicate=None, prune=None):
+        """Generator over the node's subtree in postorder. Takes the same
+           arguments as iterPreorder and also uses an explicit stack."""
+        def children(node):
+            if prune is not None and prune(node):
+                return iter(())
+            return iter(node.children)
+        stack = [(self, children(self))]
+        while stack:
+            node, rest = stack[-1]
+            for child in rest:
+                stack.append((child, children(child)))
+                break
+            else:
+                stack.pop()
+                if predicate is None or predicate(node):
+                    yield node
 
-        for child in self.children:
-            child.preorder(root)
+    def iterLevelorder(self, predicate=None, prune=None):
+        """Generator over the node's subtree in breadth first order. Takes
+           the same arguments as iterPreorder. The queue holds one level of
+           the tree at a time, so memory grows with the tree's width
+           rather than its depth."""
+        queue = deque((self,))
+        while queue:
+            node = queue.popleft()
+            if predicate is None or predicate(node):
+                yield node
+            if node.children and (prune is None or not prune(node)):
+                queue.extend(node.children)
+
+    def preorder(self):
+        """Returns a preorder list of the node's subtree."""
+        return list(self.iterPreorder())
+
+    def nextCursorNode(self, name, traversal):
+        """Advances the named traversal cursor and returns its next node, or
+           None once the traversal is finished. The cursor is a generator
+           created by calling traversal the first time."""
+        if self.cursors is None:
+            self.cursors = {}
+        cursor = self.cursors.get(name)
+        if cursor is None:
+            cursor = self.cursors[name] = traversal()
+        return next(cursor, None)
 
     def getPreorderNode(self):
         """Returns the next node of a preorder traversal of the tree."""
-        if not self.preorderList:
-            self.preorder()
-        self.preorderCurrent += 1
-        if self.preorderCurrent >= len(self.preorderList):
-            return None
-        return self.preorderList[self.preorderCurrent]
+        return self.nextCursorNode('preorder', self.iterPreorder)
 
-    def postorder(self, root=None):
-        """Recursive method to create postorder list of node's subtree."""
-        if not root:
-            root = self
-        for child in self.children:
-            child.postorder(root)
-
-        root.postorderList.append(self)
+    def postorder(self):
+        """Returns a postorder list of the node's subtree."""
+        return list(self.iterPostorder())
 
     def getPostorderNode(self):
         """Returns the next node of a postorder traversal of the tree."""
-        if not self.postorderList:
-            self.postorder()
-        self.postorderCurrent += 1
-        if self.postorderCurrent >= len(self.postorderList):
-            return None
-        return self.postorderList[self.postorderCurrent]
+        return self.nextCursorNode('postorder', self.iterPostorder)
+
+    def walk(self, maxDepth=None, maxNodes=None):
+        """Generator of (event, node, depth) tuples describing the node's
+           subtree in document order. ENTER and EXIT bracket every node.
+           If the subtree goes deeper than maxDepth or has more than
+           maxNodes nodes, a single CUT event stands in for the children
+           that are left out of each node."""
+        if maxNodes is not None and maxNodes < 1:
+            yield CUT, self, 0
+            return
+        count = 1
+        yield ENTER, self, 0
+        stack = [(self, iter(self.children))]
+        while stack:
+            node, children = stack[-1]
+            depth = len(stack)
+            for child in children:
+                if (maxDepth is not None and depth > maxDepth) or \
+                   (maxNodes is not None and count >= maxNodes):
+                    yield CUT, child, depth
+                    # skip the remaining siblings
+                    stack[-1] = (node, iter(()))
+                    break
+                count += 1
+                yield ENTER, child, depth
+                stack.append((child, iter(child.children)))
+                break
+            else:
+                stack.pop()
+                yield EXIT, node, depth - 1
+
+    def write(self, stream, format='tree', maxDepth=None, maxNodes=None):
+        """Writes the node's subtree to a file-like stream without building
+           the whole text in memory. The formats are 'tree', the indented
+           form printed by str(), 'sexp', a one line S-expression, and
+           'jsonl', one JSON object per node in preorder. maxDepth and
+           maxNodes cut the output short, see walk."""
+        writer = WRITERS[format]
+        pieces = []
+        for piece in writer(self.walk(maxDepth, maxNodes)):
+            pieces.append(piece)
+            if len(pieces) >= 512:
+                stream.write(''.join(pieces))
+                pieces = []
+        stream.write(''.join(pieces))
 
-    def __str__(self, space=0):
+    def __str__(self):
         """Returns a string representation of the node and its subtree."""
-        space += 1
-        alldata = '(' + self.data + ')'
-        for child in self.children:
-            linestr = ''
-            for i in range(space):
-                linestr += ' '
-            alldata += '\n' + str(linestr) + child.__str__(space)
-        return alldata
+        out = StringIO()
+        self.write(out)
+        return out.getvalue()
+
+
+# events generated by Node.walk
+ENTER, EXIT, CUT = range(3)
+
+
+def treeFormat(events):
+    """Yields the indented text of a walk, one node per line."""
+    indents = ['']
+    for event, node, depth in events:
+        if event == ENTER:
+            while depth >= len(indents):
+                indents.append('\n' + ' ' * len(indents))
+            yield '%s(%s)' % (indents[depth], node.data)
+        elif event == CUT:
+            yield '\n' + ' ' * depth + '...'
+
+
+def atom(data):
+    """Returns data as an S-expression atom, quoted if it has to be."""
+    data = str(data)
+    if not data or any(c in data for c in ' \t\n()"\';'):
+        return '"' + data.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return data
+
+
+def sexpFormat(events):
+    """Yields the S-expression text of a walk."""
+    for event, node, depth in events:
+        if event == ENTER:
+            if depth:
+                yield ' '
+            yield '(' + atom(node.data)
+        elif event == EXIT:
+            yield ')'
+        else:
+            yield ' ...'
+    yield '\n'
+
+
+def jsonlFormat(events):
+    """Yields one JSON object per line for every node of a walk. Nodes are
+       numbered in preorder and refer to their parent's number."""
+    ids = []
+    count = 0
+    for event, node, depth in events:
+        if event == ENTER:
+            parent = ids[-1] if ids else None
+            ids.append(count)
+            yield json.dumps({'id': count, 'parent': parent, 'depth': depth,
+                              'data': node.data, 'type': node.type,
+                              'line': node.line}) + '\n'
+            count += 1
+        elif event == EXIT:
+            ids.pop()
+        else:
+            yield json.dumps({'cut': True, 'parent': ids[-1] if ids else None,
+                              'depth': depth}) + '\n'
+
+
+WRITERS = {'tree': treeFormat, 'sexp': sexpFormat, 'jsonl': jsonlFormat}
 
 if __name__ == "__main__":
     root = Node("a")
@@ -158,3 +384,9 @@ if __name__ == "__main__":
     while currentNode:
         print currentNode.data
         currentNode = root.getPostorderNode()
+
+    print '*' * 10
+    print 'a level order traversal skipping the leaves under d'
+    print '*' * 10
+    for node in root.iterLevelorder(prune=lambda node: node.data == 'd'):
+        print node.data